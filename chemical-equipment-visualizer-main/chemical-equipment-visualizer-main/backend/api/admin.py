@@ -1,8 +1,69 @@
 from django.contrib import admin
-from .models import Dataset
+from django.template.defaultfilters import filesizeformat
+from .models import Dataset, IngestionJob, UploadTiming
+from . import tracing
+
+# Uploads summed up above the slowest uploads list
+SLOWEST_UPLOADS = 100
 
 @admin.register(Dataset)
 class DatasetAdmin(admin.ModelAdmin):
-    list_display = ['id', 'filename', 'upload_date']
+    list_display = ['id', 'filename', 'upload_date', 'upload_seconds']
     list_filter = ['upload_date']
-    search_fields = ['filename']
\ No newline at end of file
+    search_fields = ['filename']
+
+def stage_column(name):
+    """A list_display column with the wall time of one stage"""
+    def column(obj):
+        stage = obj.timing.get('stages', {}).get(name)
+        return f"{stage['wall']:.3f}" if stage else '-'
+    column.short_description = name
+    return column
+
+@admin.register(UploadTiming)
+class UploadTimingAdmin(admin.ModelAdmin):
+    """Traced uploads, slowest first, with where their time went"""
+    list_display = (
+        ['filename', 'upload_date', 'rows', 'upload_seconds']
+        + [stage_column(name) for name in tracing.STAGES]
+        + ['peak_memory']
+    )
+    list_filter = ['upload_date']
+    search_fields = ['filename']
+    ordering = ['-upload_seconds']
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).filter(upload_seconds__isnull=False)
+    
+    @admin.display(description='rows')
+    def rows(self, obj):
+        return obj.summary.get('total_count')
+    
+    @admin.display(description='peak memory')
+    def peak_memory(self, obj):
+        peak = obj.timing.get('peak_memory')
+        return '-' if peak is None else filesizeformat(peak)
+    
+    def changelist_view(self, request, extra_context=None):
+        response = super().changelist_view(request, extra_context)
+        changelist = getattr(response, 'context_data', {}).get('cl')
+        if changelist is not None:
+            # Stage totals of the slowest uploads matching the filters
+            timings = changelist.queryset.order_by('-upload_seconds').values_list('timing', flat=True)
+            timings = list(timings[:SLOWEST_UPLOADS])
+            response.context_data['stage_summary'] = {
+                'uploads': len(timings), 'stages': tracing.summarize(timings),
+            }
+        return response
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+
+@admin.register(IngestionJob)
+class IngestionJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'filename', 'state', 'rows_processed', 'created_date']
+    list_filter = ['state', 'created_date']
+    search_fields = ['filename']
@@ -1,5 +1,17 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete
 
 
 class ApiConfig(AppConfig):
     name = 'api'
+
+    def ready(self):
+        from .db import configure_sqlite
+        # Apply SQLite pragmas (WAL, busy timeout) to every new connection
+        connection_created.connect(configure_sqlite)
+
+        from .models import Dataset
+        from .reports import evict_deleted_dataset
+        # Cached PDFs of a deleted dataset, however it was deleted
+        post_delete.connect(evict_deleted_dataset, sender=Dataset)
@@ -0,0 +1,211 @@
+"""
+Bulk uploads of many CSV files at once.
+
+Files (sent as several multipart parts and/or inside ZIP archives) are
+spooled to disk and parsed and summarized in parallel on a process pool,
+which sidesteps the GIL for the pandas work. Once every file is parsed,
+the parent process stores the results in a single short transaction,
+each file in its own savepoint, and reports the outcome per file.
+
+ZIP members are only extracted within the BULK_ZIP_* limits on their
+number, total uncompressed size and compression ratio, so a small
+archive can't fill the spool directory (a "zip bomb").
+"""
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.db import transaction
+
+from .csvio import get_chunk_size, parse_csv_file
+from .ingest import store_parsed
+from .models import Dataset
+from .validation import InvalidCellsError
+
+DEFAULT_ZIP_MAX_MEMBERS = 1000
+DEFAULT_ZIP_MAX_BYTES = 1024 * 1024 * 1024
+DEFAULT_ZIP_MAX_RATIO = 100
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class ArchiveLimitError(ValueError):
+    """Raised when the ZIP archives of an upload exceed the configured limits"""
+
+
+def get_pool():
+    """Return the process-wide parsing pool, creating it on first use
+
+    Workers are spawned rather than forked: the web process runs threads,
+    and csvio doesn't need Django's app registry.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=getattr(settings, 'BULK_UPLOAD_WORKERS', None) or os.cpu_count(),
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        return _pool
+
+
+def _discard_pool(pool):
+    """Drop a pool that lost a worker, the next get_pool() starts a new one"""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _submit_all(entries, chunk_size, skip_invalid, retry=True):
+    pool = get_pool()
+    try:
+        return pool, {
+            index: pool.submit(parse_csv_file, entry[1], chunk_size, skip_invalid)
+            for index, entry in enumerate(entries) if isinstance(entry, tuple)
+        }
+    except BrokenProcessPool:
+        # A worker died during an earlier upload (e.g. out of memory)
+        _discard_pool(pool)
+        if not retry:
+            raise
+        return _submit_all(entries, chunk_size, skip_invalid, retry=False)
+
+
+def _spool(source, directory):
+    with tempfile.NamedTemporaryFile(dir=directory, suffix='.csv', delete=False) as spool:
+        shutil.copyfileobj(source, spool, 1 << 20)
+    return spool.name
+
+
+def result(filename, status, dataset=None, error=None, validation=None):
+    return {
+        'filename': filename,
+        'status': status,
+        'dataset': dataset.pk if dataset else None,
+        'rows': dataset.summary['total_count'] if dataset else None,
+        'error': error,
+        'validation': validation,
+    }
+
+
+class ArchiveLimits:
+    """Running totals of the ZIP members of one upload, against the settings"""
+
+    def __init__(self):
+        self.max_members = getattr(settings, 'BULK_ZIP_MAX_MEMBERS', DEFAULT_ZIP_MAX_MEMBERS)
+        self.max_bytes = getattr(settings, 'BULK_ZIP_MAX_BYTES', DEFAULT_ZIP_MAX_BYTES)
+        self.max_ratio = getattr(settings, 'BULK_ZIP_MAX_RATIO', DEFAULT_ZIP_MAX_RATIO)
+        self.members = 0
+        self.bytes = 0
+
+    def check(self, member):
+        """Count a member, raising ArchiveLimitError if it exceeds a limit
+
+        Sizes are those declared in the archive; zipfile doesn't extract
+        more than the declared size, so they can be trusted.
+        """
+        self.members += 1
+        if self.members > self.max_members:
+            raise ArchiveLimitError(f'ZIP archives may contain at most {self.max_members} files')
+        self.bytes += member.file_size
+        if self.bytes > self.max_bytes:
+            raise ArchiveLimitError(
+                f'ZIP archives may contain at most {self.max_bytes} bytes uncompressed'
+            )
+        if member.file_size > self.max_ratio * max(member.compress_size, 1):
+            raise ArchiveLimitError(
+                f"'{member.filename}' is compressed more than {self.max_ratio}:1"
+            )
+
+
+def collect_files(uploaded_files, directory):
+    """Spool every CSV, including the members of ZIP archives, into directory
+
+    Returns a list with a (name, path) pair per file to parse and a
+    result dict in place of entries that can't be parsed, in upload order.
+    Raises ArchiveLimitError if the archives exceed the BULK_ZIP_* limits.
+    """
+    entries = []
+    limits = ArchiveLimits()
+    for uploaded_file in uploaded_files:
+        name = uploaded_file.name
+        if name.lower().endswith('.zip'):
+            try:
+                with zipfile.ZipFile(uploaded_file) as archive:
+                    members = [member for member in archive.infolist() if not member.is_dir()]
+                    for member in members:
+                        limits.check(member)
+                    for member in members:
+                        if not member.filename.lower().endswith('.csv'):
+                            entries.append(result(member.filename, 'skipped', error='Not a CSV file'))
+                            continue
+                        with archive.open(member) as source:
+                            entries.append((os.path.basename(member.filename), _spool(source, directory)))
+            except zipfile.BadZipFile:
+                entries.append(result(name, 'failed', error='Not a valid ZIP archive'))
+        elif name.endswith('.csv'):
+            entries.append((name, _spool(uploaded_file, directory)))
+        else:
+            entries.append(result(name, 'skipped', error='File must be a CSV or ZIP archive'))
+    return entries
+
+
+def ingest_bulk(uploaded_files, user=None, skip_invalid=False):
+    """Parse uploaded CSV/ZIP files in parallel and store them together
+
+    skip_invalid drops rows with flagged cells instead of failing the file.
+
+    Returns one result per file, in upload order, with status 'created',
+    'duplicate', 'failed' or 'skipped'. Raises ArchiveLimitError, before
+    anything is parsed, if the ZIP archives exceed the configured limits.
+    """
+    directory = tempfile.mkdtemp(prefix='bulk-', dir=getattr(settings, 'INGEST_SPOOL_DIR', None))
+    try:
+        entries = collect_files(uploaded_files, directory)
+        pool, futures = _submit_all(entries, get_chunk_size(), skip_invalid)
+
+        # Waited for outside any transaction: an open write transaction
+        # would block every other writer while the pool is still parsing
+        results = list(entries)
+        parsed_files = []
+        for index, future in futures.items():
+            name = entries[index][0]
+            try:
+                parsed_files.append((index, name, future.result()))
+            except BrokenProcessPool as e:
+                _discard_pool(pool)
+                results[index] = result(name, 'failed', error=str(e))
+            except InvalidCellsError as e:
+                results[index] = result(name, 'failed', error=str(e), validation=e.report)
+            except Exception as e:
+                results[index] = result(name, 'failed', error=str(e))
+
+        with transaction.atomic():
+            for index, name, parsed in parsed_files:
+                # Also catches the same file twice in one upload
+                existing = Dataset.objects.filter(
+                    content_hash=parsed['content_hash'], user=user
+                ).first()
+                if existing is not None:
+                    results[index] = result(name, 'duplicate', existing)
+                    continue
+
+                try:
+                    dataset = store_parsed(parsed, name, user=user)
+                except Exception as e:
+                    results[index] = result(name, 'failed', error=str(e))
+                else:
+                    results[index] = result(name, 'created', dataset, validation=dataset.validation)
+
+        return results
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
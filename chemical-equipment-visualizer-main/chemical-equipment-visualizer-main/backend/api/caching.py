@@ -0,0 +1,122 @@
+"""
+Cache of serialized dataset responses.
+
+The dataset list, dataset metadata (?include_data=0), summaries and
+histograms are kept in a Django cache (settings.DATASET_CACHE_ALIAS,
+locmem by default). The serialized data is cached rather than the rendered response, so
+content negotiation still happens per request.
+
+Every cache key embeds a generation token: one for the list and one per
+dataset (a comparison embeds the tokens of both datasets). Invalidation deletes the token, the next reader draws a new one
+and the old entries are never read again. A reader that queried the
+database just before a write committed stores its result under the old
+token, so it can't bring a stale entry back. Tokens are random rather than
+counters, which keeps this safe even when the backend evicts them.
+
+Hit and miss counters are kept per process, see get_stats().
+"""
+import threading
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+DEFAULT_TIMEOUT = 300
+KEY_PREFIX = 'datasets'
+LIST_GENERATION = f'{KEY_PREFIX}:list:generation'
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def get_cache():
+    return caches[getattr(settings, 'DATASET_CACHE_ALIAS', 'default')]
+
+
+def _dataset_generation(dataset_id):
+    return f'{KEY_PREFIX}:{dataset_id}:generation'
+
+
+def _generation(cache, key):
+    token = cache.get(key)
+    if token is None:
+        token = uuid.uuid4().hex
+        # Another reader may have drawn one first, theirs wins
+        if not cache.add(key, token, timeout=None):
+            token = cache.get(key) or token
+    return token
+
+
+def _record(kind, outcome):
+    with _stats_lock:
+        counters = _stats.setdefault(kind, {'hits': 0, 'misses': 0})
+        counters[outcome] += 1
+
+
+def _cached(kind, generation_keys, key, build):
+    cache = get_cache()
+    generations = ':'.join(_generation(cache, generation_key) for generation_key in generation_keys)
+    key = f'{KEY_PREFIX}:{kind}:{key}:{generations}'
+
+    value = cache.get(key)
+    if value is not None:
+        _record(kind, 'hits')
+        return value
+
+    _record(kind, 'misses')
+    value = build()
+    cache.set(key, value, getattr(settings, 'DATASET_CACHE_TIMEOUT', DEFAULT_TIMEOUT))
+    return value
+
+
+def cached_list(build, scope='all'):
+    """Serialized dataset list, scope separates lists of different users"""
+    return _cached('list', [LIST_GENERATION], scope, build)
+
+
+def cached_metadata(dataset_id, build):
+    """Serialized dataset without its rows"""
+    return _cached('metadata', [_dataset_generation(dataset_id)], dataset_id, build)
+
+
+def cached_summary(dataset_id, build):
+    """Summary and per-type statistics of a dataset"""
+    return _cached('summary', [_dataset_generation(dataset_id)], dataset_id, build)
+
+
+def cached_histogram(dataset_id, params, build):
+    """Binned counts of a dataset, params is the parsed parameter set"""
+    key = ':'.join(f'{name}={params[name]}' for name in sorted(params))
+    return _cached('histogram', [_dataset_generation(dataset_id)], f'{dataset_id}:{key}', build)
+
+
+def cached_comparison(dataset_a_id, dataset_b_id, key, build):
+    """A page of the comparison of two datasets, key identifies the page"""
+    generation_keys = [_dataset_generation(dataset_a_id), _dataset_generation(dataset_b_id)]
+    return _cached('comparison', generation_keys, f'{dataset_a_id}:{dataset_b_id}:{key}', build)
+
+
+def invalidate_datasets(dataset_ids=()):
+    """Drop cached responses of the list and the given datasets, and their
+    decoded frames, once the current transaction commits"""
+    from .frames import invalidate_frames  # frames imports ingest, which imports this module
+    keys = [LIST_GENERATION] + [_dataset_generation(pk) for pk in dataset_ids]
+    transaction.on_commit(lambda: get_cache().delete_many(keys))
+    transaction.on_commit(lambda: invalidate_frames(dataset_ids))
+
+
+def get_stats():
+    """Hit/miss counters of this process, per kind of response"""
+    with _stats_lock:
+        kinds = {kind: dict(counters) for kind, counters in _stats.items()}
+
+    hits = sum(counters['hits'] for counters in kinds.values())
+    misses = sum(counters['misses'] for counters in kinds.values())
+    return {
+        'backend': type(get_cache()).__name__,
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': hits / (hits + misses) if hits + misses else None,
+        'kinds': kinds,
+    }
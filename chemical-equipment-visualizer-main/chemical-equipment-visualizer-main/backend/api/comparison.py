@@ -0,0 +1,204 @@
+"""
+Comparison of two datasets joined on Equipment Name.
+
+Dataset a is the baseline and b the newer export. Both are taken from the
+frame cache (see frames.py) and joined on the equipment name with a hash join, then the
+b - a deltas of every numeric column are computed for all rows at once. Each equipment gets a status:
+
+    added      only in b
+    removed    only in a
+    changed    in both, with a different type or value (blank equals blank)
+    unchanged  in both, with the same type and values
+
+Names should be unique within a dataset. When a name repeats, its last row
+is used and the repeats are counted in 'duplicates'; rows without a name
+can't be matched and are counted in 'unnamed'.
+
+Supported parameters:
+    a=<id>, b=<id>       datasets to compare
+    status=<s1>,<s2>     only list equipment with these statuses
+    sort=<column>        list the largest absolute deltas of column first
+    top=<n>              number of largest movers per column (default 10)
+"""
+import numpy as np
+import pandas as pd
+
+from .frames import get_frame
+from .models import EquipmentRecord
+from .stats import NUMERIC_COLUMNS
+
+NAME_COLUMN = 'Equipment Name'
+STATUSES = ('added', 'removed', 'changed', 'unchanged')
+DEFAULT_TOP = 10
+MAX_TOP = 100
+
+
+class CompareError(ValueError):
+    """Raised for malformed comparison parameters"""
+
+
+def _parse_id(params, key):
+    value = params.get(key)
+    if not value:
+        raise CompareError(f"'{key}' is required")
+    try:
+        return int(value)
+    except ValueError:
+        raise CompareError(f"'{key}' must be a dataset id")
+
+
+def parse_params(params):
+    """Validate query params into {'a', 'b', 'status', 'sort', 'top'}"""
+    status = tuple(params.get('status', '').split(',')) if params.get('status') else STATUSES
+    unknown = [value for value in status if value not in STATUSES]
+    if unknown:
+        raise CompareError(f"Unknown status '{unknown[0]}', use {', '.join(STATUSES)}")
+
+    sort = params.get('sort') or None
+    if sort is not None:
+        fields = {field: column for column, field in EquipmentRecord.COLUMN_FIELDS.items()}
+        sort = fields.get(sort, sort)
+        if sort not in NUMERIC_COLUMNS:
+            raise CompareError(f"Cannot sort by '{params['sort']}', use one of {', '.join(NUMERIC_COLUMNS)}")
+
+    try:
+        top = int(params.get('top', DEFAULT_TOP))
+    except ValueError:
+        raise CompareError("'top' must be an integer")
+    if not 0 <= top <= MAX_TOP:
+        raise CompareError(f"'top' must be between 0 and {MAX_TOP}")
+
+    return {
+        'a': _parse_id(params, 'a'), 'b': _parse_id(params, 'b'),
+        'status': status, 'sort': sort, 'top': top,
+    }
+
+
+def _last_rows(codes, size):
+    """Row of the last occurrence of every name code, -1 where absent"""
+    rows = np.full(size, -1, dtype=np.int64)
+    np.maximum.at(rows, codes, np.arange(len(codes)))
+    return rows
+
+
+def _take(frame, column, rows):
+    values = frame[column].to_numpy(dtype='float64' if column in NUMERIC_COLUMNS else object)
+    if not len(values):
+        # Nothing named on this side, every equipment is absent
+        return np.full(len(rows), np.nan, dtype=values.dtype)
+    taken = values[rows]
+    taken[rows < 0] = np.nan
+    return taken
+
+
+def compare_frames(frame_a, frame_b):
+    """Join two record frames on name, returns (comparison, counts)
+
+    The comparison frame has one row per equipment, in the order of a
+    followed by the equipment added in b, with status, Type_a/Type_b and
+    <column>_a, <column>_b and <column>_delta for the numeric columns.
+    """
+    named_a = frame_a[frame_a[NAME_COLUMN] != '']
+    named_b = frame_b[frame_b[NAME_COLUMN] != '']
+
+    # Factorizing both name columns together hashes every name once and
+    # numbers them in order of appearance
+    codes, names = pd.factorize(np.concatenate([
+        named_a[NAME_COLUMN].to_numpy(dtype=object), named_b[NAME_COLUMN].to_numpy(dtype=object)
+    ]))
+    rows_a = _last_rows(codes[:len(named_a)], len(names))
+    rows_b = _last_rows(codes[len(named_a):], len(names))
+    in_a, in_b = rows_a >= 0, rows_b >= 0
+    both = in_a & in_b
+
+    comparison = {NAME_COLUMN: names}
+    type_a = comparison['Type_a'] = _take(named_a, 'Type', rows_a)
+    type_b = comparison['Type_b'] = _take(named_b, 'Type', rows_b)
+    changed = both & ~((type_a == type_b) | (pd.isna(type_a) & pd.isna(type_b)))
+
+    for column in NUMERIC_COLUMNS:
+        values_a = comparison[f'{column}_a'] = _take(named_a, column, rows_a)
+        values_b = comparison[f'{column}_b'] = _take(named_b, column, rows_b)
+        comparison[f'{column}_delta'] = values_b - values_a
+        same = (values_a == values_b) | (np.isnan(values_a) & np.isnan(values_b))
+        changed |= both & ~same
+
+    status = np.select([~in_a, ~in_b, changed], STATUSES[:3], STATUSES[3])
+    comparison = pd.DataFrame(comparison)
+    comparison.insert(1, 'status', pd.Categorical(status, categories=STATUSES))
+
+    counts = comparison['status'].value_counts().to_dict()
+    counts = {
+        **{value: int(counts.get(value, 0)) for value in STATUSES},
+        'duplicates': {
+            'a': len(named_a) - int(np.count_nonzero(in_a)),
+            'b': len(named_b) - int(np.count_nonzero(in_b)),
+        },
+        'unnamed': {'a': len(frame_a) - len(named_a), 'b': len(frame_b) - len(named_b)},
+    }
+    return comparison, counts
+
+
+def compare_datasets(dataset_a, dataset_b):
+    """Compare the stored rows of two datasets, see compare_frames"""
+    return compare_frames(get_frame(dataset_a), get_frame(dataset_b))
+
+
+def largest_movers(comparison, top=DEFAULT_TOP):
+    """Equipment with the largest absolute deltas, per numeric column"""
+    movers = {}
+    for column in NUMERIC_COLUMNS:
+        magnitude = comparison[f'{column}_delta'].abs()
+        # NaN deltas (blank on one side) never make the list
+        index = magnitude[magnitude > 0].nlargest(top).index
+        movers[column] = [
+            {NAME_COLUMN: row[NAME_COLUMN], **_values(row, column)}
+            for row in _records(comparison.loc[index])
+        ]
+    return movers
+
+
+def select_rows(comparison, status=STATUSES, sort=None):
+    """Rows with the given statuses, in join order or by absolute delta of sort"""
+    if set(status) != set(STATUSES):
+        comparison = comparison[comparison['status'].isin(status)]
+    if sort:
+        order = np.argsort(-comparison[f'{sort}_delta'].abs().to_numpy(), kind='stable')
+        # NaN sorts last
+        comparison = comparison.iloc[order]
+    return ComparisonRows(comparison)
+
+
+class ComparisonRows:
+    """Sequence of comparison rows for paginators, converted per slice"""
+
+    def __init__(self, comparison):
+        self.comparison = comparison
+
+    def __len__(self):
+        return len(self.comparison)
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            raise TypeError('ComparisonRows only supports slicing')
+        return [
+            {
+                NAME_COLUMN: row[NAME_COLUMN],
+                'status': row['status'],
+                'Type': {'a': row['Type_a'], 'b': row['Type_b']},
+                **{column: _values(row, column) for column in NUMERIC_COLUMNS},
+            }
+            for row in _records(self.comparison.iloc[index])
+        ]
+
+
+def _records(frame):
+    # NaN -> None, for JSON
+    frame = frame.astype(object)
+    return frame.where(frame.notna(), None).to_dict('records')
+
+
+def _values(row, column):
+    return {
+        'a': row[f'{column}_a'], 'b': row[f'{column}_b'], 'delta': row[f'{column}_delta']
+    }
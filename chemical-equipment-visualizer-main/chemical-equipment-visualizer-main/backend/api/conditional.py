@@ -0,0 +1,68 @@
+"""
+Conditional GET for dataset resources.
+
+A dataset only changes when rows are appended, which bumps updated_date,
+so (id, updated_date) identifies its version. The validators are read
+with a single-column query before the view runs, and a matching
+If-None-Match / If-Modified-Since is answered with 304 without loading
+the summary, statistics or rows.
+
+The ETag is strong and also covers the request's query string and the
+negotiated media type, so ?include_data=0, a rows window or a MessagePack
+body each get their own tag.
+"""
+import functools
+import hashlib
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+
+def dataset_validators(view, request, extra=''):
+    """Return (etag, last_modified) for the view's dataset, or None if missing"""
+    updated = (
+        view.get_queryset().filter(pk=view.kwargs['pk'])
+        .values_list('updated_date', flat=True).first()
+    )
+    if updated is None:
+        return None
+
+    version = ':'.join([
+        str(view.kwargs['pk']), updated.isoformat(), view.action,
+        request.query_params.urlencode(), request.accepted_media_type or '', str(extra),
+    ])
+    etag = '"%s"' % hashlib.sha256(version.encode()).hexdigest()[:32]
+    return etag, int(updated.timestamp())
+
+
+def conditional_dataset(extra='', unless=None):
+    """Decorate a detail view method with ETag / Last-Modified handling
+
+    extra is mixed into the ETag, e.g. a template version for rendered files.
+    unless(request), if given, marks requests whose response may change
+    without a new dataset version; they are answered without validators.
+    """
+    def decorator(view_method):
+        @functools.wraps(view_method)
+        def wrapper(view, request, *args, **kwargs):
+            if unless is not None and unless(request):
+                return view_method(view, request, *args, **kwargs)
+
+            validators = dataset_validators(view, request, extra)
+            if validators is None:
+                # Let the view answer 404 as usual
+                return view_method(view, request, *args, **kwargs)
+
+            etag, last_modified = validators
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = view_method(view, request, *args, **kwargs)
+
+            if response.status_code in (200, 304):
+                response.headers['ETag'] = etag
+                response.headers['Last-Modified'] = http_date(last_modified)
+                # Cacheable, but always revalidated
+                response.headers.setdefault('Cache-Control', 'private, no-cache')
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,263 @@
+"""
+CSV parsing shared by request handlers and worker processes.
+
+Only the required columns are parsed, with their types declared up front:
+names as strings, Type as a category and the numeric columns as floats
+(settings.CSV_FLOAT_DTYPE). When pyarrow is installed its multithreaded,
+streaming CSV reader is used, otherwise pandas' C parser.
+
+Nothing here touches the ORM, so the module can be imported by process
+pool workers that never set up Django's app registry.
+"""
+import hashlib
+import os
+
+import pandas as pd
+from django.conf import settings
+from pandas.api.types import is_numeric_dtype
+
+from . import tracing
+from .stats import NUMERIC_COLUMNS, SummaryAccumulator, TypeStatsCollector
+from .validation import InvalidCellsError, ValidationReport
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = None
+
+REQUIRED_COLUMNS = ['Equipment Name', 'Type', 'Flowrate', 'Pressure', 'Temperature']
+
+DEFAULT_CHUNK_SIZE = 50000
+DEFAULT_FLOAT_DTYPE = 'float64'
+
+
+class MissingColumnsError(ValueError):
+    """Raised when the CSV header lacks one of the required columns"""
+
+    def __init__(self, missing_columns):
+        self.missing_columns = missing_columns
+        super().__init__(f'Missing columns: {", ".join(missing_columns)}')
+
+    def __reduce__(self):
+        # Raised in worker processes, so it has to survive pickling
+        return type(self), (self.missing_columns,)
+
+
+class EmptyCSVError(ValueError):
+    """Raised for a CSV file with a header but no rows"""
+
+    def __init__(self):
+        super().__init__('CSV file has no rows')
+
+
+class NonNumericValueError(ValueError):
+    """Raised by a typed reader on text in a numeric column"""
+
+
+def get_chunk_size():
+    return getattr(settings, 'CSV_INGEST_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
+
+
+def get_float_dtype():
+    return getattr(settings, 'CSV_FLOAT_DTYPE', DEFAULT_FLOAT_DTYPE)
+
+
+def use_pyarrow():
+    return pa is not None and getattr(settings, 'CSV_ENGINE', 'auto') != 'pandas'
+
+
+def read_csv_chunks(csv_file, chunk_size=None):
+    """Yield the required columns of the CSV as DataFrames of at most
+    chunk_size rows
+
+    A missing required column is simply absent from the frames, callers
+    check them with validate_columns(). Typed parsing fails on the first
+    text cell in a numeric column; the rest of the file is then re-read
+    with numeric columns as text, for ValidationReport.check() to convert.
+    """
+    chunk_size = chunk_size or get_chunk_size()
+    read_chunks = _read_pyarrow_chunks if use_pyarrow() else _read_pandas_chunks
+
+    rows_read = 0
+    try:
+        for chunk in read_chunks(csv_file, chunk_size):
+            rows_read += len(chunk)
+            yield chunk
+    except NonNumericValueError:
+        yield from read_chunks(csv_file, chunk_size, skip_rows=rows_read, numeric_as_text=True)
+
+
+def read_valid_chunks(csv_file, report, skip_invalid=False, chunk_size=None):
+    """Yield validated chunks of the CSV, ready to be stored
+
+    With skip_invalid, rows with any flagged cell are dropped. Otherwise
+    all rows are kept unless a cell is invalid: the rest of the file is
+    then only checked, to complete the report, and InvalidCellsError is
+    raised.
+    """
+    rejected = False
+    chunks = tracing.iterate('read_csv', read_csv_chunks(csv_file, chunk_size))
+    for index, chunk in enumerate(chunks):
+        with tracing.span('validate'):
+            if index == 0:
+                validate_columns(chunk.columns)
+
+            chunk, valid = report.check(chunk)
+            if skip_invalid:
+                if not valid.all():
+                    report.rows_skipped += int(len(valid) - valid.sum())
+                    chunk = chunk[valid]
+            elif report.has_invalid:
+                rejected = True
+        if not rejected:
+            yield chunk
+
+    if rejected:
+        raise InvalidCellsError(report.to_dict())
+
+
+def _read_pandas_chunks(csv_file, chunk_size, skip_rows=0, numeric_as_text=False):
+    if hasattr(csv_file, 'seek'):
+        csv_file.seek(0)
+    float_dtype = get_float_dtype()
+    dtype = {'Equipment Name': str, 'Type': 'category'}
+    if numeric_as_text:
+        dtype.update({column: str for column in NUMERIC_COLUMNS})
+
+    reader = pd.read_csv(
+        csv_file, chunksize=chunk_size,
+        usecols=lambda column: column in REQUIRED_COLUMNS,
+        dtype=dtype,
+        skiprows=range(1, skip_rows + 1),
+    )
+    with reader:
+        for chunk in reader:
+            if numeric_as_text:
+                yield chunk
+                continue
+            # Numeric columns are converted here rather than through dtype=,
+            # so that text cells can be told from other parse errors. The
+            # empty chunk of a header-only file comes back as object.
+            for column in NUMERIC_COLUMNS:
+                if column not in chunk:
+                    continue
+                if len(chunk) and not is_numeric_dtype(chunk[column]):
+                    raise NonNumericValueError(column)
+                chunk[column] = chunk[column].astype(float_dtype)
+            yield chunk
+
+
+def _open_pyarrow_reader(csv_file, include_columns, skip_rows=0, numeric_as_text=False):
+    if hasattr(csv_file, 'seek'):
+        csv_file.seek(0)
+    numeric_type = pa.string() if numeric_as_text else pa.from_numpy_dtype(get_float_dtype())
+    column_types = {
+        'Equipment Name': pa.string(),
+        'Type': pa.dictionary(pa.int32(), pa.string()),
+        **{column: numeric_type for column in NUMERIC_COLUMNS},
+    }
+    return pa_csv.open_csv(
+        csv_file,
+        read_options=pa_csv.ReadOptions(skip_rows_after_names=skip_rows),
+        convert_options=pa_csv.ConvertOptions(
+            include_columns=include_columns,
+            column_types=column_types,
+            # Blank names and types become NaN, as with pandas
+            strings_can_be_null=True,
+        ),
+    )
+
+
+def _read_pyarrow_chunks(csv_file, chunk_size, skip_rows=0, numeric_as_text=False):
+    def invalid(e):
+        # Conversion errors are the only ones a text read can get past
+        if not numeric_as_text and 'conversion error' in str(e):
+            return NonNumericValueError(str(e))
+        return ValueError(f'Invalid CSV: {e}')
+
+    try:
+        reader = _open_pyarrow_reader(csv_file, REQUIRED_COLUMNS, skip_rows, numeric_as_text)
+    except pa.ArrowKeyError:
+        # Reopen with every column to report all the missing ones
+        reader = _open_pyarrow_reader(csv_file, [], skip_rows, numeric_as_text)
+        validate_columns(reader.schema.names)
+        raise
+    except pa.ArrowInvalid as e:
+        raise invalid(e)
+
+    # Record batches are sized in bytes, regroup them into chunk_size rows
+    pending = pa.Table.from_batches([], reader.schema)
+    yielded = False
+    try:
+        for batch in reader:
+            pending = pa.concat_tables([pending, pa.Table.from_batches([batch])])
+            while pending.num_rows >= chunk_size:
+                yield pending.slice(0, chunk_size).to_pandas()
+                pending = pending.slice(chunk_size)
+                yielded = True
+    except pa.ArrowInvalid as e:
+        raise invalid(e)
+
+    if pending.num_rows or not yielded:
+        yield pending.to_pandas()
+
+
+def validate_columns(columns):
+    missing_columns = [col for col in REQUIRED_COLUMNS if col not in columns]
+    if missing_columns:
+        raise MissingColumnsError(missing_columns)
+
+
+def file_sha256(path):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def parse_csv_file(path, chunk_size, skip_invalid=False):
+    """Parse, validate and summarize a whole CSV file
+
+    Runs in worker processes for bulk uploads. Returns everything needed to
+    store the dataset: the rows (required columns only) as one DataFrame,
+    summary, summary_state, type_stats, validation, content_hash,
+    size_bytes and the timing of these stages.
+    """
+    accumulator = SummaryAccumulator()
+    type_stats = TypeStatsCollector()
+    report = ValidationReport(float_dtype=get_float_dtype())
+    frames = []
+    trace = tracing.Trace()
+
+    with tracing.activate(trace):
+        for chunk in read_valid_chunks(path, report, skip_invalid, chunk_size):
+            with tracing.span('summary'):
+                accumulator.update(chunk)
+            frames.append(chunk)
+
+        if not accumulator.total_count:
+            raise EmptyCSVError()
+
+        with tracing.span('read_csv'):
+            frame = pd.concat(frames, ignore_index=True)
+        with tracing.span('summary'):
+            summary = accumulator.to_summary()
+            summary_state = accumulator.to_state()
+            # The rows are held for storing anyway, so percentiles are exact here
+            type_stats.update(frame)
+            computed_type_stats = type_stats.compute()
+        with tracing.span('hash'):
+            content_hash = file_sha256(path)
+
+    return {
+        'frame': frame,
+        'summary': summary,
+        'summary_state': summary_state,
+        'type_stats': computed_type_stats,
+        'validation': report.to_dict(),
+        'content_hash': content_hash,
+        'size_bytes': os.path.getsize(path),
+        'timing': trace.to_dict(),
+    }
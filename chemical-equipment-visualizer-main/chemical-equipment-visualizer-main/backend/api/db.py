@@ -0,0 +1,18 @@
+"""
+Database connection setup.
+"""
+from django.conf import settings
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """Apply settings.SQLITE_PRAGMAS to a new SQLite connection
+
+    Connected to the connection_created signal in ApiConfig.ready(), so
+    other database backends are left untouched.
+    """
+    if connection.vendor != 'sqlite':
+        return
+
+    with connection.cursor() as cursor:
+        for name, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+            cursor.execute(f'PRAGMA {name} = {value}')
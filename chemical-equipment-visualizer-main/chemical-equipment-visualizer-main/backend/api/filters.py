@@ -0,0 +1,64 @@
+"""
+Query-string filtering and sorting of EquipmentRecord rows.
+
+Supported parameters:
+    type=<value>                  exact equipment type
+    <column>_min / <column>_max   inclusive numeric range, for flowrate,
+                                  pressure and temperature
+    sort=<column>                 name, type, flowrate, pressure or temperature
+                                  (CSV column names are accepted too)
+    order=asc|desc
+"""
+from .models import EquipmentRecord
+
+NUMERIC_FIELDS = ['flowrate', 'pressure', 'temperature']
+SORT_FIELDS = list(EquipmentRecord.COLUMN_FIELDS.values())
+
+
+class RecordFilterError(ValueError):
+    """Raised for malformed filter or sort parameters"""
+
+
+def _parse_float(params, key):
+    value = params.get(key)
+    if value in (None, ''):
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        raise RecordFilterError(f"'{key}' must be a number")
+
+
+def filter_records(records, params):
+    """Apply type and numeric range filters from query params"""
+    eq_type = params.get('type')
+    if eq_type:
+        records = records.filter(type=eq_type)
+
+    for field in NUMERIC_FIELDS:
+        low = _parse_float(params, f'{field}_min')
+        high = _parse_float(params, f'{field}_max')
+        if low is not None:
+            records = records.filter(**{f'{field}__gte': low})
+        if high is not None:
+            records = records.filter(**{f'{field}__lte': high})
+
+    return records
+
+
+def sort_records(records, params):
+    """Order rows by ?sort= and ?order=, keeping upload order for ties"""
+    sort = params.get('sort')
+    if not sort:
+        return records
+
+    field = EquipmentRecord.COLUMN_FIELDS.get(sort, sort)
+    if field not in SORT_FIELDS:
+        raise RecordFilterError(f"Cannot sort by '{sort}'")
+
+    order = params.get('order', 'asc').lower()
+    if order not in ('asc', 'desc'):
+        raise RecordFilterError("'order' must be 'asc' or 'desc'")
+
+    prefix = '-' if order == 'desc' else ''
+    return records.order_by(f'{prefix}{field}', f'{prefix}id')
@@ -0,0 +1,193 @@
+"""
+Per-process LRU cache of decoded dataset frames.
+
+Histograms, comparisons and full PDF reports need every row of a dataset
+as columns. Loading them is a database scan plus building a DataFrame from
+Python tuples, which dominates those endpoints on large datasets, so the
+decoded frames are kept in memory by each worker process.
+
+The cache holds at most settings.DATASET_FRAME_CACHE_BYTES (deep memory
+usage of the frames, 0 disables it) and evicts the least recently used
+frames to make room. A frame larger than the whole budget isn't cached.
+Scans that can work chunk by chunk use iter_frames(), which reads a
+dataset that isn't cached and wouldn't fit straight from the database,
+so it is never held in memory whole.
+
+Entries are stamped with the dataset's updated_date, so a frame cached
+before an append is reloaded even by a worker that didn't make the change.
+Deletes and appends also drop the frame through caching.invalidate_datasets,
+which frees its memory right away in the worker that made the change.
+
+Cached frames are shared between requests and must not be modified in
+place (with copy-on-write, derived frames can be).
+"""
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .ingest import iter_record_frames, load_record_frame
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+# Memory of a row until a frame has been measured: name, type code, 3 floats
+DEFAULT_ROW_BYTES = 100
+
+
+class FrameCache:
+    """Thread-safe LRU of dataset id -> (version, frame) within a byte budget"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # dataset id -> (version, frame, nbytes)
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+        self.invalidations = 0
+        self.oversize = 0
+        # Memory per row of the last frame put, to size frames before loading
+        self.row_bytes = DEFAULT_ROW_BYTES
+
+    def _discard(self, dataset_id):
+        entry = self._entries.pop(dataset_id, None)
+        if entry is not None:
+            self.bytes -= entry[2]
+        return entry
+
+    def get(self, dataset_id, version):
+        """The cached frame of this dataset version, or None"""
+        with self._lock:
+            entry = self._entries.get(dataset_id)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(dataset_id)
+                self.hits += 1
+                return entry[1]
+
+            self.misses += 1
+            if entry is not None:
+                # Rows were appended since
+                self._discard(dataset_id)
+                self.invalidations += 1
+            return None
+
+    def put(self, dataset_id, version, frame):
+        nbytes = int(frame.memory_usage(deep=True).sum())
+        with self._lock:
+            if len(frame):
+                self.row_bytes = nbytes / len(frame)
+            self._discard(dataset_id)
+            if nbytes > self.max_bytes:
+                self.oversize += 1
+                return
+
+            while self.bytes + nbytes > self.max_bytes:
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+                self.evicted_bytes += evicted
+            self._entries[dataset_id] = (version, frame, nbytes)
+            self.bytes += nbytes
+
+    def fits(self, rows):
+        """Whether a frame of this many rows would be cached"""
+        return rows * self.row_bytes <= self.max_bytes
+
+    def invalidate(self, dataset_ids):
+        with self._lock:
+            for dataset_id in dataset_ids:
+                if self._discard(dataset_id) is not None:
+                    self.invalidations += 1
+
+    def get_stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else None,
+                'evictions': self.evictions,
+                'evicted_bytes': self.evicted_bytes,
+                'invalidations': self.invalidations,
+                'oversize': self.oversize,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_frame_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = FrameCache(getattr(settings, 'DATASET_FRAME_CACHE_BYTES', DEFAULT_MAX_BYTES))
+        return _cache
+
+
+def get_frame(dataset, columns=None):
+    """All rows of dataset as a DataFrame with CSV column names
+
+    Type is categorical and blank cells are NaN. columns selects some CSV
+    columns of the cached frame.
+    """
+    cache = get_frame_cache()
+    if not cache.max_bytes:
+        return load_record_frame(dataset, columns)
+
+    version = dataset.updated_date.isoformat()
+    frame = cache.get(dataset.pk, version)
+    if frame is None:
+        frame = _load(cache, dataset, version)
+    return frame if columns is None else frame[list(columns)]
+
+
+def _load(cache, dataset, version):
+    frame = load_record_frame(dataset)
+    # A handful of types repeated over every row
+    frame['Type'] = frame['Type'].astype('category')
+    cache.put(dataset.pk, version, frame)
+    return frame
+
+
+def iter_frames(dataset, columns=None, chunk_size=None):
+    """The rows of dataset as DataFrames, like get_frame() but possibly in chunks
+
+    The cached frame is the only one when it is cached already or fits
+    the budget, otherwise the rows are read from the database chunk by
+    chunk (Type isn't categorical then).
+    """
+    cache = get_frame_cache()
+    frame = None
+    if cache.max_bytes:
+        version = dataset.updated_date.isoformat()
+        frame = cache.get(dataset.pk, version)
+        if frame is None and cache.fits(dataset.summary.get('total_count', 0)):
+            frame = _load(cache, dataset, version)
+
+    if frame is None:
+        yield from iter_record_frames(dataset, chunk_size, columns)
+    else:
+        yield frame if columns is None else frame[list(columns)]
+
+
+def frame_rows(frame):
+    """Rows of a frame as dicts, with blanks as stored ('' and None)"""
+    values = frame.astype(object)
+    values = values.where(frame.notna(), None)
+    if 'Type' in values:
+        values['Type'] = values['Type'].where(frame['Type'].notna(), '')
+    return values.to_dict('records')
+
+
+def invalidate_frames(dataset_ids):
+    get_frame_cache().invalidate(dataset_ids)
+
+
+def get_stats():
+    """Counters and size of this process's frame cache"""
+    return get_frame_cache().get_stats()
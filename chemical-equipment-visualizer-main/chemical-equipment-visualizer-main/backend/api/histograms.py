@@ -0,0 +1,160 @@
+"""
+Binned counts of dataset columns for charts.
+
+Supported parameters:
+    column=<column>   numeric column to bin (flowrate, pressure or
+                      temperature; CSV column names are accepted too)
+    y=<column>        second numeric column, for 2D (heatmap) binning
+    bins=<n>          bins per axis, up to MAX_BINS (MAX_BINS_2D with y)
+    by=type           also count per equipment type
+
+Bins are equal-width and span the column's min and max from the dataset
+summary; the last bin includes its upper edge. Rows come from the frame
+cache, or in chunks from the database when the dataset doesn't fit it
+(see frames.iter_frames), and are binned with NumPy, so the response has
+a fixed size whatever the number of rows. Blank cells are counted as
+missing.
+"""
+import numpy as np
+import pandas as pd
+
+from .frames import iter_frames
+from .models import EquipmentRecord
+from .stats import NUMERIC_COLUMNS
+
+DEFAULT_BINS = 32
+MAX_BINS = 512
+MAX_BINS_2D = 128
+
+
+class HistogramError(ValueError):
+    """Raised for malformed histogram parameters"""
+
+
+def _parse_column(params, key, required=True):
+    value = params.get(key)
+    if not value:
+        if required:
+            raise HistogramError(f"'{key}' is required")
+        return None
+
+    # Accept field names (pressure) as well as CSV names (Pressure)
+    fields = {field: column for column, field in EquipmentRecord.COLUMN_FIELDS.items()}
+    column = fields.get(value, value)
+    if column not in NUMERIC_COLUMNS:
+        raise HistogramError(f"Cannot bin '{value}', use one of {', '.join(NUMERIC_COLUMNS)}")
+    return column
+
+
+def parse_params(params):
+    """Validate query params into {'column', 'y', 'bins', 'by'}"""
+    column = _parse_column(params, 'column')
+    y = _parse_column(params, 'y', required=False)
+    max_bins = MAX_BINS_2D if y else MAX_BINS
+
+    try:
+        bins = int(params.get('bins', DEFAULT_BINS))
+    except ValueError:
+        raise HistogramError("'bins' must be an integer")
+    if not 1 <= bins <= max_bins:
+        raise HistogramError(f"'bins' must be between 1 and {max_bins}")
+
+    by = params.get('by') or None
+    if by is not None:
+        if by.lower() != 'type':
+            raise HistogramError("'by' only supports 'type'")
+        by = 'Type'
+
+    return {'column': column, 'y': y, 'bins': bins, 'by': by}
+
+
+def bin_edges(summary, column, bins):
+    """Equal-width edges over the column's range, None if it has no values"""
+    low = summary.get(f'min_{column.lower()}')
+    high = summary.get(f'max_{column.lower()}')
+    if low is None or high is None or np.isnan(low) or np.isnan(high):
+        return None
+    if low == high:
+        # A single value still gets a bin around it
+        low, high = low - 0.5, high + 0.5
+    return np.linspace(low, high, bins + 1)
+
+
+def bin_indices(values, edges):
+    """Bin of each value, -1 for NaN and values outside the edges"""
+    bins = len(edges) - 1
+    indices = np.searchsorted(edges, values, side='right') - 1
+    indices[values == edges[-1]] = bins - 1
+    indices[(indices < 0) | (indices >= bins) | np.isnan(values)] = -1
+    return indices
+
+
+def compute_histogram(dataset, column, bins=DEFAULT_BINS, y=None, by=None):
+    """Count the rows of dataset per bin of column (and y), optionally per type
+
+    counts is a list of bins counts, or with y a bins x bins list of lists
+    (first index along column, second along y). With by, groups holds the
+    same counts per type.
+    """
+    axes = [column] + ([y] if y else [])
+    edges = [bin_edges(dataset.summary, axis, bins) for axis in axes]
+    shape = (bins,) * len(axes)
+    cells = bins ** len(axes)
+
+    counts = np.zeros(cells, dtype=np.int64)
+    groups = {}
+
+    if all(axis_edges is not None for axis_edges in edges):
+        total = missing = 0
+        for frame in iter_frames(dataset, axes + ([by] if by else [])):
+            total += len(frame)
+            flat = np.zeros(len(frame), dtype=np.int64)
+            binned = np.ones(len(frame), dtype=bool)
+            for axis, axis_edges in zip(axes, edges):
+                indices = bin_indices(frame[axis].to_numpy(dtype='float64'), axis_edges)
+                binned &= indices >= 0
+                flat = flat * bins + indices
+
+            missing += int(np.count_nonzero(~binned))
+            flat = flat[binned]
+            counts += np.bincount(flat, minlength=cells)
+
+            if by:
+                codes, names = pd.factorize(frame[by][binned])
+                known = codes >= 0
+                per_group = np.bincount(
+                    codes[known] * cells + flat[known], minlength=len(names) * cells
+                ).reshape(len(names), cells)
+                for name, group_counts in zip(names, per_group):
+                    if name in groups:
+                        groups[name] = groups[name] + group_counts
+                    else:
+                        groups[name] = group_counts
+    else:
+        total = missing = dataset.records.count()
+
+    def shaped(values):
+        return np.asarray(values).reshape(shape).tolist()
+
+    result = {
+        'bins': bins,
+        'total': total,
+        'missing': missing,
+        'counts': shaped(counts),
+    }
+    if y:
+        result['x'] = {'column': column, 'edges': _edges_list(edges[0])}
+        result['y'] = {'column': y, 'edges': _edges_list(edges[1])}
+    else:
+        result['column'] = column
+        result['edges'] = _edges_list(edges[0])
+    if by:
+        result['by'] = by
+        result['groups'] = {
+            str(name): shaped(group_counts) for name, group_counts in sorted(groups.items())
+        }
+    return result
+
+
+def _edges_list(edges):
+    return [] if edges is None else edges.tolist()
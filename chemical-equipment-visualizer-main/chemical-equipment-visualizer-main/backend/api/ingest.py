@@ -0,0 +1,322 @@
+"""
+Streaming CSV ingestion for equipment datasets.
+
+Uploads are read in bounded-size chunks and folded into running aggregates,
+so peak memory depends on the chunk size rather than on the file size.
+"""
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import metrics, tracing
+from .caching import invalidate_datasets
+from .csvio import EmptyCSVError, get_chunk_size, get_float_dtype, read_valid_chunks
+from .models import Dataset, EquipmentRecord
+from .stats import NUMERIC_COLUMNS, SummaryAccumulator, TypeStatsCollector
+from .validation import ValidationReport
+
+DEFAULT_BATCH_SIZE = 5000
+
+# Datasets with a percentile refresh queued but not started yet
+_refresh_pending = set()
+_refresh_lock = threading.Lock()
+
+
+def get_batch_size():
+    return getattr(settings, 'CSV_INGEST_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+
+
+def build_records(dataset, chunk):
+    """Convert a DataFrame chunk into unsaved EquipmentRecord instances"""
+    columns = []
+    for column in EquipmentRecord.COLUMN_FIELDS:
+        values = chunk[column]
+        if column in NUMERIC_COLUMNS:
+            # NaN becomes NULL
+            values = values.astype(object).where(values.notna(), None)
+        else:
+            # Through object first, '' isn't a category of Type
+            values = values.astype(object).where(values.notna(), '').astype(str)
+        columns.append(values.tolist())
+
+    fields = list(EquipmentRecord.COLUMN_FIELDS.values())
+    return [
+        EquipmentRecord(dataset=dataset, **dict(zip(fields, row)))
+        for row in zip(*columns)
+    ]
+
+
+def write_chunks(dataset, csv_file, collectors, chunk_size=None, progress=None,
+                 report=None, skip_invalid=False):
+    """Parse and validate csv_file chunk by chunk, storing its rows under dataset
+
+    Each chunk is passed to the update() method of every collector. Cells
+    are validated into report (see csvio.read_valid_chunks for the effect
+    of skip_invalid). Returns the number of rows written.
+    """
+    if report is None:
+        report = ValidationReport(float_dtype=get_float_dtype())
+
+    rows_written = 0
+    for chunk in read_valid_chunks(csv_file, report, skip_invalid, chunk_size):
+        with tracing.span('summary'):
+            for collector in collectors:
+                collector.update(chunk)
+        with tracing.span('build_records'):
+            records = build_records(dataset, chunk)
+        with tracing.span('db_write'):
+            EquipmentRecord.objects.bulk_create(records, batch_size=get_batch_size())
+        rows_written += len(chunk)
+        if progress is not None:
+            progress(rows_written)
+
+    return rows_written
+
+
+def ingest_csv(csv_file, filename, user=None, content_hash='', size_bytes=0,
+               chunk_size=None, progress=None, skip_invalid=False):
+    """Stream a CSV upload into a new Dataset, writing rows chunk by chunk
+
+    progress, if given, is called with the number of rows written so far
+    after every chunk. With skip_invalid only rows without flagged cells
+    are stored, otherwise invalid cells raise InvalidCellsError. Per-type
+    percentiles are None until the refresh queued here has run.
+    """
+    accumulator = SummaryAccumulator()
+    report = ValidationReport(float_dtype=get_float_dtype())
+    started = time.perf_counter()
+
+    with transaction.atomic():
+        with tracing.span('db_write'):
+            dataset = Dataset.objects.create(
+                filename=filename, summary={}, user=user,
+                content_hash=content_hash, size_bytes=size_bytes
+            )
+        rows_written = write_chunks(
+            dataset, csv_file, [accumulator], chunk_size, progress,
+            report, skip_invalid
+        )
+        if not rows_written:
+            raise EmptyCSVError()
+
+        with tracing.span('summary'):
+            dataset.summary = accumulator.to_summary()
+            dataset.summary_state = accumulator.to_state()
+            # Percentiles need every value, they are filled in by the refresh
+            dataset.type_stats = accumulator.to_type_stats()
+            dataset.validation = report.to_dict()
+        with tracing.span('db_write'):
+            dataset.save(update_fields=['summary', 'summary_state', 'type_stats', 'validation'])
+        invalidate_datasets([dataset.pk])
+        schedule_type_stats_refresh(dataset.pk)
+
+    metrics.record_ingest('upload', rows_written, time.perf_counter() - started)
+    return dataset
+
+
+def store_parsed(parsed, filename, user=None):
+    """Create a Dataset from the output of csvio.parse_csv_file()
+
+    Nested in the caller's transaction as a savepoint, so a failing file
+    doesn't undo the others of a bulk upload. The stages timed here are
+    added to the timing of the parse.
+    """
+    frame = parsed['frame']
+    batch_size = get_batch_size()
+    started = time.perf_counter()
+    trace = tracing.Trace()
+
+    with transaction.atomic(), tracing.activate(trace):
+        with tracing.span('db_write'):
+            dataset = Dataset.objects.create(
+                filename=filename, user=user,
+                summary=parsed['summary'],
+                summary_state=parsed['summary_state'],
+                type_stats=parsed['type_stats'],
+                validation=parsed['validation'],
+                content_hash=parsed['content_hash'],
+                size_bytes=parsed['size_bytes'],
+            )
+        for start in range(0, len(frame), batch_size):
+            with tracing.span('build_records'):
+                records = build_records(dataset, frame.iloc[start:start + batch_size])
+            with tracing.span('db_write'):
+                EquipmentRecord.objects.bulk_create(records, batch_size=batch_size)
+        dataset.timing = tracing.store(
+            dataset.pk, tracing.merge(parsed.get('timing', {}), trace.to_dict())
+        )
+        invalidate_datasets([dataset.pk])
+
+    # Parsing happened in a pool worker, this is the database part
+    metrics.record_ingest('bulk', len(frame), time.perf_counter() - started)
+    return dataset
+
+
+def iter_record_frames(dataset, chunk_size=None, columns=None):
+    """Yield the stored rows of dataset as DataFrames with CSV column names
+
+    columns limits the frames to some CSV columns. Blank cells come back
+    as NaN, as they were when the CSV was parsed.
+    """
+    columns = list(columns or EquipmentRecord.COLUMN_FIELDS)
+    values = dataset.records.values_list(
+        *[EquipmentRecord.COLUMN_FIELDS[column] for column in columns]
+    )
+    numeric_columns = [column for column in columns if column in NUMERIC_COLUMNS]
+
+    def to_frame(rows):
+        frame = pd.DataFrame(rows, columns=columns)
+        # NULL -> NaN, even when a column is NULL throughout the chunk
+        frame[numeric_columns] = frame[numeric_columns].astype(float)
+        if 'Type' in frame:
+            frame['Type'] = frame['Type'].replace('', np.nan)
+        return frame
+
+    chunk_size = chunk_size or get_chunk_size()
+    rows = []
+    for row in values.iterator(chunk_size=chunk_size):
+        rows.append(row)
+        if len(rows) == chunk_size:
+            yield to_frame(rows)
+            rows = []
+    if rows:
+        yield to_frame(rows)
+
+
+def load_record_frame(dataset, columns=None, chunk_size=None):
+    """All stored rows of dataset as one DataFrame, see iter_record_frames"""
+    frames = list(iter_record_frames(dataset, chunk_size, columns))
+    if not frames:
+        columns = list(columns or EquipmentRecord.COLUMN_FIELDS)
+        return pd.DataFrame({
+            column: pd.Series(dtype=float if column in NUMERIC_COLUMNS else object)
+            for column in columns
+        })
+    return pd.concat(frames, ignore_index=True)
+
+
+def rebuild_summary_state(dataset, chunk_size=None):
+    """Recompute the mergeable summary state from stored rows
+
+    Only needed for datasets created before summary_state, or its per-type
+    stats, was recorded.
+    """
+    accumulator = SummaryAccumulator()
+    for frame in iter_record_frames(dataset, chunk_size):
+        accumulator.update(frame)
+    return accumulator
+
+
+def compute_type_stats(dataset, chunk_size=None):
+    """Recompute per-type statistics over all stored rows"""
+    type_stats = TypeStatsCollector()
+    for frame in iter_record_frames(dataset, chunk_size):
+        type_stats.update(frame)
+    return type_stats.compute()
+
+
+def refresh_type_stats(dataset_id, chunk_size=None):
+    """Recompute the per-type stats of a dataset, percentiles included
+
+    Returns False when there was nothing to store: the dataset is gone, or
+    rows were appended while reading, whose append queued another refresh.
+    """
+    with _refresh_lock:
+        _refresh_pending.discard(dataset_id)
+    dataset = Dataset.objects.filter(pk=dataset_id).first()
+    if dataset is None:
+        return False
+
+    type_stats = compute_type_stats(dataset, chunk_size)
+    with transaction.atomic():
+        updated = Dataset.objects.filter(
+            pk=dataset_id, updated_date=dataset.updated_date
+        ).update(type_stats=type_stats, updated_date=timezone.now())
+        if updated:
+            # A new updated_date, so clients revalidating get the percentiles
+            invalidate_datasets([dataset_id])
+    return bool(updated)
+
+
+def _refresh_in_worker(dataset_id):
+    # Imported here because reports imports this module, through frames
+    from .reports import prerender_report
+    try:
+        if refresh_type_stats(dataset_id) and getattr(settings, 'REPORT_PRERENDER', False):
+            dataset = Dataset.objects.filter(pk=dataset_id).first()
+            if dataset is not None:
+                # The refresh made a new version, render the report of that one
+                prerender_report(dataset)
+    finally:
+        connection.close()
+
+
+def schedule_type_stats_refresh(dataset_id):
+    """Refresh per-type percentiles on the worker pool once the current transaction commits
+
+    The report is prerendered after the refresh, which changes the
+    dataset's version. A dataset already waiting for a refresh isn't
+    queued again, so a burst of appends costs one rescan rather than one
+    per append.
+    """
+    # Imported here because jobs imports this module
+    from .jobs import get_executor
+
+    def submit():
+        with _refresh_lock:
+            if dataset_id in _refresh_pending:
+                return
+            _refresh_pending.add(dataset_id)
+        get_executor().submit(_refresh_in_worker, dataset_id)
+
+    transaction.on_commit(submit)
+
+
+def append_csv(dataset, csv_file, chunk_size=None, skip_invalid=False):
+    """Append the rows of csv_file to dataset, merging only their aggregates
+
+    Per-type percentiles are None until the refresh queued here has
+    rescanned the dataset. The validation report of the appended file is
+    merged into the stored one. Returns the refreshed dataset, the number
+    of rows appended and the validation report of the appended file.
+    """
+    report = ValidationReport(float_dtype=get_float_dtype())
+    started = time.perf_counter()
+    with transaction.atomic():
+        dataset = Dataset.objects.select_for_update().get(pk=dataset.pk)
+        if 'type_columns' in dataset.summary_state:
+            accumulator = SummaryAccumulator.from_state(dataset.summary_state)
+        else:
+            # Recorded before the state had per-type stats, rebuilt once
+            accumulator = rebuild_summary_state(dataset, chunk_size)
+
+        new_rows = SummaryAccumulator()
+        rows_appended = write_chunks(
+            dataset, csv_file, [new_rows], chunk_size, report=report, skip_invalid=skip_invalid
+        )
+        accumulator.merge(new_rows)
+
+        dataset.summary = accumulator.to_summary()
+        dataset.summary_state = accumulator.to_state()
+        dataset.type_stats = accumulator.to_type_stats()
+        # Row numbers of the appended file continue after the rows checked so far
+        validation = ValidationReport.from_dict(dataset.validation, float_dtype=report.float_dtype)
+        validation.merge(report)
+        dataset.validation = validation.to_dict()
+        # The stored rows no longer match the originally uploaded file
+        dataset.content_hash = ''
+        dataset.size_bytes += csv_file.size
+        dataset.save(update_fields=[
+            'summary', 'summary_state', 'type_stats', 'validation', 'content_hash', 'size_bytes',
+            'updated_date',
+        ])
+        invalidate_datasets([dataset.pk])
+        schedule_type_stats_refresh(dataset.pk)
+
+    metrics.record_ingest('append', rows_appended, time.perf_counter() - started)
+    return dataset, rows_appended, report.to_dict()
@@ -0,0 +1,117 @@
+"""
+Background ingestion jobs.
+
+Uploads are spooled to disk and handed to a local thread pool, so the web
+request returns as soon as the file is received. Job state lives in the
+IngestionJob table; row progress of running jobs is kept in memory by the
+process executing them because the ingest transaction is not visible to
+other connections until it commits.
+"""
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .ingest import ingest_csv
+from .models import IngestionJob
+from .retention import enforce_retention_traced
+from . import tracing
+
+DEFAULT_WORKERS = 2
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# job id -> rows written so far, for jobs running in this process
+_progress = {}
+
+
+def get_executor():
+    """Return the process-wide ingestion worker pool, creating it on first use"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'INGEST_WORKERS', DEFAULT_WORKERS),
+                thread_name_prefix='ingest',
+            )
+        return _executor
+
+
+def spool_upload(uploaded_file):
+    """Copy an uploaded file to a temporary file the worker can read later"""
+    spool_dir = getattr(settings, 'INGEST_SPOOL_DIR', None)
+    if spool_dir:
+        os.makedirs(spool_dir, exist_ok=True)
+
+    with tempfile.NamedTemporaryFile(
+        prefix='ingest-', suffix='.csv', dir=spool_dir, delete=False
+    ) as spool:
+        for chunk in uploaded_file.chunks():
+            spool.write(chunk)
+    return spool.name
+
+
+def submit_upload(uploaded_file, user=None, content_hash='', skip_invalid=False):
+    """Spool an upload and queue it for background ingestion"""
+    path = spool_upload(uploaded_file)
+    job = IngestionJob.objects.create(filename=uploaded_file.name, user=user)
+    transaction.on_commit(
+        lambda: get_executor().submit(
+            run_job, job.pk, path, content_hash, uploaded_file.size, skip_invalid
+        )
+    )
+    return job
+
+
+def get_live_progress(job_id):
+    return _progress.get(job_id, 0)
+
+
+def run_job(job_id, path, content_hash='', size_bytes=0, skip_invalid=False):
+    """Worker entry point: ingest a spooled file and record the outcome"""
+    try:
+        job = IngestionJob.objects.get(pk=job_id)
+        job.state = IngestionJob.STATE_RUNNING
+        job.save(update_fields=['state', 'updated_date'])
+
+        def progress(rows):
+            _progress[job_id] = rows
+
+        try:
+            trace = tracing.Trace()
+            with open(path, 'rb') as csv_file, tracing.activate(trace):
+                dataset = ingest_csv(
+                    csv_file, job.filename, user=job.user,
+                    content_hash=content_hash, size_bytes=size_bytes,
+                    progress=progress, skip_invalid=skip_invalid
+                )
+            tracing.store(dataset.pk, trace.to_dict())
+        except Exception as e:
+            job.state = IngestionJob.STATE_FAILED
+            job.error = str(e)
+            job.save()
+            return
+
+        job.state = IngestionJob.STATE_SUCCEEDED
+        job.dataset = dataset
+        job.rows_processed = dataset.summary['total_count']
+        job.save()
+
+        # The upload is stored either way, a failing cleanup doesn't fail the job
+        try:
+            enforce_retention_traced(dataset.pk)
+        except Exception:
+            logger.exception('Enforcing retention after job %s failed', job_id)
+    finally:
+        _progress.pop(job_id, None)
+        if os.path.exists(path):
+            os.remove(path)
+        # Worker threads outlive the job, don't keep their connection open
+        connection.close()
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from api.retention import enforce_retention
+
+
+class Command(BaseCommand):
+    help = 'Delete datasets outside the DATASET_RETENTION policy (run periodically, e.g. from cron)'
+
+    def handle(self, *args, **options):
+        report = enforce_retention()
+        self.stdout.write(
+            f"Deleted {report['datasets_deleted']} datasets "
+            f"({report['records_deleted']} rows, {report['bytes_reclaimed']} bytes)"
+        )
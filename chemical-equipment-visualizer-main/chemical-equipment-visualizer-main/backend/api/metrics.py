@@ -0,0 +1,192 @@
+"""
+In-process metrics in the Prometheus text format.
+
+Every thread records into its own shard (a plain dict behind a
+threading.local), so the request path never takes a lock or contends with
+other threads. A scrape sums the shards; shards of threads that have
+exited are folded into one retired shard, so short-lived threads (one per
+request under runserver) don't pile up.
+
+Metrics are per process, like the caches: with several worker processes
+each one exposes its own counts, and Prometheus adds them up.
+
+Request metrics are recorded by middleware.MetricsMiddleware, ingestion
+and PDF rendering by the code doing the work.
+"""
+import bisect
+import threading
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+ROWS_PER_SECOND_BUCKETS = (1e3, 5e3, 1e4, 5e4, 1e5, 2.5e5, 5e5, 1e6, 2.5e6)
+
+_local = threading.local()
+_shards = []  # (thread, shard) of live threads
+_retired = {}
+_shards_lock = threading.Lock()
+_metrics = []
+
+
+def _shard():
+    try:
+        return _local.shard
+    except AttributeError:
+        shard = _local.shard = {}
+        with _shards_lock:
+            _shards.append((threading.current_thread(), shard))
+        return shard
+
+
+def _merge(into, shard):
+    for key, value in shard.items():
+        if isinstance(value, list):
+            total = into.setdefault(key, [0] * len(value))
+            for index, count in enumerate(value):
+                total[index] += count
+        else:
+            into[key] = into.get(key, 0) + value
+
+
+def _collect():
+    """Sum of every shard, keyed by (metric name, label values)"""
+    with _shards_lock:
+        live = []
+        for thread, shard in _shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                # The thread can't write anymore, fold it in for good
+                _merge(_retired, shard)
+        _shards[:] = live
+
+        totals = {}
+        _merge(totals, _retired)
+        for _, shard in live:
+            # copy() doesn't release the GIL, so the shard can't grow while it's read
+            _merge(totals, shard.copy())
+    return totals
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        _metrics.append(self)
+
+    def _label_text(self, values, extra=''):
+        pairs = [f'{label}="{_escape(value)}"' for label, value in zip(self.labels, values)]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    def render(self, totals):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for (name, values), value in sorted(totals.items(), key=lambda item: item[0]):
+            if name == self.name:
+                lines.extend(self._samples(values, value))
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, *label_values):
+        shard = _shard()
+        key = (self.name, label_values)
+        shard[key] = shard.get(key, 0) + amount
+
+    def _samples(self, values, value):
+        return [f'{self.name}{self._label_text(values)} {_number(value)}']
+
+
+class Histogram(Metric):
+    """Buckets are stored per bucket and made cumulative when rendered"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = buckets
+
+    def observe(self, value, *label_values):
+        shard = _shard()
+        key = (self.name, label_values)
+        counts = shard.get(key)
+        if counts is None:
+            # One count per bucket, +Inf, then the sum
+            counts = shard[key] = [0] * (len(self.buckets) + 2)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def _samples(self, values, counts):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), counts):
+            cumulative += count
+            le = 'le="%s"' % (bound if bound == '+Inf' else _number(bound))
+            lines.append(f'{self.name}_bucket{self._label_text(values, le)} {cumulative}')
+        lines.append(f'{self.name}_sum{self._label_text(values)} {_number(counts[-1])}')
+        lines.append(f'{self.name}_count{self._label_text(values)} {cumulative}')
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+REQUEST_DURATION = Histogram(
+    'api_request_duration_seconds', 'Time to produce a response, per view.', ('view', 'method')
+)
+REQUESTS = Counter(
+    'api_requests_total', 'Responses sent, per view and status code.', ('view', 'method', 'status')
+)
+REQUEST_QUERIES = Histogram(
+    'api_request_db_queries', 'SQL queries run by a request.', ('view',), QUERY_BUCKETS
+)
+REQUEST_QUERY_SECONDS = Histogram(
+    'api_request_db_seconds', 'Time spent in SQL queries by a request.', ('view',)
+)
+RESPONSE_BYTES = Histogram(
+    'api_response_bytes', 'Size of response bodies as sent, after compression.', ('view',),
+    BYTES_BUCKETS
+)
+ROWS_INGESTED = Counter(
+    'api_rows_ingested_total', 'CSV rows stored, per kind of upload.', ('source',)
+)
+INGEST_DURATION = Histogram(
+    'api_ingest_duration_seconds', 'Time to store one CSV file.', ('source',)
+)
+INGEST_ROWS_PER_SECOND = Histogram(
+    'api_ingest_rows_per_second', 'Ingestion throughput of one CSV file.', ('source',),
+    ROWS_PER_SECOND_BUCKETS
+)
+PDF_RENDER_DURATION = Histogram(
+    'api_pdf_render_seconds', 'Time to render a PDF report (cache misses).', ('variant',)
+)
+
+
+def record_ingest(source, rows, seconds):
+    """Count rows stored by an upload ('upload', 'append' or 'bulk')"""
+    ROWS_INGESTED.inc(rows, source)
+    INGEST_DURATION.observe(seconds, source)
+    if seconds > 0:
+        INGEST_ROWS_PER_SECOND.observe(rows / seconds, source)
+
+
+def render():
+    """Every metric in the Prometheus text exposition format"""
+    totals = _collect()
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render(totals))
+    return '\n'.join(lines) + '\n'
+
@@ -0,0 +1,145 @@
+"""
+Custom middleware for the API.
+"""
+import contextvars
+import re
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+from . import metrics
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+re_accepts_br = re.compile(r'\bbr\b')
+
+
+class BrotliMiddleware(MiddlewareMixin):
+    """Compress responses with Brotli for clients that accept it
+
+    Mirrors django.middleware.gzip.GZipMiddleware. List it after
+    GZipMiddleware so it sees the response first; GZip then leaves the
+    already encoded response alone. Does nothing if brotli isn't installed.
+    """
+    min_length = 200
+    quality = 5
+
+    def process_response(self, request, response):
+        if brotli is None or response.streaming or len(response.content) < self.min_length:
+            return response
+        if response.has_header('Content-Encoding'):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        if not re_accepts_br.search(request.META.get('HTTP_ACCEPT_ENCODING', '')):
+            return response
+
+        compressed = brotli.compress(response.content, quality=self.quality)
+        if len(compressed) >= len(response.content):
+            return response
+
+        response.content = compressed
+        response.headers['Content-Length'] = str(len(compressed))
+
+        # The body changed, so a strong ETag no longer applies
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = 'br'
+        return response
+
+
+# [queries, seconds] of the current request, followed into the threads running its queries
+_request_queries = contextvars.ContextVar('request_queries', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    queries = _request_queries.get()
+    if queries is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        queries[0] += 1
+        queries[1] += time.perf_counter() - start
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    # Connections are reopened on the same wrapper object
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class MetricsMiddleware:
+    """Record latency, SQL queries and response size of every request
+
+    List it first, so the time includes the other middleware and the size
+    is measured after compression. Set METRICS_ENABLED = False to leave it
+    out. See metrics.py.
+
+    Works under WSGI and ASGI. Queries are counted on every connection
+    through a context variable, so the queries of a view offloaded to
+    another thread (see offload.py) count for its request.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'METRICS_ENABLED', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        connection_created.connect(install_query_recorder, dispatch_uid='api.metrics.queries')
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+
+        # This thread's connection may have been opened before the signal was connected
+        install_query_recorder(None, connection)
+        queries = [0, 0.0]
+        token = _request_queries.set(queries)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_queries.reset(token)
+        self.record(request, response, time.perf_counter() - start, queries)
+        return response
+
+    async def __acall__(self, request):
+        queries = [0, 0.0]
+        token = _request_queries.set(queries)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_queries.reset(token)
+        self.record(request, response, time.perf_counter() - start, queries)
+        return response
+
+    def record(self, request, response, elapsed, queries):
+        match = request.resolver_match
+        view = match.view_name if match is not None else 'unmatched'
+        metrics.REQUEST_DURATION.observe(elapsed, view, request.method)
+        metrics.REQUESTS.inc(1, view, request.method, str(response.status_code))
+        metrics.REQUEST_QUERIES.observe(queries[0], view)
+        metrics.REQUEST_QUERY_SECONDS.observe(queries[1], view)
+
+        if not response.streaming:
+            metrics.RESPONSE_BYTES.observe(len(response.content), view)
+        elif response.has_header('Content-Length'):
+            metrics.RESPONSE_BYTES.observe(int(response['Content-Length']), view)
@@ -0,0 +1,91 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:59
+
+import math
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+COLUMN_FIELDS = {
+    'Equipment Name': 'name',
+    'Type': 'type',
+    'Flowrate': 'flowrate',
+    'Pressure': 'pressure',
+    'Temperature': 'temperature',
+}
+NUMERIC_FIELDS = {'flowrate', 'pressure', 'temperature'}
+
+
+def _clean(field, value):
+    # JSON rows may hold NaN for blank cells
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None if field in NUMERIC_FIELDS else ''
+    return value if field in NUMERIC_FIELDS else str(value)
+
+
+def copy_rows_to_records(apps, schema_editor):
+    Dataset = apps.get_model('api', 'Dataset')
+    EquipmentRecord = apps.get_model('api', 'EquipmentRecord')
+    for dataset in Dataset.objects.all().iterator():
+        EquipmentRecord.objects.bulk_create(
+            [
+                EquipmentRecord(
+                    dataset=dataset,
+                    **{field: _clean(field, row.get(column)) for column, field in COLUMN_FIELDS.items()}
+                )
+                for row in dataset.data or []
+            ],
+            batch_size=5000,
+        )
+
+
+def copy_records_to_rows(apps, schema_editor):
+    Dataset = apps.get_model('api', 'Dataset')
+    EquipmentRecord = apps.get_model('api', 'EquipmentRecord')
+    for dataset in Dataset.objects.all().iterator():
+        values = EquipmentRecord.objects.filter(dataset=dataset).order_by('id').values_list(
+            *COLUMN_FIELDS.values()
+        )
+        dataset.data = [
+            # Blank text cells were None in the JSON rows
+            {column: value if value != '' else None for column, value in zip(COLUMN_FIELDS, row)}
+            for row in values.iterator()
+        ]
+        dataset.save(update_fields=['data'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EquipmentRecord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(blank=True, max_length=255)),
+                ('type', models.CharField(blank=True, max_length=100)),
+                ('flowrate', models.FloatField(blank=True, null=True)),
+                ('pressure', models.FloatField(blank=True, null=True)),
+                ('temperature', models.FloatField(blank=True, null=True)),
+                ('dataset', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='records', to='api.dataset')),
+            ],
+            options={
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['dataset', 'type'], name='api_equipme_dataset_325704_idx'), models.Index(fields=['dataset', 'name'], name='api_equipme_dataset_28c3d4_idx')],
+            },
+        ),
+        migrations.RunPython(copy_rows_to_records, copy_records_to_rows),
+        # Lets the reverse migration add the column back to existing datasets
+        # before copy_records_to_rows fills it
+        migrations.AlterField(
+            model_name='dataset',
+            name='data',
+            field=models.JSONField(default=list),
+        ),
+        migrations.RemoveField(
+            model_name='dataset',
+            name='data',
+        ),
+    ]
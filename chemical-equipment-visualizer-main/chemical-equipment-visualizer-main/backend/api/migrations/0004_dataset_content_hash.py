@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_ingestionjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataset',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+    ]
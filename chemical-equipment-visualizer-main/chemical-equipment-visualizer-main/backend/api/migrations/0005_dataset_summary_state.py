@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_dataset_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataset',
+            name='summary_state',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='dataset',
+            name='updated_date',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
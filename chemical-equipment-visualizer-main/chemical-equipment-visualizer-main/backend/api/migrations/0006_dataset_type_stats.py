@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_dataset_summary_state'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataset',
+            name='type_stats',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
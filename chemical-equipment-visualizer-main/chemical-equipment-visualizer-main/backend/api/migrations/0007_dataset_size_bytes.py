@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_dataset_type_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataset',
+            name='size_bytes',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
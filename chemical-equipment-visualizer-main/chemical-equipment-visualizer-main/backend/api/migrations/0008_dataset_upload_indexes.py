@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:12
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_dataset_size_bytes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='dataset',
+            name='user',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='dataset',
+            index=models.Index(fields=['upload_date', 'id'], name='api_dataset_upload_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dataset',
+            index=models.Index(fields=['user', 'upload_date', 'id'], name='api_dataset_user_upload_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_dataset_upload_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataset',
+            name='validation',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
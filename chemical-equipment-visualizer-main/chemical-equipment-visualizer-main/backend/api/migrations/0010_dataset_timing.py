@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_dataset_validation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadTiming',
+            fields=[
+            ],
+            options={
+                'verbose_name': 'upload timing',
+                'verbose_name_plural': 'slowest uploads',
+                'proxy': True,
+                'indexes': [],
+                'constraints': [],
+            },
+            bases=('api.dataset',),
+        ),
+        migrations.AddField(
+            model_name='dataset',
+            name='timing',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='dataset',
+            name='upload_seconds',
+            field=models.FloatField(blank=True, db_index=True, null=True),
+        ),
+    ]
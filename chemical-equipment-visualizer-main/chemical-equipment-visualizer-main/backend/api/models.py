@@ -1,25 +1,121 @@
+import uuid
+
 from django.db import models
 from django.contrib.auth.models import User
-import json
 
 class Dataset(models.Model):
     filename = models.CharField(max_length=255)
     upload_date = models.DateTimeField(auto_now_add=True)
-    data = models.JSONField()  # Store the CSV data as JSON
+    updated_date = models.DateTimeField(auto_now=True)  # Changes when rows are appended
     summary = models.JSONField()  # Store computed statistics
-    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
+    summary_state = models.JSONField(default=dict, blank=True)  # Mergeable form of summary, see stats.py
+    type_stats = models.JSONField(default=dict, blank=True)  # Per-type count/mean/std/min/max/percentiles
+    validation = models.JSONField(default=dict, blank=True)  # Flagged cells of the upload, see validation.py
+    # Indexed by the (user, upload_date) index below
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, db_index=False)
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)  # SHA-256 of the uploaded file
+    size_bytes = models.PositiveBigIntegerField(default=0)  # Size of the uploaded CSV data
+    timing = models.JSONField(default=dict, blank=True)  # Stage timings of the upload, see tracing.py
+    upload_seconds = models.FloatField(null=True, blank=True, db_index=True)  # timing['wall'], for sorting
     
     class Meta:
         ordering = ['-upload_date']
+        indexes = [
+            # Newest-first listing and retention; id breaks ties of equal dates
+            models.Index(fields=['upload_date', 'id'], name='api_dataset_upload_idx'),
+            # Per-user listing and retention
+            models.Index(fields=['user', 'upload_date', 'id'], name='api_dataset_user_upload_idx'),
+        ]
     
     def __str__(self):
         return f"{self.filename} - {self.upload_date.strftime('%Y-%m-%d %H:%M')}"
     
+    def get_rows(self, limit=None):
+        """Return the equipment rows as dicts keyed by CSV column name"""
+        records = self.records.all()
+        if limit is not None:
+            records = records[:limit]
+        return records_to_rows(records)
+    
     @classmethod
     def cleanup_old_datasets(cls):
-        """Keep only the last 5 datasets"""
-        datasets = cls.objects.all()
-        if datasets.count() > 5:
-            old_datasets = datasets[5:]
-            for dataset in old_datasets:
-                dataset.delete()
\ No newline at end of file
+        """Apply the retention policy, by default keeping only the last 5 datasets"""
+        from .retention import enforce_retention  # retention imports this module
+        return enforce_retention()
+
+
+class UploadTiming(Dataset):
+    """Datasets seen through their upload timings, for the slowest uploads admin"""
+    class Meta:
+        proxy = True
+        verbose_name = 'upload timing'
+        verbose_name_plural = 'slowest uploads'
+
+
+class EquipmentRecord(models.Model):
+    """A single CSV row belonging to a dataset"""
+    # CSV column name -> model field
+    COLUMN_FIELDS = {
+        'Equipment Name': 'name',
+        'Type': 'type',
+        'Flowrate': 'flowrate',
+        'Pressure': 'pressure',
+        'Temperature': 'temperature',
+    }
+    
+    dataset = models.ForeignKey(Dataset, on_delete=models.CASCADE, related_name='records')
+    name = models.CharField(max_length=255, blank=True)
+    type = models.CharField(max_length=100, blank=True)
+    flowrate = models.FloatField(null=True, blank=True)
+    pressure = models.FloatField(null=True, blank=True)
+    temperature = models.FloatField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['dataset', 'type']),
+            models.Index(fields=['dataset', 'name']),
+        ]
+    
+    def __str__(self):
+        return f"{self.name} ({self.type})"
+    
+    def to_row(self):
+        return {column: getattr(self, field) for column, field in self.COLUMN_FIELDS.items()}
+
+
+def records_to_rows(records):
+    """Convert an EquipmentRecord queryset into dicts keyed by CSV column name"""
+    columns = list(EquipmentRecord.COLUMN_FIELDS)
+    values = records.values_list(*EquipmentRecord.COLUMN_FIELDS.values())
+    return [dict(zip(columns, row)) for row in values]
+
+
+class IngestionJob(models.Model):
+    """A CSV upload processed in the background worker pool"""
+    STATE_QUEUED = 'queued'
+    STATE_RUNNING = 'running'
+    STATE_SUCCEEDED = 'succeeded'
+    STATE_FAILED = 'failed'
+    STATE_CHOICES = [
+        (STATE_QUEUED, 'Queued'),
+        (STATE_RUNNING, 'Running'),
+        (STATE_SUCCEEDED, 'Succeeded'),
+        (STATE_FAILED, 'Failed'),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    filename = models.CharField(max_length=255)
+    state = models.CharField(max_length=16, choices=STATE_CHOICES, default=STATE_QUEUED)
+    rows_processed = models.PositiveBigIntegerField(default=0)
+    dataset = models.ForeignKey(Dataset, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    error = models.TextField(blank=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
+    created_date = models.DateTimeField(auto_now_add=True)
+    updated_date = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['-created_date']
+    
+    def __str__(self):
+        return f"{self.filename} ({self.state})"
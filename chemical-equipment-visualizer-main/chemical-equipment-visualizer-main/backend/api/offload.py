@@ -0,0 +1,108 @@
+"""
+Async serving of the dataset endpoints.
+
+Under ASGI (config/asgi.py sets ASYNC_VIEWS), the router's views are
+wrapped by offload(): the async view awaits the DRF view on a bounded
+thread pool, where it parses, queries and renders, and then returns. The
+request body has already been received by Django's ASGI handler without
+a thread, and a streamed response (PDF reports) is read from disk chunk
+by chunk on the pool. A slow client, or a request queued behind busy
+workers, therefore holds only a coroutine, while at most ASYNC_WORKERS
+threads (one per CPU by default) run pandas and ReportLab work and hold
+database connections.
+
+Django's async ORM would run each query on a thread as well, so queries
+stay in the offloaded views rather than being split between the event
+loop and the pool. The pool runs threads, not processes, because views
+need the ORM; pyarrow's CSV reader and most of numpy release the GIL.
+"""
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.urls import URLPattern
+from django.views.decorators.csrf import csrf_exempt
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_workers():
+    return getattr(settings, 'ASYNC_WORKERS', None) or os.cpu_count() or 1
+
+
+def get_executor():
+    """Return the process-wide pool of offloaded views, creating it on first use"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=get_workers(), thread_name_prefix='offload')
+        return _executor
+
+
+def _call(func, args, kwargs):
+    # Like a request in a sync worker: expired connections are replaced
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run(func, *args, **kwargs):
+    """Await func(*args, **kwargs) on the pool
+
+    It runs in a copy of the caller's context, so e.g. the metrics
+    middleware still counts the request's queries.
+    """
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        get_executor(), functools.partial(context.run, _call, func, args, kwargs)
+    )
+
+
+async def _iterate(iterator):
+    """Yield the chunks of a sync iterator, each one read on the pool"""
+    done = object()
+    while True:
+        chunk = await run(next, iterator, done)
+        if chunk is done:
+            return
+        yield chunk
+
+
+def _respond(view, request, args, kwargs):
+    response = view(request, *args, **kwargs)
+    # DRF responses are rendered here rather than on the event loop
+    if hasattr(response, 'render') and callable(response.render):
+        response = response.render()
+    return response
+
+
+def offload(view):
+    """Async version of a sync view, run on the pool"""
+    async def async_view(request, *args, **kwargs):
+        response = await run(_respond, view, request, args, kwargs)
+        if response.streaming and not response.is_async:
+            # Django would read a sync iterator to the end before sending
+            response.streaming_content = _iterate(iter(response.streaming_content))
+        return response
+
+    # DRF checks CSRF itself for session-authenticated requests
+    if getattr(view, 'csrf_exempt', False):
+        async_view = csrf_exempt(async_view)
+    return async_view
+
+
+def offload_patterns(patterns):
+    """Copies of URL patterns with their views offloaded"""
+    return [
+        URLPattern(pattern.pattern, offload(pattern.callback), pattern.default_args, pattern.name)
+        if isinstance(pattern, URLPattern) else pattern
+        for pattern in patterns
+    ]
@@ -0,0 +1,85 @@
+"""
+Binary renderers for dataset payloads.
+
+Both are optional: a renderer is only offered when its library
+(msgpack, pyarrow) is installed, otherwise clients get JSON as before.
+"""
+import json
+
+from rest_framework.renderers import BaseRenderer
+
+from .models import EquipmentRecord
+from .stats import NUMERIC_COLUMNS
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+
+class MessagePackRenderer(BaseRenderer):
+    """Same structure as the JSON response, encoded as MessagePack"""
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, use_bin_type=True)
+
+
+class ArrowStreamRenderer(BaseRenderer):
+    """Rows as a typed, columnar Arrow IPC stream
+
+    The row list ('data' for a dataset, 'results' for a window of rows)
+    becomes the record batch; every other key is JSON-encoded into the
+    schema metadata under b'meta'.
+    """
+    media_type = 'application/vnd.apache.arrow.stream'
+    format = 'arrow'
+    charset = None
+    render_style = 'binary'
+
+    ROW_KEYS = ('data', 'results')
+
+    def get_schema(self):
+        return pa.schema([
+            (column, pa.float64() if column in NUMERIC_COLUMNS else pa.string())
+            for column in EquipmentRecord.COLUMN_FIELDS
+        ])
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        rows, meta = [], data
+        if isinstance(data, dict):
+            meta = dict(data)
+            for key in self.ROW_KEYS:
+                if key in meta:
+                    rows = meta.pop(key)
+                    break
+
+        schema = self.get_schema().with_metadata({b'meta': json.dumps(meta).encode()})
+        table = pa.Table.from_pylist(rows, schema=schema)
+
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+
+
+# Renderers offered next to JSON by the dataset and rows endpoints
+PAYLOAD_RENDERERS = [
+    renderer for renderer, library in (
+        (ArrowStreamRenderer, pa),
+        (MessagePackRenderer, msgpack),
+    ) if library is not None
+]
@@ -0,0 +1,322 @@
+"""
+PDF report rendering and the on-disk report cache.
+
+Rendered reports are stored under REPORT_CACHE_DIR, named after the
+dataset id, the report variant, the dataset's last modification time and
+REPORT_TEMPLATE_VERSION. Bump the version whenever the layout changes so
+stale files are no longer served.
+
+Rendering a full report takes time proportional to the number of rows,
+so large ones are rendered on the worker pool (render_in_background) and
+the download is retried until the file is in the cache.
+"""
+import glob
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+from reportlab.lib.pagesizes import letter
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib import colors
+
+from . import metrics
+from .frames import frame_rows, iter_frames
+from .jobs import get_executor
+
+REPORT_TEMPLATE_VERSION = 1
+DEFAULT_ROWS_PER_TABLE = 40
+DEFAULT_BACKGROUND_ROWS = 20000
+# Suggested wait before downloading a report rendered in the background again
+RETRY_AFTER_SECONDS = 5
+
+logger = logging.getLogger(__name__)
+
+# Report path -> None while queued or rendering in this process, or the
+# error of its failed rendering
+_background = {}
+_background_lock = threading.Lock()
+
+
+class ReportRenderError(Exception):
+    """Raised when the background rendering of a report failed"""
+
+
+def format_value(value):
+    """Format a numeric cell for the PDF, blank cells are stored as NULL"""
+    return 'N/A' if value is None else f"{value:.2f}"
+
+
+def _table_style(header_font_size):
+    return TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), header_font_size),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black)
+    ])
+
+
+def _summary_elements(dataset, styles):
+    """Title, summary statistics and type distribution shared by all reports"""
+    elements = []
+    
+    # Title
+    title = Paragraph(f"<b>Chemical Equipment Report</b><br/>{dataset.filename}", styles['Title'])
+    elements.append(title)
+    elements.append(Spacer(1, 12))
+    
+    # Summary statistics
+    summary_text = f"""
+    <b>Summary Statistics</b><br/>
+    Total Equipment: {dataset.summary['total_count']}<br/>
+    Average Flowrate: {dataset.summary['avg_flowrate']:.2f}<br/>
+    Average Pressure: {dataset.summary['avg_pressure']:.2f}<br/>
+    Average Temperature: {dataset.summary['avg_temperature']:.2f}<br/>
+    """
+    elements.append(Paragraph(summary_text, styles['Normal']))
+    elements.append(Spacer(1, 12))
+    
+    # Equipment type distribution
+    elements.append(Paragraph("<b>Equipment Type Distribution</b>", styles['Heading2']))
+    type_data = [['Type', 'Count']]
+    for eq_type, count in dataset.summary['type_distribution'].items():
+        type_data.append([eq_type, str(count)])
+    
+    type_table = Table(type_data)
+    type_table.setStyle(_table_style(14))
+    elements.append(type_table)
+    elements.append(Spacer(1, 12))
+    return elements
+
+
+def _equipment_table(rows):
+    data_table = [['Name', 'Type', 'Flowrate', 'Pressure', 'Temp']]
+    for row in rows:
+        data_table.append([
+            row['Equipment Name'],
+            row['Type'],
+            format_value(row['Flowrate']),
+            format_value(row['Pressure']),
+            format_value(row['Temperature'])
+        ])
+    
+    equipment_table = Table(data_table, repeatRows=1)
+    style = _table_style(10)
+    style.add('FONTSIZE', (0, 1), (-1, -1), 8)
+    equipment_table.setStyle(style)
+    return equipment_table
+
+
+def build_summary_report(dataset, output):
+    """Render the summary report (statistics and first 10 rows) into output"""
+    doc = SimpleDocTemplate(output, pagesize=letter)
+    styles = getSampleStyleSheet()
+    elements = _summary_elements(dataset, styles)
+    
+    # Equipment data table (first 10 rows)
+    elements.append(Paragraph("<b>Equipment Data (First 10 Rows)</b>", styles['Heading2']))
+    elements.append(_equipment_table(dataset.get_rows(limit=10)))
+    
+    doc.build(elements)
+
+
+class LazyFlowables(list):
+    """Flowable list that is refilled from an iterator as the build consumes it
+
+    ReportLab's build loop only ever looks at the front of the list, so
+    keeping a couple of flowables buffered is enough. This bounds memory to
+    one page-sized table at a time instead of the whole document.
+    """
+
+    def __init__(self, flowables, iterator, buffered=2):
+        super().__init__(flowables)
+        self.iterator = iterator
+        self.buffered = buffered
+
+    def _fill(self):
+        while self.iterator is not None and list.__len__(self) < self.buffered:
+            try:
+                self.append(next(self.iterator))
+            except StopIteration:
+                self.iterator = None
+
+    def __len__(self):
+        self._fill()
+        return super().__len__()
+
+    def __getitem__(self, index):
+        self._fill()
+        return super().__getitem__(index)
+
+
+def _iter_equipment_tables(dataset, rows_per_table):
+    rows = []
+    # Chunks of a dataset too large for the frame cache needn't align with tables
+    for frame in iter_frames(dataset):
+        for start in range(0, len(frame), rows_per_table):
+            rows.extend(frame_rows(frame.iloc[start:start + rows_per_table]))
+            if len(rows) >= rows_per_table:
+                yield _equipment_table(rows[:rows_per_table])
+                rows = rows[rows_per_table:]
+    if rows:
+        yield _equipment_table(rows)
+
+
+def build_full_report(dataset, output):
+    """Render a report listing every row, one page-sized table at a time"""
+    rows_per_table = getattr(settings, 'REPORT_ROWS_PER_TABLE', DEFAULT_ROWS_PER_TABLE)
+    doc = SimpleDocTemplate(output, pagesize=letter, pageCompression=1)
+    styles = getSampleStyleSheet()
+    elements = _summary_elements(dataset, styles)
+    elements.append(Paragraph(
+        f"<b>Equipment Data (All {dataset.summary['total_count']} Rows)</b>", styles['Heading2']
+    ))
+    
+    doc.build(LazyFlowables(elements, _iter_equipment_tables(dataset, rows_per_table)))
+
+
+def get_cache_dir():
+    return getattr(settings, 'REPORT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'report_cache'))
+
+
+def _stamp(dataset):
+    return int(dataset.updated_date.timestamp() * 1000000)
+
+
+def report_path(dataset, variant='summary'):
+    filename = f'{dataset.pk}-{variant}-{_stamp(dataset)}-v{REPORT_TEMPLATE_VERSION}.pdf'
+    return os.path.join(get_cache_dir(), filename)
+
+
+def get_report(dataset, variant='summary'):
+    """Return the path of the rendered report, rendering it on a cache miss"""
+    path = report_path(dataset, variant)
+    if os.path.exists(path):
+        return path
+
+    cache_dir = get_cache_dir()
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # Render to a temporary file and rename, so concurrent readers never
+    # see a partially written report
+    fd, tmp_path = tempfile.mkstemp(suffix='.pdf.tmp', dir=cache_dir)
+    start = time.perf_counter()
+    try:
+        with os.fdopen(fd, 'wb') as output:
+            REPORT_BUILDERS[variant](dataset, output)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    metrics.PDF_RENDER_DURATION.observe(time.perf_counter() - start, variant)
+
+    # Drop reports rendered for earlier versions of this dataset
+    for stale in glob.glob(os.path.join(cache_dir, f'{dataset.pk}-{variant}-*.pdf')):
+        if stale != path:
+            _remove(stale)
+    return path
+
+
+def cached_report(dataset, variant='summary'):
+    """Path of the rendered report if it is in the cache, else None"""
+    path = report_path(dataset, variant)
+    return path if os.path.exists(path) else None
+
+
+def renders_in_background(dataset, variant):
+    """Whether a download should not wait for this report to be rendered"""
+    limit = getattr(settings, 'REPORT_BACKGROUND_ROWS', DEFAULT_BACKGROUND_ROWS)
+    return variant == 'full' and limit is not None and dataset.summary.get('total_count', 0) > limit
+
+
+def _render_in_worker(dataset, variant, path):
+    error = None
+    try:
+        # Retention may have removed the dataset before the worker got to it
+        if type(dataset).objects.filter(pk=dataset.pk).exists():
+            get_report(dataset, variant)
+    except Exception as e:
+        logger.exception('Rendering report %s failed', path)
+        error = str(e) or type(e).__name__
+    finally:
+        with _background_lock:
+            if error is None:
+                _background.pop(path, None)
+            else:
+                _background[path] = error
+        connection.close()
+
+
+def render_in_background(dataset, variant='full'):
+    """Queue the rendering of a report on the worker pool
+
+    A report already queued or rendering in this process isn't queued
+    again. If its last rendering failed, ReportRenderError is raised and
+    the next call queues it again.
+    """
+    path = report_path(dataset, variant)
+    with _background_lock:
+        if path in _background:
+            error = _background[path]
+            if error is not None:
+                del _background[path]
+                raise ReportRenderError(error)
+            return
+        _background[path] = None
+    get_executor().submit(_render_in_worker, dataset, variant, path)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def evict_reports(dataset_ids):
+    """Delete every cached report of the given datasets"""
+    cache_dir = get_cache_dir()
+    for dataset_id in dataset_ids:
+        for path in glob.glob(os.path.join(cache_dir, f'{dataset_id}-*.pdf')):
+            _remove(path)
+
+
+def evict_deleted_dataset(sender, instance, **kwargs):
+    """post_delete receiver: evict the reports of a deleted dataset once the delete commits
+
+    Connected in ApiConfig.ready(), so API, admin and retention deletes
+    all go through it.
+    """
+    dataset_id = instance.pk
+    transaction.on_commit(lambda: evict_reports([dataset_id]))
+
+
+def prerender_report(dataset):
+    """Worker entry point: render the default report ahead of the first download"""
+    try:
+        # Retention may have removed the dataset before the worker got to it
+        if type(dataset).objects.filter(pk=dataset.pk).exists():
+            get_report(dataset)
+    finally:
+        connection.close()
+
+
+def schedule_prerender(dataset):
+    """Render the report in the background once the current transaction commits"""
+    if not getattr(settings, 'REPORT_PRERENDER', False):
+        return
+    transaction.on_commit(lambda: get_executor().submit(prerender_report, dataset))
+
+
+REPORT_BUILDERS = {
+    'summary': build_summary_report,
+    'full': build_full_report,
+}
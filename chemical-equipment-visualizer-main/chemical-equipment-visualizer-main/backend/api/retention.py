@@ -0,0 +1,143 @@
+"""
+Dataset retention.
+
+The policy comes from settings.DATASET_RETENTION; every limit is optional:
+
+    MAX_COUNT        keep only the newest N datasets
+    MAX_AGE_DAYS     delete datasets uploaded more than N days ago
+    MAX_TOTAL_BYTES  keep the newest datasets whose uploads add up to N bytes
+    MAX_PER_USER     keep only the newest N datasets of each user (datasets
+                     uploaded anonymously count as one user)
+
+Expired datasets are selected with one query per limit and removed with a
+single set-based delete. Retention runs on the ingestion worker pool after
+an upload commits, or periodically with `manage.py enforce_retention`.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Sum, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from . import tracing
+from .caching import invalidate_datasets
+from .models import Dataset, EquipmentRecord
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POLICY = {
+    'MAX_COUNT': 5,
+    'MAX_AGE_DAYS': None,
+    'MAX_TOTAL_BYTES': None,
+    'MAX_PER_USER': None,
+}
+
+
+def get_policy():
+    return {**DEFAULT_POLICY, **getattr(settings, 'DATASET_RETENTION', {})}
+
+
+def _newest_first(queryset):
+    return queryset.order_by('-upload_date', '-id')
+
+
+def select_expired(policy=None, now=None):
+    """Return the set of dataset ids that fall outside the retention policy"""
+    policy = policy or get_policy()
+    now = now or timezone.now()
+    expired = set()
+
+    if policy['MAX_COUNT'] is not None:
+        ids = _newest_first(Dataset.objects.all()).values_list('id', flat=True)
+        expired.update(ids[policy['MAX_COUNT']:])
+
+    if policy['MAX_AGE_DAYS'] is not None:
+        cutoff = now - timedelta(days=policy['MAX_AGE_DAYS'])
+        expired.update(
+            Dataset.objects.filter(upload_date__lt=cutoff).values_list('id', flat=True)
+        )
+
+    if policy['MAX_TOTAL_BYTES'] is not None:
+        running_total = Window(
+            Sum('size_bytes'), order_by=[F('upload_date').desc(), F('id').desc()]
+        )
+        expired.update(
+            Dataset.objects.annotate(running_total=running_total)
+            .filter(running_total__gt=policy['MAX_TOTAL_BYTES'])
+            .values_list('id', flat=True)
+        )
+
+    if policy['MAX_PER_USER'] is not None:
+        position = Window(
+            RowNumber(), partition_by=[F('user')],
+            order_by=[F('upload_date').desc(), F('id').desc()],
+        )
+        expired.update(
+            Dataset.objects.annotate(position=position)
+            .filter(position__gt=policy['MAX_PER_USER'])
+            .values_list('id', flat=True)
+        )
+
+    return expired
+
+
+def delete_datasets(dataset_ids):
+    """Delete datasets and their rows in bulk, reporting what was reclaimed"""
+    report = {'datasets_deleted': 0, 'records_deleted': 0, 'bytes_reclaimed': 0}
+    if not dataset_ids:
+        return report
+
+    with transaction.atomic():
+        datasets = Dataset.objects.filter(id__in=dataset_ids)
+        report['bytes_reclaimed'] = datasets.aggregate(total=Sum('size_bytes'))['total'] or 0
+        # Their reports are evicted by reports.evict_deleted_dataset
+        _, deleted = datasets.delete()
+        invalidate_datasets(dataset_ids)
+
+    report['datasets_deleted'] = deleted.get(Dataset._meta.label, 0)
+    report['records_deleted'] = deleted.get(EquipmentRecord._meta.label, 0)
+    return report
+
+
+def enforce_retention(policy=None):
+    """Apply the retention policy now and return the reclaim report"""
+    report = delete_datasets(select_expired(policy))
+    if report['datasets_deleted']:
+        logger.info(
+            'Retention removed %(datasets_deleted)d datasets, %(records_deleted)d rows, '
+            '%(bytes_reclaimed)d bytes', report
+        )
+    return report
+
+
+def enforce_retention_traced(dataset_id):
+    """enforce_retention(), adding its time to the upload trace of dataset_id"""
+    trace = tracing.Trace()
+    with trace.span('cleanup'):
+        report = enforce_retention()
+    tracing.store(dataset_id, trace.to_dict(), merge_stored=True)
+    return report
+
+
+def _run_in_worker(traced_dataset=None):
+    try:
+        if traced_dataset is None:
+            enforce_retention()
+        else:
+            enforce_retention_traced(traced_dataset)
+    finally:
+        connection.close()
+
+
+def schedule_retention(traced_dataset=None):
+    """Enforce retention on the worker pool once the current transaction commits
+
+    traced_dataset is the id of the upload that triggered it, which gets
+    the time taken as its 'cleanup' stage.
+    """
+    # Imported here because jobs imports this module
+    from .jobs import get_executor
+    transaction.on_commit(lambda: get_executor().submit(_run_in_worker, traced_dataset))
@@ -1,12 +1,17 @@
 from rest_framework import serializers
-from .models import Dataset
+from .models import Dataset, IngestionJob
 from django.contrib.auth.models import User
 
 class DatasetSerializer(serializers.ModelSerializer):
+    data = serializers.SerializerMethodField()
+    
     class Meta:
         model = Dataset
-        fields = ['id', 'filename', 'upload_date', 'data', 'summary']
-        read_only_fields = ['upload_date']
+        fields = ['id', 'filename', 'upload_date', 'data', 'summary', 'validation']
+        read_only_fields = ['upload_date', 'validation']
+    
+    def get_data(self, obj):
+        return obj.get_rows()
 
 class DatasetListSerializer(serializers.ModelSerializer):
     """Lightweight serializer for listing datasets"""
@@ -14,6 +19,13 @@ class DatasetListSerializer(serializers.ModelSerializer):
         model = Dataset
         fields = ['id', 'filename', 'upload_date', 'summary']
 
+class IngestionJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = IngestionJob
+        fields = ['id', 'filename', 'state', 'rows_processed', 'dataset',
+                  'error', 'created_date', 'updated_date']
+        read_only_fields = fields
+
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
@@ -0,0 +1,270 @@
+"""
+Summary statistics for equipment datasets.
+
+SummaryAccumulator keeps the summary in a mergeable form: per numeric
+column a count, sum, Welford mean/M2, min and max, plus per-type counts
+and the same running stats per type and column. Two accumulators over
+disjoint rows merge exactly (Chan et al.), so the summary of a dataset
+can be extended with new rows without rescanning the old ones.
+
+TypeStatsCollector computes per-equipment-type statistics, including
+percentiles, which are not mergeable and so need every value of a column.
+It holds the rows it is given, so streaming ingestion only uses it in
+the background rescan (ingest.refresh_type_stats) and bulk parsing on a
+frame it holds anyway.
+"""
+import math
+
+import pandas as pd
+from pandas.api.types import is_numeric_dtype
+
+NUMERIC_COLUMNS = ['Flowrate', 'Pressure', 'Temperature']
+PERCENTILES = {'p50': 0.5, 'p95': 0.95, 'p99': 0.99}
+
+
+def _empty_column():
+    return {'count': 0, 'sum': 0.0, 'mean': 0.0, 'm2': 0.0, 'min': None, 'max': None}
+
+
+def _merge_column(left, right):
+    """Combine the running stats of two disjoint sets of values"""
+    if not right['count']:
+        return dict(left)
+    if not left['count']:
+        return dict(right)
+
+    count = left['count'] + right['count']
+    delta = right['mean'] - left['mean']
+    return {
+        'count': count,
+        'sum': left['sum'] + right['sum'],
+        'mean': left['mean'] + delta * right['count'] / count,
+        'm2': left['m2'] + right['m2'] + delta * delta * left['count'] * right['count'] / count,
+        'min': min(left['min'], right['min']),
+        'max': max(left['max'], right['max']),
+    }
+
+
+class SummaryAccumulator:
+    """Running, mergeable aggregates folded one DataFrame chunk at a time"""
+
+    def __init__(self):
+        self.total_count = 0
+        self.columns = {column: _empty_column() for column in NUMERIC_COLUMNS}
+        self.type_counts = {}
+        # type -> column -> running stats, for the moments of type_stats
+        self.type_columns = {}
+
+    @classmethod
+    def from_state(cls, state):
+        """Rebuild an accumulator from the dict produced by to_state()"""
+        accumulator = cls()
+        accumulator.total_count = state['total_count']
+        for column in NUMERIC_COLUMNS:
+            accumulator.columns[column] = dict(state['columns'][column])
+        accumulator.type_counts = dict(state['type_counts'])
+        accumulator.type_columns = {
+            eq_type: {column: dict(stats) for column, stats in columns.items()}
+            for eq_type, columns in state.get('type_columns', {}).items()
+        }
+        return accumulator
+
+    def to_state(self):
+        """JSON-serializable state, stored as Dataset.summary_state"""
+        return {
+            'total_count': self.total_count,
+            'columns': {column: dict(stats) for column, stats in self.columns.items()},
+            'type_counts': {str(eq_type): count for eq_type, count in self.type_counts.items()},
+            'type_columns': {
+                eq_type: {column: dict(stats) for column, stats in columns.items()}
+                for eq_type, columns in self.type_columns.items()
+            },
+        }
+
+    def update(self, chunk):
+        """Fold a DataFrame chunk into the running aggregates"""
+        self.total_count += len(chunk)
+
+        for column in NUMERIC_COLUMNS:
+            values = chunk[column]
+            if not is_numeric_dtype(values):
+                raise TypeError(f"Column '{column}' contains non-numeric values")
+
+            values = values.dropna()
+            if values.empty:
+                continue
+
+            mean = float(values.mean())
+            chunk_stats = {
+                'count': len(values),
+                'sum': float(values.sum()),
+                'mean': mean,
+                'm2': float(((values - mean) ** 2).sum()),
+                'min': float(values.min()),
+                'max': float(values.max()),
+            }
+            self.columns[column] = _merge_column(self.columns[column], chunk_stats)
+
+        # Insertion order follows first appearance, which keeps ties in the
+        # same order as pandas' value_counts()
+        types = chunk['Type']
+        if isinstance(types.dtype, pd.CategoricalDtype):
+            # Counted as values: categorical counts come in category order
+            # and include categories absent from this chunk
+            types = types.astype(object)
+        for eq_type, count in types.value_counts(sort=False).items():
+            self.type_counts[eq_type] = self.type_counts.get(eq_type, 0) + int(count)
+
+        self._update_types(chunk[NUMERIC_COLUMNS], types)
+
+    def _update_types(self, values, types):
+        """Fold the running stats of each type in a chunk"""
+        codes, uniques = pd.factorize(types)
+        # Rows without a type (code -1) aren't in any type's stats
+        known = codes >= 0
+        if not known.all():
+            values, codes = values[known], codes[known]
+
+        grouped = values.groupby(codes, sort=False)
+        counts, sums = grouped.count(), grouped.sum()
+        minimums, maximums = grouped.min(), grouped.max()
+        means = sums / counts
+        # Squared deviations from each row's type mean, NaN cells drop out
+        deviations = values.to_numpy() - means.loc[codes].to_numpy()
+        squares = pd.DataFrame(deviations ** 2, columns=values.columns).groupby(codes, sort=False).sum()
+
+        for code in counts.index:
+            columns = self.type_columns.setdefault(
+                str(uniques[code]), {column: _empty_column() for column in NUMERIC_COLUMNS}
+            )
+            for column in NUMERIC_COLUMNS:
+                count = int(counts.at[code, column])
+                if not count:
+                    continue
+                columns[column] = _merge_column(columns[column], {
+                    'count': count,
+                    'sum': float(sums.at[code, column]),
+                    'mean': float(means.at[code, column]),
+                    'm2': float(squares.at[code, column]),
+                    'min': float(minimums.at[code, column]),
+                    'max': float(maximums.at[code, column]),
+                })
+
+    def merge(self, other):
+        """Fold another accumulator over disjoint rows into this one"""
+        self.total_count += other.total_count
+        for column in NUMERIC_COLUMNS:
+            self.columns[column] = _merge_column(self.columns[column], other.columns[column])
+        for eq_type, count in other.type_counts.items():
+            self.type_counts[eq_type] = self.type_counts.get(eq_type, 0) + count
+        for eq_type, columns in other.type_columns.items():
+            merged = self.type_columns.setdefault(
+                eq_type, {column: _empty_column() for column in NUMERIC_COLUMNS}
+            )
+            for column in NUMERIC_COLUMNS:
+                merged[column] = _merge_column(merged[column], columns[column])
+
+    def _mean(self, column):
+        stats = self.columns[column]
+        return stats['sum'] / stats['count'] if stats['count'] else float('nan')
+
+    def _bound(self, column, key):
+        value = self.columns[column][key]
+        return float('nan') if value is None else value
+
+    def to_summary(self):
+        """Build the summary dict stored on Dataset"""
+        type_distribution = dict(
+            sorted(self.type_counts.items(), key=lambda item: item[1], reverse=True)
+        )
+        return {
+            'total_count': self.total_count,
+            'avg_flowrate': self._mean('Flowrate'),
+            'avg_pressure': self._mean('Pressure'),
+            'avg_temperature': self._mean('Temperature'),
+            'type_distribution': type_distribution,
+            'max_flowrate': self._bound('Flowrate', 'max'),
+            'min_flowrate': self._bound('Flowrate', 'min'),
+            'max_pressure': self._bound('Pressure', 'max'),
+            'min_pressure': self._bound('Pressure', 'min'),
+            'max_temperature': self._bound('Temperature', 'max'),
+            'min_temperature': self._bound('Temperature', 'min'),
+        }
+
+
+    def to_type_stats(self):
+        """Per-type stats like TypeStatsCollector.compute(), percentiles left None
+
+        Percentiles can't be merged, see ingest.refresh_type_stats().
+        """
+        type_stats = {}
+        for eq_type, columns in self.type_columns.items():
+            type_stats[eq_type] = {}
+            for column in NUMERIC_COLUMNS:
+                stats = columns[column]
+                count = stats['count']
+                type_stats[eq_type][column] = {
+                    'count': count,
+                    'mean': stats['mean'] if count else None,
+                    # Sample std (ddof=1) like pandas, undefined for one value
+                    'std': math.sqrt(stats['m2'] / (count - 1)) if count > 1 else None,
+                    'min': stats['min'],
+                    'max': stats['max'],
+                    **{name: None for name in PERCENTILES},
+                }
+        return dict(sorted(type_stats.items()))
+
+
+def _json_float(value):
+    # NaN (e.g. std of a single value) is not valid JSON
+    value = float(value)
+    return None if math.isnan(value) else value
+
+
+class TypeStatsCollector:
+    """Per-type count/mean/std/min/max/percentiles of each numeric column
+
+    Chunks are kept in a compact form (Type as category, numeric columns
+    only) and grouped once in compute().
+    """
+
+    def __init__(self):
+        self.frames = []
+
+    def update(self, chunk):
+        frame = chunk[['Type'] + NUMERIC_COLUMNS].copy()
+        frame['Type'] = frame['Type'].astype('category')
+        self.frames.append(frame)
+
+    def compute(self):
+        """Return {type: {column: {stat: value}}}"""
+        if not self.frames:
+            return {}
+
+        frame = pd.concat(self.frames, ignore_index=True)
+        self.frames = []
+        # Categories differ between chunks, so concat may fall back to object
+        frame['Type'] = frame['Type'].astype('category')
+
+        grouped = frame.groupby('Type', observed=True)[NUMERIC_COLUMNS]
+        aggregates = grouped.agg(['count', 'mean', 'std', 'min', 'max'])
+        quantiles = grouped.quantile(list(PERCENTILES.values()))
+
+        type_stats = {}
+        for eq_type, row in aggregates.iterrows():
+            type_stats[str(eq_type)] = {
+                column: {
+                    'count': int(row[(column, 'count')]),
+                    'mean': _json_float(row[(column, 'mean')]),
+                    'std': _json_float(row[(column, 'std')]),
+                    'min': _json_float(row[(column, 'min')]),
+                    'max': _json_float(row[(column, 'max')]),
+                    **{
+                        name: _json_float(quantiles.loc[(eq_type, q), column])
+                        for name, q in PERCENTILES.items()
+                    },
+                }
+                for column in NUMERIC_COLUMNS
+            }
+        # Category order depends on the parser, keep the output stable
+        return dict(sorted(type_stats.items()))
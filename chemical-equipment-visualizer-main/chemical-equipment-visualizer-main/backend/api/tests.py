@@ -1,3 +1,1210 @@
-from django.test import TestCase
+import contextlib
+import importlib
+import io
+import json
+import os
+import tempfile
+import zipfile
+from datetime import timedelta
+from unittest import mock, skipUnless
+from urllib.parse import urlencode
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+from asgiref.sync import iscoroutinefunction
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, connections
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import clear_url_caches, resolve
+from django.utils import timezone
+
+from config import urls as config_urls
+from . import (
+    bulk, caching, csvio, frames, ingest, jobs, metrics, middleware, offload, renderers, reports,
+    retention, tracing,
+)
+from . import urls as api_urls
+from .csvio import read_csv_chunks, read_valid_chunks
+from .histograms import compute_histogram
+from .models import Dataset, EquipmentRecord, IngestionJob
+from .stats import PERCENTILES, SummaryAccumulator, TypeStatsCollector
+from .validation import InvalidCellsError, ValidationReport
+
+HEADER = 'Equipment Name,Type,Flowrate,Pressure,Temperature\n'
+SAMPLE = HEADER + (
+    'Pump-1,Pump,100.0,5.0,80\n'
+    'Pump-2,Pump,120.0,5.5,85\n'
+    'Valve-1,Valve,60.0,4.0,70\n'
+    'Reactor-1,Reactor,150.5,2.5,350\n'
+)
+
+
+class APITestCase(TestCase):
+    def setUp(self):
+        # Dataset ids are reused once a test's transaction is rolled back
+        caching.get_cache().clear()
+
+    def upload(self, text, name='equipment.csv', **params):
+        url = '/api/datasets/upload/'
+        if params:
+            url += '?' + urlencode(params)
+        return self.client.post(url, {'file': SimpleUploadedFile(name, text.encode())})
+
+    def append(self, dataset_id, text, name='more.csv'):
+        return self.client.post(
+            f'/api/datasets/{dataset_id}/append/', {'file': SimpleUploadedFile(name, text.encode())}
+        )
+
+    def assertStatsAlmostEqual(self, first, second):
+        """Equal JSON stats, floats within a relative tolerance"""
+        if isinstance(first, dict):
+            self.assertEqual(first.keys(), second.keys())
+            for key in first:
+                self.assertStatsAlmostEqual(first[key], second[key])
+        elif isinstance(first, float) and isinstance(second, float):
+            self.assertAlmostEqual(first, second, delta=1e-9 * max(1.0, abs(first)))
+        else:
+            self.assertEqual(first, second)
+
+
+MORE = (
+    'Pump-3,Pump,95.5,4.8,78\n'
+    'Valve-2,Valve,65.0,,72\n'
+    'Tank-1,Tank,10.0,1.0,20\n'
+    'Pump-4,,90.0,5.2,82\n'
+)
+
+
+class StreamingSummaryTests(APITestCase):
+    @override_settings(CSV_INGEST_CHUNK_SIZE=7)
+    def test_matches_whole_frame_pandas(self):
+        rng = np.random.default_rng(1)
+        # Valve and Tank tie, their order must follow first appearance
+        types = ['Pump'] * 20 + ['Tank'] * 12 + ['Valve'] * 12 + ['Reactor'] * 6
+        rng.shuffle(types)
+        lines = [
+            f'E-{row},{eq_type},{rng.uniform(1, 200):.3f},{rng.uniform(0.5, 9):.3f},{rng.uniform(-20, 400):.2f}'
+            for row, eq_type in enumerate(types)
+        ]
+        text = HEADER + '\n'.join(lines) + '\n'
+        summary = self.upload(text).json()['summary']
+
+        df = pd.read_csv(io.StringIO(text))
+        self.assertEqual(summary['total_count'], len(df))
+        for column in ('Flowrate', 'Pressure', 'Temperature'):
+            described = df[column].describe()
+            self.assertAlmostEqual(summary[f'avg_{column.lower()}'], described['mean'], places=9)
+            self.assertEqual(summary[f'min_{column.lower()}'], described['min'])
+            self.assertEqual(summary[f'max_{column.lower()}'], described['max'])
+        counts = df['Type'].value_counts()
+        self.assertEqual(list(summary['type_distribution'].items()), list(counts.items()))
+
+
+class AppendTests(APITestCase):
+    def summary(self, dataset_id):
+        return self.client.get(f'/api/datasets/{dataset_id}/summary/').json()
+
+    def test_summary_matches_single_upload(self):
+        appended = self.upload(SAMPLE).json()['id']
+        response = self.append(appended, HEADER + MORE)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['rows_appended'], 4)
+        whole = self.upload(SAMPLE + MORE, 'whole.csv').json()['id']
+
+        summary = self.summary(appended)
+        expected = self.summary(whole)
+        self.assertEqual(summary.pop('type_stats').keys(), expected.pop('type_stats').keys())
+        self.assertStatsAlmostEqual(summary, expected)
+        # Ties are in order of first appearance, as in a single upload
+        self.assertEqual(list(summary['type_distribution']), list(expected['type_distribution']))
+
+    def test_merged_state_matches_single_pass(self):
+        frames = list(read_valid_chunks(io.BytesIO((SAMPLE + MORE).encode()), ValidationReport(), chunk_size=3))
+        single = SummaryAccumulator()
+        merged = SummaryAccumulator()
+        for frame in frames:
+            single.update(frame)
+            part = SummaryAccumulator()
+            part.update(frame)
+            merged.merge(SummaryAccumulator.from_state(part.to_state()))
+        self.assertStatsAlmostEqual(merged.to_state(), single.to_state())
+        self.assertStatsAlmostEqual(merged.to_summary(), single.to_summary())
+
+    def test_type_stats_match_pandas(self):
+        # Uploads stream without holding rows for the percentiles
+        with mock.patch.object(TypeStatsCollector, 'update', side_effect=AssertionError):
+            appended = self.upload(SAMPLE).json()['id']
+            self.assertEqual(self.append(appended, HEADER + MORE).status_code, 200)
+            whole = self.upload(SAMPLE + MORE, 'whole.csv').json()['id']
+
+        collector = TypeStatsCollector()
+        collector.update(pd.read_csv(io.StringIO(SAMPLE + MORE)))
+        expected = collector.compute()
+        moments = {
+            eq_type: {
+                column: {name: value for name, value in stats.items() if name not in PERCENTILES}
+                for column, stats in columns.items()
+            }
+            for eq_type, columns in expected.items()
+        }
+        for dataset_id in (appended, whole):
+            type_stats = self.summary(dataset_id)['type_stats']
+            for columns in type_stats.values():
+                for stats in columns.values():
+                    # Merged without rescanning, percentiles wait for the refresh
+                    self.assertEqual([stats.pop(name) for name in PERCENTILES], [None] * 3)
+            self.assertStatsAlmostEqual(type_stats, moments)
+
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertTrue(ingest.refresh_type_stats(dataset_id))
+            self.assertStatsAlmostEqual(self.summary(dataset_id)['type_stats'], expected)
+
+    def test_refresh_skips_dataset_appended_meanwhile(self):
+        dataset_id = self.upload(SAMPLE).json()['id']
+        self.append(dataset_id, HEADER + MORE)
+
+        def append_while_reading(dataset, chunk_size):
+            self.append(dataset_id, HEADER + 'Pump-5,Pump,1,2,3\n')
+            return {}
+
+        with mock.patch.object(ingest, 'compute_type_stats', side_effect=append_while_reading):
+            self.assertFalse(ingest.refresh_type_stats(dataset_id))
+        self.assertIsNone(self.summary(dataset_id)['type_stats']['Pump']['Flowrate']['p50'])
+
+
+class DeduplicationTests(APITestCase):
+    def test_identical_upload_returns_existing_dataset(self):
+        first = self.upload(SAMPLE)
+        self.assertEqual(first.status_code, 201)
+        records = EquipmentRecord.objects.count()
+
+        second = self.upload(SAMPLE, 'renamed.csv')
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.json()['id'], first.json()['id'])
+        self.assertEqual(EquipmentRecord.objects.count(), records)
+        self.assertEqual(Dataset.objects.count(), 1)
+
+    def test_changed_file_is_a_new_dataset(self):
+        first = self.upload(SAMPLE)
+        second = self.upload(SAMPLE + 'Tank-1,Tank,10,1,20\n')
+        self.assertEqual(second.status_code, 201)
+        self.assertNotEqual(second.json()['id'], first.json()['id'])
+
+    def test_same_file_of_another_user_is_a_new_dataset(self):
+        anonymous = self.upload(SAMPLE).json()['id']
+        self.client.force_login(User.objects.create_user('alice'))
+        response = self.upload(SAMPLE)
+        self.assertEqual(response.status_code, 201)
+        self.assertNotEqual(response.json()['id'], anonymous)
+        self.assertEqual(EquipmentRecord.objects.count(), 8)
+
+        self.client.force_login(User.objects.create_user('bob'))
+        self.assertEqual(self.upload(SAMPLE).status_code, 201)
+        self.assertEqual(Dataset.objects.count(), 3)
+
+
+class RowsTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.dataset_id = self.upload(SAMPLE + MORE).json()['id']
+
+    def rows(self, **params):
+        return self.client.get(f'/api/datasets/{self.dataset_id}/rows/?' + urlencode(params))
+
+    def names(self, **params):
+        response = self.rows(**params)
+        self.assertEqual(response.status_code, 200)
+        return [row['Equipment Name'] for row in response.json()['results']]
+
+    def test_filter_by_type(self):
+        self.assertEqual(self.names(type='Pump'), ['Pump-1', 'Pump-2', 'Pump-3'])
+
+    def test_filter_by_numeric_range(self):
+        # Inclusive bounds, upload order
+        self.assertEqual(
+            self.names(flowrate_min=60, flowrate_max=100),
+            ['Pump-1', 'Valve-1', 'Pump-3', 'Valve-2', 'Pump-4']
+        )
+        self.assertEqual(self.names(type='Valve', temperature_max=70), ['Valve-1'])
+
+    def test_sort_direction(self):
+        ascending = self.names(sort='Flowrate')
+        self.assertEqual(ascending[0], 'Tank-1')
+        self.assertEqual(self.names(sort='flowrate', order='desc'), ascending[::-1])
+        self.assertEqual(self.names(sort='name', order='desc')[0], 'Valve-2')
+
+    def test_limit_offset(self):
+        response = self.rows(sort='flowrate', limit=3, offset=2).json()
+        self.assertEqual(response['count'], 8)
+        self.assertEqual(
+            [row['Equipment Name'] for row in response['results']], ['Valve-2', 'Pump-4', 'Pump-3']
+        )
+        self.assertIsNotNone(response['next'])
+        self.assertIsNotNone(response['previous'])
+        self.assertEqual(self.rows(type='Pump', limit=2).json()['count'], 3)
+
+    def test_invalid_params(self):
+        for params in ({'sort': 'colour'}, {'sort': 'name', 'order': 'sideways'}, {'flowrate_min': 'abc'}):
+            response = self.rows(**params)
+            self.assertEqual(response.status_code, 400, params)
+            self.assertIn('error', response.json())
+        self.assertEqual(self.rows(sort='colour').json()['error'], "Cannot sort by 'colour'")
+
+
+class DatasetListTests(APITestCase):
+    def listed(self):
+        return [dataset['filename'] for dataset in self.client.get('/api/datasets/').json()]
+
+    def test_users_only_list_their_own_datasets(self):
+        alice, bob = User.objects.create_user('alice'), User.objects.create_user('bob')
+        self.client.force_login(alice)
+        self.upload(SAMPLE, 'alice.csv')
+        # Cached for alice first, bob must not be served her list
+        self.assertEqual(self.listed(), ['alice.csv'])
+
+        self.client.force_login(bob)
+        self.assertEqual(self.listed(), [])
+        with self.captureOnCommitCallbacks(execute=True), mock.patch.object(jobs, 'get_executor'):
+            self.upload(SAMPLE, 'bob.csv')
+            self.upload(HEADER + MORE, 'bob-more.csv')
+        self.assertEqual(self.listed(), ['bob-more.csv', 'bob.csv'])
+
+        self.client.logout()
+        self.assertEqual(self.listed(), [])
+
+    def test_lists_the_five_newest(self):
+        with mock.patch.object(jobs, 'get_executor'), \
+                override_settings(DATASET_RETENTION={'MAX_COUNT': None}):
+            for number in range(7):
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.upload(SAMPLE.replace('Pump-1', f'Pump-{number}'), f'{number}.csv')
+        self.assertEqual(self.listed(), ['6.csv', '5.csv', '4.csv', '3.csv', '2.csv'])
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Only applies to SQLite')
+class SQLitePragmaTests(TestCase):
+    def pragmas(self, name, *pragmas):
+        """Values of pragmas on a new connection to the database file name"""
+        settings_dict = {**connections['default'].settings_dict, 'NAME': name}
+        wrapper = type(connections['default'])(settings_dict, alias='pragmas')
+        try:
+            with wrapper.cursor() as cursor:
+                values = []
+                for pragma in pragmas:
+                    cursor.execute(f'PRAGMA {pragma}')
+                    values.append(cursor.fetchone()[0])
+                return values
+        finally:
+            wrapper.close()
+
+    def test_new_connections_get_the_pragmas(self):
+        # A file database, the test database is in memory and can't use WAL
+        with tempfile.TemporaryDirectory() as directory:
+            self.assertEqual(
+                self.pragmas(os.path.join(directory, 'db.sqlite3'), 'journal_mode', 'synchronous', 'busy_timeout'),
+                ['wal', 1, 20000]  # synchronous = NORMAL
+            )
+
+    @override_settings(SQLITE_PRAGMAS={'synchronous': 'FULL'})
+    def test_pragmas_come_from_settings(self):
+        self.assertEqual(self.pragmas(':memory:', 'synchronous'), [2])
+
+
+class ValidationTests(APITestCase):
+    FLAGGED = HEADER + (
+        'Pump-1,Pump,100,abc,80\n'
+        'Pump-2,Pump,-5,5,80\n'
+        'Pump-3,Pump,,5,80\n'
+        'Pump-4,Pump,1,2,3\n'
+        'Pump-5,Pump,1,x,3\n'
+    )
+    RULES = {
+        'Flowrate': {'missing': {'count': 1, 'rows': [2]}, 'out_of_range': {'count': 1, 'rows': [1]}},
+        'Pressure': {'invalid': {'count': 2, 'rows': [0, 4]}},
+    }
+
+    def test_invalid_cells_reject_upload(self):
+        response = self.upload(self.FLAGGED)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], '2 cells are not valid numbers')
+        validation = response.json()['validation']
+        self.assertEqual((validation['rows_checked'], validation['rows_flagged']), (5, 4))
+        self.assertEqual(validation['rules'], self.RULES)
+        self.assertFalse(Dataset.objects.exists())
+
+    @override_settings(CSV_INGEST_CHUNK_SIZE=2)
+    def test_rows_are_numbered_across_chunks(self):
+        self.assertEqual(self.upload(self.FLAGGED).json()['validation']['rules'], self.RULES)
+
+    def test_skip_invalid_drops_flagged_rows(self):
+        response = self.upload(self.FLAGGED, skip_invalid=1)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['validation']['rows_skipped'], 4)
+        self.assertEqual(response.json()['summary']['total_count'], 1)
+
+    def test_missing_and_out_of_range_cells_are_kept(self):
+        response = self.upload(HEADER + 'Pump-1,Pump,-5,5,80\nPump-2,Pump,,5,80\n')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['validation']['rules'], {
+            'Flowrate': {'missing': {'count': 1, 'rows': [1]}, 'out_of_range': {'count': 1, 'rows': [0]}}
+        })
+        self.assertEqual(response.json()['summary']['total_count'], 2)
+
+
+    def test_append_merges_the_stored_report(self):
+        dataset_id = self.upload(HEADER + 'Pump-1,Pump,-5,5,80\nPump-2,Pump,,5,80\n').json()['id']
+        appended = self.client.post(
+            f'/api/datasets/{dataset_id}/append/?skip_invalid=1',
+            {'file': SimpleUploadedFile('more.csv', (HEADER + MORE + 'Pump-5,Pump,1,x,3\n').encode())}
+        )
+        self.assertEqual(appended.status_code, 200)
+        # The response reports the appended file on its own
+        self.assertEqual(appended.json()['validation']['rules']['Pressure'], {
+            'missing': {'count': 1, 'rows': [1]}, 'invalid': {'count': 1, 'rows': [4]},
+        })
+
+        validation = self.client.get(f'/api/datasets/{dataset_id}/').json()['validation']
+        self.assertEqual(
+            (validation['rows_checked'], validation['rows_flagged'], validation['rows_skipped']), (7, 5, 3)
+        )
+        self.assertEqual(validation['rules'], {
+            'Flowrate': {'missing': {'count': 1, 'rows': [1]}, 'out_of_range': {'count': 1, 'rows': [0]}},
+            'Pressure': {'missing': {'count': 1, 'rows': [3]}, 'invalid': {'count': 1, 'rows': [6]}},
+            'Type': {'missing': {'count': 1, 'rows': [5]}},
+        })
+        self.assertEqual(Dataset.objects.get(pk=dataset_id).validation, validation)
+
+    def test_merged_reports_keep_the_example_limit(self):
+        first = ValidationReport.from_dict(
+            {'rows_checked': 5, 'rules': {'Pressure': {'missing': {'count': 2, 'rows': [1, 3]}}}},
+            max_examples=3,
+        )
+        second = ValidationReport(max_examples=3)
+        second.check(pd.DataFrame({'Pressure': [np.nan, np.nan, 1.0, np.nan]}))
+        first.merge(second)
+        self.assertEqual(first.to_dict()['rules'], {'Pressure': {'missing': {'count': 5, 'rows': [1, 3, 5]}}})
+        self.assertEqual(first.rows_checked, 9)
+
+class UploadTimingTests(APITestCase):
+    UPLOAD_STAGES = {'hash', 'read_csv', 'validate', 'summary', 'build_records', 'db_write', 'serialize'}
+
+    @override_settings(CSV_INGEST_CHUNK_SIZE=3)
+    def test_stages_are_stored_with_the_dataset(self):
+        dataset_id = self.upload(SAMPLE + MORE).json()['id']
+        dataset = Dataset.objects.get(pk=dataset_id)
+
+        self.assertEqual(set(dataset.timing['stages']), self.UPLOAD_STAGES)
+        self.assertLessEqual(self.UPLOAD_STAGES, set(tracing.STAGES))
+        # Once per chunk, added up
+        self.assertEqual(dataset.timing['stages']['build_records']['calls'], 3)
+        self.assertEqual(dataset.upload_seconds, dataset.timing['wall'])
+        stage_wall = sum(stage['wall'] for stage in dataset.timing['stages'].values())
+        self.assertLessEqual(stage_wall, dataset.timing['wall'] + 1e-3)
+
+    def test_bulk_uploads_add_parse_and_store_stages(self):
+        response = self.client.post(
+            '/api/datasets/bulk_upload/', {'files': [zip_upload({'a.csv': SAMPLE})]}
+        )
+        dataset = Dataset.objects.get(pk=response.json()['results'][0]['dataset'])
+        # Parsed in a pool worker, stored by the request
+        self.assertLessEqual(
+            {'read_csv', 'summary', 'hash', 'build_records', 'db_write'}, set(dataset.timing['stages'])
+        )
+        self.assertEqual(dataset.upload_seconds, dataset.timing['wall'])
+
+    def test_changelist_renders_the_slowest_uploads(self):
+        fast = self.upload(SAMPLE, 'fast.csv').json()['id']
+        slow = self.upload(HEADER + MORE, 'slow.csv').json()['id']
+        Dataset.objects.filter(pk=slow).update(upload_seconds=60)
+        Dataset.objects.filter(pk=fast).update(upload_seconds=1)
+        # Created without a trace, left out of the list
+        Dataset.objects.create(filename='untraced.csv', summary={})
+
+        self.client.force_login(User.objects.create_superuser('admin'))
+        response = self.client.get('/admin/api/uploadtiming/')
+        self.assertEqual(response.status_code, 200)
+        listed = [dataset.filename for dataset in response.context_data['cl'].result_list]
+        self.assertEqual(listed, ['slow.csv', 'fast.csv'])
+        stage_summary = response.context_data['stage_summary']
+        self.assertEqual(stage_summary['uploads'], 2)
+        self.assertIn('db_write', [stage['stage'] for stage in stage_summary['stages']])
+        self.assertContains(response, 'Stages of the 2 slowest uploads')
+        self.assertNotContains(response, 'untraced.csv')
+
+
+class MetricsTests(APITestCase):
+    def scrape(self):
+        """Samples of the exposition, keyed by name and labels"""
+        response = self.client.get('/api/metrics/')
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        samples = {}
+        for line in response.content.decode().splitlines():
+            if not line.startswith('#'):
+                key, value = line.rsplit(' ', 1)
+                samples[key] = float(value)
+        return response.content.decode(), samples
+
+    def test_exposition(self):
+        dataset_id = self.upload(SAMPLE).json()['id']
+        self.client.get(f'/api/datasets/{dataset_id}/summary/')
+        text, samples = self.scrape()
+
+        for metric in metrics._metrics:
+            self.assertTrue(metric.name.startswith('api_'))
+            self.assertIn(f'# TYPE {metric.name} {metric.kind}\n', text)
+        self.assertIn('api_requests_total{view="dataset-summary",method="GET",status="200"}', samples)
+        self.assertIn('api_request_duration_seconds_bucket{view="dataset-upload",method="POST",le="+Inf"}', samples)
+        self.assertIn('api_response_bytes_count{view="dataset-summary"}', samples)
+
+    def test_counters_go_up(self):
+        dataset_id = self.upload(SAMPLE).json()['id']
+        requests = 'api_requests_total{view="dataset-summary",method="GET",status="200"}'
+        durations = 'api_request_duration_seconds_count{view="dataset-summary",method="GET"}'
+        queries = 'api_request_db_queries_count{view="dataset-summary"}'
+        rows = 'api_rows_ingested_total{source="upload"}'
+
+        _, before = self.scrape()
+        self.client.get(f'/api/datasets/{dataset_id}/summary/')
+        self.client.get(f'/api/datasets/{dataset_id}/summary/')
+        self.upload(HEADER + MORE, 'more.csv')
+        _, after = self.scrape()
+
+        for key, increase in ((requests, 2), (durations, 2), (queries, 2), (rows, 4)):
+            self.assertEqual(after[key] - before.get(key, 0), increase, key)
+
+
+class CSVReaderTests(TestCase):
+    ENGINES = ['auto', 'pandas'] if csvio.pa is not None else ['pandas']
+
+    def read(self, text, engine, chunk_size=3):
+        with override_settings(CSV_ENGINE=engine):
+            return list(read_csv_chunks(io.BytesIO(text.encode()), chunk_size))
+
+    @skipUnless(csvio.pa, 'pyarrow is not installed')
+    def test_engines_read_the_same_frames(self):
+        text = (SAMPLE + MORE).replace('Pump-1,Pump,100.0', 'Pump-1,Pump,1e2')
+        arrow_chunks, pandas_chunks = self.read(text, 'auto'), self.read(text, 'pandas')
+        self.assertEqual([len(chunk) for chunk in pandas_chunks], [3, 3, 2])
+        self.assertEqual(len(arrow_chunks), len(pandas_chunks))
+        for arrow_chunk, pandas_chunk in zip(arrow_chunks, pandas_chunks):
+            # Categories are listed in the order each reader met them
+            pd.testing.assert_frame_equal(
+                arrow_chunk.reset_index(drop=True), pandas_chunk.reset_index(drop=True),
+                check_categorical=False
+            )
+
+    def test_text_cells_are_reread_as_text(self):
+        text = SAMPLE + 'Pump-3,Pump,95.5,high,78\n' + MORE
+        for engine in self.ENGINES:
+            with self.subTest(engine=engine):
+                chunks = self.read(text, engine)
+                frame = pd.concat(chunks, ignore_index=True)
+                self.assertEqual(frame['Equipment Name'].tolist()[4:6], ['Pump-3', 'Pump-3'])
+                self.assertEqual(len(frame), 9)
+                self.assertEqual(frame['Pressure'][4], 'high')
+
+        # Only the rest of the file is re-read, chunks read before stay typed
+        with mock.patch.object(csvio, '_read_pandas_chunks', wraps=csvio._read_pandas_chunks) as reader:
+            chunks = self.read(text, 'pandas')
+        self.assertEqual(chunks[0]['Pressure'].dtype, np.float64)
+        self.assertEqual(reader.call_args.kwargs, {'skip_rows': 3, 'numeric_as_text': True})
+
+    def test_text_cells_are_reported(self):
+        text = SAMPLE + 'Pump-3,Pump,95.5,high,78\n' + MORE.replace('Tank,10.0', 'Tank,ten')
+        for engine in self.ENGINES:
+            with self.subTest(engine=engine), override_settings(CSV_ENGINE=engine):
+                report = ValidationReport()
+                with self.assertRaises(InvalidCellsError) as raised:
+                    list(read_valid_chunks(io.BytesIO(text.encode()), report, chunk_size=3))
+                rules = raised.exception.report['rules']
+                self.assertEqual(rules['Pressure']['invalid'], {'count': 1, 'rows': [4]})
+                self.assertEqual(rules['Flowrate']['invalid'], {'count': 1, 'rows': [7]})
+                self.assertEqual(raised.exception.report['rows_checked'], 9)
+
+
+class HistogramTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.dataset_id = self.upload(SAMPLE + MORE).json()['id']
+
+    def histogram(self, **params):
+        return self.client.get(f'/api/datasets/{self.dataset_id}/histogram/?' + urlencode(params))
+
+    def test_counts_match_numpy(self):
+        flowrates = [100.0, 120.0, 60.0, 150.5, 95.5, 65.0, 10.0, 90.0]
+        result = self.histogram(column='flowrate', bins=4).json()
+        counts, edges = np.histogram(flowrates, bins=4)
+        # The maximum falls in the last bin
+        self.assertEqual(result['counts'], counts.tolist())
+        np.testing.assert_allclose(result['edges'], edges)
+        self.assertEqual((result['total'], result['missing']), (8, 0))
+
+    def test_blank_cells_are_missing(self):
+        result = self.histogram(column='Pressure', bins=2).json()
+        self.assertEqual((result['total'], result['missing'], sum(result['counts'])), (8, 1, 7))
+
+    def test_heatmap_by_type(self):
+        result = self.histogram(column='flowrate', y='pressure', bins=3, by='type').json()
+        self.assertEqual(np.shape(result['counts']), (3, 3))
+        self.assertEqual(list(result['groups']), ['Pump', 'Reactor', 'Tank', 'Valve'])
+        grouped = np.sum([counts for counts in result['groups'].values()], axis=0)
+        # Pump-4 has no type and Valve-2 no pressure
+        self.assertEqual(int(np.sum(result['counts'])), 7)
+        self.assertEqual(int(grouped.sum()), 6)
+        # Pump-1 and Pump-3: flowrate in [56.8, 103.7), pressure in [4, 5.5]
+        self.assertEqual(result['groups']['Pump'][1][2], 2)
+
+    def test_invalid_params(self):
+        for params in (
+            {}, {'column': 'Type'}, {'column': 'flowrate', 'bins': 0},
+            {'column': 'flowrate', 'bins': 'many'}, {'column': 'flowrate', 'y': 'pressure', 'bins': 200},
+            {'column': 'flowrate', 'by': 'name'},
+        ):
+            response = self.histogram(**params)
+            self.assertEqual(response.status_code, 400, params)
+            self.assertIn('error', response.json())
+
+
+@override_settings(CSV_INGEST_CHUNK_SIZE=3)
+class FrameBudgetTests(APITestCase):
+    """Scans of a dataset larger than the frame cache read it in chunks"""
+
+    def setUp(self):
+        super().setUp()
+        self.dataset = Dataset.objects.get(pk=self.upload(SAMPLE + MORE).json()['id'])
+
+    def scan(self, max_bytes, func, *args):
+        with mock.patch.object(frames, '_cache', frames.FrameCache(max_bytes)):
+            return func(self.dataset, *args), frames.get_stats()
+
+    def test_histogram(self):
+        for params in (('Flowrate', 4), ('Flowrate', 4, 'Pressure', 'Type')):
+            expected, stats = self.scan(1024 * 1024, compute_histogram, *params)
+            self.assertEqual(stats['entries'], 1)
+
+            with mock.patch.object(frames, 'load_record_frame', side_effect=AssertionError):
+                streamed, stats = self.scan(100, compute_histogram, *params)
+            self.assertEqual(streamed, expected)
+            self.assertEqual((stats['entries'], stats['oversize']), (0, 0))
+
+    def test_full_report_tables(self):
+        def tables(dataset, rows_per_table):
+            return [table._cellvalues[1:] for table in reports._iter_equipment_tables(dataset, rows_per_table)]
+
+        expected, _ = self.scan(1024 * 1024, tables, 5)
+        with mock.patch.object(frames, 'load_record_frame', side_effect=AssertionError):
+            streamed, _ = self.scan(0, tables, 5)
+        self.assertEqual([len(rows) for rows in streamed], [5, 3])
+        self.assertEqual(streamed, expected)
+
+
+class InlineExecutor:
+    """Runs submitted work right away, in place of the worker pool"""
+
+    def submit(self, func, *args):
+        # Workers close their connection, which would end the test's transaction
+        with mock.patch.object(reports.connection, 'close'):
+            func(*args)
+
+
+class ReportTestCase(APITestCase):
+    def setUp(self):
+        super().setUp()
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        cache_setting = override_settings(REPORT_CACHE_DIR=cache_dir.name)
+        cache_setting.enable()
+        self.addCleanup(cache_setting.disable)
+        self.addCleanup(reports._background.clear)
+
+
+class ReportCacheTests(ReportTestCase):
+    def download(self, dataset_id):
+        response = self.client.get(f'/api/datasets/{dataset_id}/download_pdf/')
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def cached_files(self, dataset_id):
+        return [name for name in os.listdir(reports.get_cache_dir()) if name.startswith(f'{dataset_id}-')]
+
+    def test_second_download_is_served_from_cache(self):
+        dataset_id = self.upload(SAMPLE).json()['id']
+        build = mock.Mock(wraps=reports.build_summary_report)
+        with mock.patch.dict(reports.REPORT_BUILDERS, summary=build):
+            first = self.download(dataset_id)
+            second = self.download(dataset_id)
+        self.assertEqual(build.call_count, 1)
+        self.assertEqual(first, second)
+
+    def test_delete_evicts_reports(self):
+        dataset_id = self.upload(SAMPLE).json()['id']
+        self.download(dataset_id)
+        self.assertEqual(len(self.cached_files(dataset_id)), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.delete(f'/api/datasets/{dataset_id}/').status_code, 204)
+        self.assertEqual(self.cached_files(dataset_id), [])
+
+        # The id may be reused, the new dataset gets a report of its own
+        new_id = self.upload(SAMPLE).json()['id']
+        self.download(new_id)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/datasets/{new_id}/')
+        self.assertEqual(self.cached_files(new_id), [])
+
+    def test_admin_delete_evicts_reports(self):
+        dataset_id = self.upload(SAMPLE).json()['id']
+        self.download(dataset_id)
+        self.client.force_login(User.objects.create_superuser('admin'))
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f'/admin/api/dataset/{dataset_id}/delete/', {'post': 'yes'})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Dataset.objects.filter(pk=dataset_id).exists())
+        self.assertEqual(self.cached_files(dataset_id), [])
+
+
+@override_settings(REPORT_BACKGROUND_ROWS=2)
+class FullReportTests(ReportTestCase):
+    def download(self, dataset_id):
+        return self.client.get(f'/api/datasets/{dataset_id}/download_pdf/?full=1')
+
+    def test_large_report_is_rendered_in_background(self):
+        dataset_id = self.upload(SAMPLE).json()['id']
+        executor = InlineExecutor()
+        with mock.patch.object(reports, 'get_executor', return_value=executor), \
+                mock.patch.object(executor, 'submit', wraps=executor.submit) as submit:
+            first = self.download(dataset_id)
+            second = self.download(dataset_id)
+
+        self.assertEqual(first.status_code, 202)
+        self.assertEqual(first['Retry-After'], str(reports.RETRY_AFTER_SECONDS))
+        self.assertNotIn('ETag', first)
+        self.assertEqual(submit.call_count, 1)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(b''.join(second.streaming_content)[:5], b'%PDF-')
+
+    def test_failed_rendering_is_reported_once(self):
+        dataset_id = self.upload(SAMPLE).json()['id']
+        with mock.patch.object(reports, 'get_executor', return_value=InlineExecutor()), \
+                mock.patch.dict(reports.REPORT_BUILDERS, full=mock.Mock(side_effect=ValueError('boom'))), \
+                self.assertLogs('api.reports', 'ERROR'):
+            statuses = [self.download(dataset_id).status_code for _ in range(3)]
+        self.assertEqual(statuses, [202, 500, 202])
+
+    @override_settings(REPORT_BACKGROUND_ROWS=4)
+    def test_small_report_is_rendered_in_request(self):
+        dataset_id = self.upload(SAMPLE).json()['id']
+        with mock.patch.object(reports, 'get_executor', side_effect=AssertionError):
+            self.assertEqual(self.download(dataset_id).status_code, 200)
+
+
+def zip_upload(members, name='archive.zip'):
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for member, text in members.items():
+            zip_file.writestr(member, text)
+    return SimpleUploadedFile(name, archive.getvalue())
+
+
+class BulkUploadTests(APITestCase):
+    def test_mixed_archive(self):
+        existing = self.upload(SAMPLE).json()['id']
+        upload = zip_upload({
+            'new.csv': HEADER + MORE,
+            'data/copy.csv': SAMPLE,
+            'bad.csv': 'Name,Size\nPump-1,3\n',
+            'notes.txt': 'not data',
+        })
+        # Parsed on the real process pool
+        response = self.client.post('/api/datasets/bulk_upload/', {'files': [upload]})
+        self.assertEqual(response.status_code, 201)
+
+        results = response.json()['results']
+        self.assertEqual(
+            [(result['filename'], result['status']) for result in results],
+            [('new.csv', 'created'), ('copy.csv', 'duplicate'), ('bad.csv', 'failed'),
+             ('notes.txt', 'skipped')]
+        )
+        created = Dataset.objects.get(pk=results[0]['dataset'])
+        self.assertEqual((results[0]['rows'], created.records.count()), (4, 4))
+        self.assertEqual(results[1]['dataset'], existing)
+        self.assertTrue(results[2]['error'])
+        self.assertEqual(Dataset.objects.count(), 2)
+
+
+class BulkArchiveLimitTests(APITestCase):
+    def bulk_upload(self, members):
+        # Rejected before any member is extracted
+        with mock.patch.object(bulk, '_spool', side_effect=AssertionError):
+            return self.client.post('/api/datasets/bulk_upload/', {'files': [zip_upload(members)]})
+
+    def assertRejected(self, response, message):
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(message, response.json()['error'])
+
+    @override_settings(BULK_ZIP_MAX_MEMBERS=2)
+    def test_member_count(self):
+        response = self.bulk_upload({'a.csv': SAMPLE, 'b.csv': SAMPLE, 'notes.txt': 'x'})
+        self.assertRejected(response, 'at most 2 files')
+
+    @override_settings(BULK_ZIP_MAX_BYTES=len(SAMPLE) * 3 // 2)
+    def test_uncompressed_size(self):
+        response = self.bulk_upload({'a.csv': SAMPLE, 'b.csv': SAMPLE})
+        self.assertRejected(response, 'bytes uncompressed')
+
+    def test_compression_ratio(self):
+        response = self.bulk_upload({'bomb.csv': HEADER + 'Pump-1,Pump,1,1,1\n' * 100000})
+        self.assertRejected(response, "'bomb.csv' is compressed more than 100:1")
+
+
+class RetentionTests(ReportTestCase):
+    NO_LIMITS = {'MAX_COUNT': None, 'MAX_AGE_DAYS': None, 'MAX_TOTAL_BYTES': None, 'MAX_PER_USER': None}
+
+    def setUp(self):
+        super().setUp()
+        self.now = timezone.now()
+
+    def dataset(self, age_days=0, size_bytes=0, user=None, rows=0):
+        """A dataset uploaded age_days ago, newer than the ones made before it"""
+        dataset = Dataset.objects.create(
+            filename='equipment.csv', summary={}, size_bytes=size_bytes, user=user
+        )
+        EquipmentRecord.objects.bulk_create(
+            EquipmentRecord(dataset=dataset, name=f'Pump-{row}') for row in range(rows)
+        )
+        Dataset.objects.filter(pk=dataset.pk).update(
+            upload_date=self.now - timedelta(days=age_days) + timedelta(seconds=dataset.pk)
+        )
+        return dataset.pk
+
+    def enforce(self, **policy):
+        # Reports are evicted once the delete commits
+        with self.captureOnCommitCallbacks(execute=True):
+            return retention.enforce_retention({**self.NO_LIMITS, **policy})
+
+    def assertRemaining(self, dataset_ids):
+        self.assertEqual(set(Dataset.objects.values_list('pk', flat=True)), set(dataset_ids))
+
+    def test_max_count(self):
+        ids = [self.dataset() for _ in range(4)]
+        self.assertEqual(self.enforce(MAX_COUNT=2)['datasets_deleted'], 2)
+        self.assertRemaining(ids[2:])
+
+    def test_max_age_days(self):
+        old, recent, new = self.dataset(age_days=10), self.dataset(age_days=5), self.dataset()
+        self.enforce(MAX_AGE_DAYS=7)
+        self.assertRemaining([recent, new])
+
+    def test_max_total_bytes(self):
+        ids = [self.dataset(size_bytes=100) for _ in range(3)]
+        # The newest datasets are kept up to the limit
+        self.assertEqual(self.enforce(MAX_TOTAL_BYTES=250)['bytes_reclaimed'], 100)
+        self.assertRemaining(ids[1:])
+
+    def test_max_per_user(self):
+        alice = User.objects.create_user('alice')
+        bob = User.objects.create_user('bob')
+        alices = [self.dataset(user=alice) for _ in range(3)]
+        bobs = [self.dataset(user=bob)]
+        anonymous = [self.dataset() for _ in range(2)]
+        self.enforce(MAX_PER_USER=1)
+        self.assertRemaining([alices[-1], bobs[-1], anonymous[-1]])
+
+    def test_rows_are_deleted_with_their_dataset(self):
+        expired, kept = self.dataset(rows=3), self.dataset(rows=2)
+        report = self.enforce(MAX_COUNT=1)
+        self.assertEqual((report['datasets_deleted'], report['records_deleted']), (1, 3))
+        self.assertFalse(EquipmentRecord.objects.filter(dataset_id=expired).exists())
+        self.assertEqual(EquipmentRecord.objects.filter(dataset_id=kept).count(), 2)
+
+    def test_cached_reports_are_evicted(self):
+        expired, kept = self.upload(SAMPLE).json()['id'], self.upload(HEADER + MORE).json()['id']
+        paths = {
+            dataset_id: reports.get_report(Dataset.objects.get(pk=dataset_id))
+            for dataset_id in (expired, kept)
+        }
+        self.enforce(MAX_COUNT=1)
+        self.assertFalse(os.path.exists(paths[expired]))
+        self.assertTrue(os.path.exists(paths[kept]))
+
+
+class ConditionalGetTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.dataset_id = self.upload(SAMPLE).json()['id']
+        self.url = f'/api/datasets/{self.dataset_id}/summary/'
+
+    def test_matching_etag_is_not_modified(self):
+        first = self.client.get(self.url)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first['Cache-Control'], 'private, no-cache')
+
+        second = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second['ETag'], first['ETag'])
+        self.assertEqual(second.content, b'')
+
+        since = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(since.status_code, 304)
+
+    def test_etag_covers_query_string(self):
+        url = f'/api/datasets/{self.dataset_id}/'
+        full = self.client.get(url)
+        brief = self.client.get(url, {'include_data': 0}, HTTP_IF_NONE_MATCH=full['ETag'])
+        self.assertEqual(brief.status_code, 200)
+        self.assertNotEqual(brief['ETag'], full['ETag'])
+
+    def test_append_changes_etag(self):
+        first = self.client.get(self.url)
+        # Runs the append's invalidation; its background work isn't started
+        with mock.patch.object(jobs, 'get_executor'), self.captureOnCommitCallbacks(execute=True):
+            self.append(self.dataset_id, HEADER + MORE)
+
+        second = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(second['ETag'], first['ETag'])
+        self.assertEqual(second.json()['total_count'], 8)
+
+    def test_debug_timing_is_not_conditional(self):
+        url = f'/api/datasets/{self.dataset_id}/?debug_timing=1'
+        first = self.client.get(url)
+        self.assertNotIn('ETag', first)
+        self.assertNotIn('cleanup', first.json()['timing']['stages'])
+
+        # Retention adds its stage later, the dataset's version is the same
+        trace = tracing.Trace()
+        with trace.span('cleanup'):
+            pass
+        tracing.store(self.dataset_id, trace.to_dict(), merge_stored=True)
+
+        last_modified = self.client.get(f'/api/datasets/{self.dataset_id}/')['Last-Modified']
+        second = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(second.status_code, 200)
+        self.assertIn('cleanup', second.json()['timing']['stages'])
+
+    def test_missing_dataset(self):
+        response = self.client.get('/api/datasets/999/summary/', HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, 404)
+
+
+class CachingTests(APITestCase):
+    def committed(self):
+        """Run the invalidations queued on commit; background work is dropped"""
+        stack = contextlib.ExitStack()
+        stack.enter_context(mock.patch.object(jobs, 'get_executor'))
+        stack.enter_context(self.captureOnCommitCallbacks(execute=True))
+        return stack
+
+    def listed(self):
+        return [dataset['id'] for dataset in self.client.get('/api/datasets/').json()]
+
+    def summary(self, dataset_id):
+        return self.client.get(f'/api/datasets/{dataset_id}/summary/').json()
+
+    def test_upload_and_delete_refresh_the_list(self):
+        with self.committed():
+            first = self.upload(SAMPLE).json()['id']
+        self.assertEqual(self.listed(), [first])
+
+        with self.committed():
+            second = self.upload(HEADER + MORE, 'more.csv').json()['id']
+        self.assertEqual(self.listed(), [second, first])
+
+        with self.committed():
+            self.client.delete(f'/api/datasets/{second}/')
+        self.assertEqual(self.listed(), [first])
+
+    def test_append_and_refresh_update_the_summary(self):
+        with self.committed():
+            dataset_id = self.upload(SAMPLE).json()['id']
+        self.assertEqual(self.summary(dataset_id)['total_count'], 4)
+
+        with self.committed():
+            self.append(dataset_id, HEADER + MORE)
+        summary = self.summary(dataset_id)
+        self.assertEqual(summary['total_count'], 8)
+        self.assertIsNone(summary['type_stats']['Pump']['Flowrate']['p50'])
+
+        with self.committed():
+            ingest.refresh_type_stats(dataset_id)
+        self.assertIsNotNone(self.summary(dataset_id)['type_stats']['Pump']['Flowrate']['p50'])
+
+    @override_settings(DATASET_RETENTION={'MAX_COUNT': 1})
+    def test_retention_refreshes_the_list(self):
+        with self.committed():
+            first = self.upload(SAMPLE).json()['id']
+            second = self.upload(HEADER + MORE, 'more.csv').json()['id']
+        self.assertEqual(self.listed(), [second, first])
+
+        with self.committed():
+            retention.enforce_retention()
+        self.assertEqual(self.listed(), [second])
+
+    def test_hit_and_miss_counters(self):
+        dataset_id = self.upload(SAMPLE).json()['id']
+
+        def counters(kind):
+            stats = self.client.get('/api/cache/stats/').json()
+            return stats['kinds'].get(kind, {'hits': 0, 'misses': 0})
+
+        before = counters('summary')
+        for _ in range(3):
+            self.summary(dataset_id)
+        after = counters('summary')
+        self.assertEqual(after['misses'] - before['misses'], 1)
+        self.assertEqual(after['hits'] - before['hits'], 2)
+
+        stats = self.client.get('/api/cache/stats/').json()
+        self.assertEqual(stats['backend'], 'LocMemCache')
+        self.assertEqual(stats['hits'], sum(kind['hits'] for kind in stats['kinds'].values()))
+        self.assertAlmostEqual(stats['hit_ratio'], stats['hits'] / (stats['hits'] + stats['misses']))
+
+
+class NegotiationTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.url = f"/api/datasets/{self.upload(SAMPLE + MORE).json()['id']}/"
+
+    @skipUnless(renderers.msgpack, 'msgpack is not installed')
+    def test_msgpack_matches_json(self):
+        response = self.client.get(self.url, HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(renderers.msgpack.unpackb(response.content), self.client.get(self.url).json())
+
+    @skipUnless(renderers.pa, 'pyarrow is not installed')
+    def test_arrow_matches_json(self):
+        pa = renderers.pa
+        media_type = 'application/vnd.apache.arrow.stream'
+        for url, key in ((self.url, 'data'), (self.url + 'rows/?limit=5', 'results')):
+            response = self.client.get(url, HTTP_ACCEPT=media_type)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], media_type)
+            table = pa.ipc.open_stream(response.content).read_all()
+
+            expected = self.client.get(url).json()
+            self.assertEqual(table.to_pylist(), expected.pop(key))
+            self.assertEqual(json.loads(table.schema.metadata[b'meta']), expected)
+            self.assertTrue(pa.types.is_float64(table.schema.field('Pressure').type))
+
+    def test_unsupported_media_type(self):
+        response = self.client.get(self.url, HTTP_ACCEPT='text/csv')
+        self.assertEqual(response.status_code, 406)
+
+    def assertCompressedRevalidates(self, encoding):
+        first = self.client.get(self.url, HTTP_ACCEPT_ENCODING=encoding)
+        self.assertEqual(first['Content-Encoding'], encoding)
+        self.assertTrue(first['ETag'].startswith('W/"'))
+        self.assertIn('Accept-Encoding', first['Vary'])
+
+        second = self.client.get(
+            self.url, HTTP_ACCEPT_ENCODING=encoding, HTTP_IF_NONE_MATCH=first['ETag']
+        )
+        self.assertEqual(second.status_code, 304)
+
+    def test_gzip_revalidates(self):
+        self.assertCompressedRevalidates('gzip')
+
+    @skipUnless(middleware.brotli, 'brotli is not installed')
+    def test_brotli_revalidates(self):
+        self.assertCompressedRevalidates('br')
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(middleware.brotli.decompress(response.content), self.client.get(self.url).content)
+
+
+class RecordMigrationTests(TransactionTestCase):
+    """0002 moves the JSON rows of datasets into EquipmentRecord, and back when reversed"""
+    before = [('api', '0001_initial')]
+    after = [('api', '0002_equipmentrecord')]
+    ROWS = [
+        {'Equipment Name': 'Pump-1', 'Type': 'Pump', 'Flowrate': 100.0, 'Pressure': 5.0, 'Temperature': 80.0},
+        {'Equipment Name': 'Valve-2', 'Type': 'Valve', 'Flowrate': 65.0, 'Pressure': None, 'Temperature': 72.0},
+        {'Equipment Name': 'Pump-4', 'Type': None, 'Flowrate': 90.0, 'Pressure': 5.2, 'Temperature': 82.0},
+    ]
+
+    def migrate(self, targets=None):
+        executor = MigrationExecutor(connection)
+        targets = targets or executor.loader.graph.leaf_nodes()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        # Back to the latest schema for the other tests
+        self.migrate()
+
+    def test_rows_move_both_ways(self):
+        apps = self.migrate(self.before)
+        OldDataset = apps.get_model('api', 'Dataset')
+        dataset_id = OldDataset.objects.create(filename='old.csv', data=self.ROWS, summary={}).pk
+        OldDataset.objects.create(filename='empty.csv', data=[], summary={})
+
+        apps = self.migrate(self.after)
+        Record = apps.get_model('api', 'EquipmentRecord')
+        self.assertEqual(
+            list(Record.objects.filter(dataset_id=dataset_id).order_by('id').values_list(
+                'name', 'type', 'flowrate', 'pressure', 'temperature'
+            )),
+            [('Pump-1', 'Pump', 100.0, 5.0, 80.0), ('Valve-2', 'Valve', 65.0, None, 72.0),
+             ('Pump-4', '', 90.0, 5.2, 82.0)]
+        )
+        self.assertEqual(Record.objects.count(), 3)
+
+        apps = self.migrate(self.before)
+        OldDataset = apps.get_model('api', 'Dataset')
+        self.assertEqual(OldDataset.objects.get(pk=dataset_id).data, self.ROWS)
+        self.assertEqual(OldDataset.objects.get(filename='empty.csv').data, [])
+
+
+def reload_urls():
+    """Rebuild the URLconf, whose dataset routes depend on ASYNC_VIEWS"""
+    importlib.reload(api_urls)
+    importlib.reload(config_urls)
+    clear_url_caches()
+
+
+@override_settings(REPORT_PRERENDER=False)
+class AsyncViewsTests(TransactionTestCase):
+    # Offloaded views query from the pool's threads, which can only see committed rows
+
+    def setUp(self):
+        caching.get_cache().clear()
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        cache_setting = override_settings(REPORT_CACHE_DIR=cache_dir.name)
+        cache_setting.enable()
+        self.addCleanup(cache_setting.disable)
+
+        with override_settings(ASYNC_VIEWS=True):
+            reload_urls()
+        self.addCleanup(reload_urls)
+
+        # Background refreshes and retention are left out
+        executor = mock.patch.object(jobs, 'get_executor')
+        executor.start()
+        self.addCleanup(executor.stop)
+
+    def test_dataset_routes_are_offloaded(self):
+        self.assertTrue(iscoroutinefunction(resolve('/api/datasets/').func))
+        self.assertTrue(iscoroutinefunction(resolve('/api/datasets/1/download_pdf/').func))
+        self.assertFalse(iscoroutinefunction(resolve('/api/health/').func))
+
+    async def test_views_run_on_the_pool(self):
+        with mock.patch.object(offload, 'get_executor', wraps=offload.get_executor) as get_executor:
+            response = await self.async_client.post(
+                '/api/datasets/upload/', {'file': SimpleUploadedFile('equipment.csv', SAMPLE.encode())}
+            )
+            self.assertEqual(response.status_code, 201)
+            summary = await self.async_client.get(f"/api/datasets/{response.json()['id']}/summary/")
+        self.assertEqual(summary.status_code, 200)
+        self.assertEqual(summary.json()['total_count'], 4)
+        self.assertEqual(get_executor.call_count, 2)
+
+    async def test_pdf_is_streamed(self):
+        response = await self.async_client.post(
+            '/api/datasets/upload/', {'file': SimpleUploadedFile('equipment.csv', SAMPLE.encode())}
+        )
+        url = f"/api/datasets/{response.json()['id']}/download_pdf/"
+
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        # Read chunk by chunk on the pool rather than by Django on the event loop
+        self.assertTrue(response.is_async)
+        content = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertTrue(content.startswith(b'%PDF'))
+        self.assertEqual(len(content), int(response['Content-Length']))
+
+
+class JobRetrieveTests(TestCase):
+    def test_polls_see_live_progress(self):
+        job = IngestionJob.objects.create(filename='a.csv', state=IngestionJob.STATE_RUNNING)
+        url = f'/api/jobs/{job.pk}/'
+        jobs._progress[job.pk] = 10
+        try:
+            first = self.client.get(url)
+            jobs._progress[job.pk] = 20
+            # A revalidating client must not get 304 with stale progress
+            second = self.client.get(url, HTTP_IF_NONE_MATCH=first.get('ETag', '*'))
+        finally:
+            jobs._progress.pop(job.pk, None)
+
+        self.assertEqual(first.json()['rows_processed'], 10)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.json()['rows_processed'], 20)
+
+
+@override_settings(REPORT_PRERENDER=False)
+class BackgroundUploadTests(APITestCase):
+    def upload_async(self, text, name='data.csv'):
+        with mock.patch.object(jobs, 'get_executor', return_value=InlineExecutor()), \
+                self.captureOnCommitCallbacks(execute=True):
+            return self.upload(text, name, **{'async': 1})
+
+    def test_accepted_with_location(self):
+        with mock.patch.object(jobs, 'get_executor'):
+            response = self.upload(SAMPLE, **{'async': 1})
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['state'], IngestionJob.STATE_QUEUED)
+        self.assertTrue(response['Location'].endswith(f"/api/jobs/{response.json()['id']}/"))
+
+    def test_poll_to_succeeded(self):
+        response = self.upload_async(SAMPLE)
+        job = self.client.get(response['Location']).json()
+        self.assertEqual(job['state'], IngestionJob.STATE_SUCCEEDED)
+        self.assertEqual(job['rows_processed'], 4)
+        self.assertEqual(Dataset.objects.get(pk=job['dataset']).records.count(), 4)
+
+    def test_poll_to_failed(self):
+        response = self.upload_async(HEADER + 'Pump-1,Pump,fast,5.0,80\n')
+        job = self.client.get(response['Location']).json()
+        self.assertEqual(job['state'], IngestionJob.STATE_FAILED)
+        self.assertIn('not valid numbers', job['error'])
+        self.assertIsNone(job['dataset'])
+        self.assertFalse(Dataset.objects.exists())
+
+    def test_failing_retention_does_not_fail_the_job(self):
+        with mock.patch.object(jobs, 'enforce_retention_traced', side_effect=RuntimeError('boom')), \
+                self.assertLogs('api.jobs', 'ERROR'):
+            response = self.upload_async(SAMPLE)
+        job = self.client.get(response['Location']).json()
+        self.assertEqual(job['state'], IngestionJob.STATE_SUCCEEDED)
+        self.assertEqual(job['error'], '')
+        self.assertIsNotNone(job['dataset'])
+
+
+class CompareTests(APITestCase):
+    def compare(self, a, b, **params):
+        return self.client.get('/api/datasets/compare/?' + urlencode({'a': a, 'b': b, **params}))
+
+    def test_statuses_and_deltas(self):
+        a = self.upload(SAMPLE).json()['id']
+        b = self.upload(
+            HEADER + 'Pump-1,Pump,110.0,5.0,80\nPump-2,Pump,120.0,5.5,85\nTank-1,Tank,10,1,20\n',
+            'b.csv'
+        ).json()['id']
+
+        response = self.compare(a, b, sort='Flowrate')
+        self.assertEqual(response.status_code, 200)
+        counts = response.json()['counts']
+        self.assertEqual(
+            [counts[status] for status in ('added', 'removed', 'changed', 'unchanged')], [1, 2, 1, 1]
+        )
+        first = response.json()['results'][0]
+        self.assertEqual(first['Equipment Name'], 'Pump-1')
+        self.assertAlmostEqual(first['Flowrate']['delta'], 10.0)
+
+    def test_dataset_without_named_rows(self):
+        a = self.upload(SAMPLE).json()['id']
+        b = self.upload(HEADER + ',Pump,1,2,3\n,Valve,4,5,6\n', 'unnamed.csv').json()['id']
+
+        response = self.compare(a, b)
+        self.assertEqual(response.status_code, 200)
+        counts = response.json()['counts']
+        self.assertEqual(counts['removed'], 4)
+        self.assertEqual(counts['unnamed'], {'a': 0, 'b': 2})
+
+        response = self.compare(b, a)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['counts']['added'], 4)
@@ -0,0 +1,208 @@
+"""
+Stage timings of an upload.
+
+An upload activates a Trace; code along the way wraps its stages in
+span('read_csv'), span('db_write'), ... Spans of the same name add up, so
+a stage run once per chunk is reported once, with the number of calls.
+Outside an active trace a span does nothing, so shared code such as
+csvio.read_valid_chunks() is traced only when an upload asks for it.
+
+Every stage records wall time and CPU time of the current thread (work
+pyarrow does on its own threads isn't counted). When tracemalloc is
+tracing, e.g. with PYTHONTRACEMALLOC=1, the peak of traced memory above
+the start of the span is recorded too; tracemalloc is process-wide, so
+the peaks of concurrent uploads include each other's allocations.
+
+The trace is stored on the dataset (Dataset.timing), see store().
+"""
+import contextvars
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Stages of an upload in pipeline order
+STAGES = ('hash', 'read_csv', 'validate', 'summary', 'build_records', 'db_write', 'serialize', 'cleanup')
+
+_current = contextvars.ContextVar('upload_trace', default=None)
+
+
+class Trace:
+    def __init__(self):
+        self.stages = {}
+        self.memory = tracemalloc.is_tracing()
+        # [memory at the start, highest peak seen] of the trace and of open spans
+        self._frames = []
+        self._root = self._enter()
+        self._wall = time.perf_counter()
+        self._cpu = time.thread_time()
+
+    def _enter(self):
+        if not self.memory:
+            return None
+        current, peak = tracemalloc.get_traced_memory()
+        if self._frames:
+            self._frames[-1][1] = max(self._frames[-1][1], peak)
+        tracemalloc.reset_peak()
+        frame = [current, current]
+        self._frames.append(frame)
+        return frame
+
+    def _peak(self, frame):
+        """Peak memory above the start of frame so far"""
+        return max(frame[1], tracemalloc.get_traced_memory()[1]) - frame[0]
+
+    def _exit(self, frame):
+        if frame is None:
+            return None
+        peak = self._peak(frame)
+        # Spans nest, frame is the innermost one
+        self._frames.pop()
+        if self._frames:
+            # The global peak was reset when frame was entered
+            parent = self._frames[-1]
+            parent[1] = max(parent[1], frame[0] + peak)
+        return peak
+
+    @contextmanager
+    def span(self, name):
+        """Time a stage, adding to earlier spans of the same name"""
+        frame = self._enter()
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = time.thread_time() - cpu
+            peak = self._exit(frame)
+
+            stage = self.stages.setdefault(
+                name, {'wall': 0.0, 'cpu': 0.0, 'calls': 0, 'peak_memory': None}
+            )
+            stage['wall'] += wall
+            stage['cpu'] += cpu
+            stage['calls'] += 1
+            if peak is not None:
+                stage['peak_memory'] = max(stage['peak_memory'] or 0, peak)
+
+    def to_dict(self):
+        """Totals since the trace started and every stage, times in seconds"""
+        return {
+            'wall': round(time.perf_counter() - self._wall, 6),
+            'cpu': round(time.thread_time() - self._cpu, 6),
+            'peak_memory': self._peak(self._root) if self._root is not None else None,
+            'stages': {
+                name: {**stage, 'wall': round(stage['wall'], 6), 'cpu': round(stage['cpu'], 6)}
+                for name, stage in self.stages.items()
+            },
+        }
+
+
+@contextmanager
+def activate(trace):
+    """Make trace the one span() records into, in this thread or task"""
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def span(name):
+    """Time a stage of the active trace, if any"""
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    with trace.span(name):
+        yield
+
+
+def iterate(name, iterable):
+    """Yield from iterable, timing every step as the stage name"""
+    iterator = iter(iterable)
+    while True:
+        with span(name):
+            item = next(iterator, StopIteration)
+        if item is StopIteration:
+            return
+        yield item
+
+
+def _max(a, b):
+    return b if a is None else a if b is None else max(a, b)
+
+
+def merge(timing, other):
+    """Add the timings of other, e.g. a later stage, to timing"""
+    stages = {name: dict(stage) for name, stage in timing.get('stages', {}).items()}
+    for name, stage in other.get('stages', {}).items():
+        if name not in stages:
+            stages[name] = dict(stage)
+            continue
+        merged = stages[name]
+        merged['wall'] = round(merged['wall'] + stage['wall'], 6)
+        merged['cpu'] = round(merged['cpu'] + stage['cpu'], 6)
+        merged['calls'] += stage['calls']
+        merged['peak_memory'] = _max(merged['peak_memory'], stage['peak_memory'])
+
+    return {
+        'wall': round(timing.get('wall', 0.0) + other.get('wall', 0.0), 6),
+        'cpu': round(timing.get('cpu', 0.0) + other.get('cpu', 0.0), 6),
+        'peak_memory': _max(timing.get('peak_memory'), other.get('peak_memory')),
+        'stages': stages,
+    }
+
+
+def summarize(timings):
+    """Per-stage totals over many stored timings, slowest stage first
+
+    'other' is the time of the uploads outside any stage, e.g. committing.
+    """
+    totals = {}
+    wall = 0.0
+    for timing in timings:
+        wall += timing.get('wall', 0.0)
+        for name, stage in timing.get('stages', {}).items():
+            total = totals.setdefault(name, {
+                'stage': name, 'uploads': 0, 'wall': 0.0, 'cpu': 0.0,
+                'max_wall': 0.0, 'peak_memory': None,
+            })
+            total['uploads'] += 1
+            total['wall'] += stage['wall']
+            total['cpu'] += stage['cpu']
+            total['max_wall'] = max(total['max_wall'], stage['wall'])
+            total['peak_memory'] = _max(total['peak_memory'], stage['peak_memory'])
+
+    other = wall - sum(total['wall'] for total in totals.values())
+    if other > 0:
+        totals['other'] = {
+            'stage': 'other', 'uploads': None, 'wall': other, 'cpu': None,
+            'max_wall': None, 'peak_memory': None,
+        }
+    for total in totals.values():
+        total['share'] = total['wall'] / wall if wall else 0.0
+        total['mean_wall'] = total['wall'] / total['uploads'] if total['uploads'] else None
+    return sorted(totals.values(), key=lambda total: total['wall'], reverse=True)
+
+
+def store(dataset_id, timing, merge_stored=False):
+    """Save timing (a Trace.to_dict()) on a dataset, or add it to the stored one
+
+    Returns the timing as stored. updated_date is left alone, the rows
+    haven't changed.
+    """
+    # Imported here: csvio uses this module in bulk parse workers, which
+    # don't load Django's app registry
+    from .models import Dataset
+
+    datasets = Dataset.objects.filter(pk=dataset_id)
+    if merge_stored:
+        stored = datasets.values_list('timing', flat=True).first()
+        if stored is None:
+            # Deleted in the meantime, e.g. by retention
+            return None
+        timing = merge(stored, timing)
+    datasets.update(timing=timing, upload_seconds=timing['wall'])
+    return timing
@@ -0,0 +1,49 @@
+"""
+Upload handlers used while Django receives multipart request bodies.
+"""
+import hashlib
+
+from django.core.files.uploadhandler import FileUploadHandler
+
+
+class HashingUploadHandler(FileUploadHandler):
+    """Computes the SHA-256 of every uploaded file while it is received
+
+    Data is passed through unchanged to the next handler. Digests are
+    collected on request.upload_sha256 as {field name: [hex digest, ...]}
+    in the order the files arrived.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.hasher = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.hasher.update(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size):
+        if not hasattr(self.request, 'upload_sha256'):
+            self.request.upload_sha256 = {}
+        self.request.upload_sha256.setdefault(self.field_name, []).append(
+            self.hasher.hexdigest()
+        )
+        # Let the next handler build the file object
+        return None
+
+
+def get_upload_sha256(request, uploaded_file, field_name='file', index=0):
+    """Return the SHA-256 hex digest of an uploaded file
+
+    Uses the digest recorded by HashingUploadHandler when it is installed,
+    otherwise hashes the file contents.
+    """
+    digests = getattr(request, 'upload_sha256', {}).get(field_name, [])
+    if index < len(digests):
+        return digests[index]
+
+    hasher = hashlib.sha256()
+    for chunk in uploaded_file.chunks():
+        hasher.update(chunk)
+    uploaded_file.seek(0)
+    return hasher.hexdigest()
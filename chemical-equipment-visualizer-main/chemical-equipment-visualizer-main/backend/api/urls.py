@@ -1,14 +1,24 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import DatasetViewSet, health_check
+from .offload import offload_patterns
+from .views import DatasetViewSet, IngestionJobViewSet, cache_stats, health_check, metrics_view
 from .auth_views import register, login, logout  # Add this
 
 router = DefaultRouter()
 router.register(r'datasets', DatasetViewSet, basename='dataset')
+router.register(r'jobs', IngestionJobViewSet, basename='job')
+
+router_urls = router.urls
+if settings.ASYNC_VIEWS:
+    # Under ASGI, see offload.py
+    router_urls = offload_patterns(router_urls)
 
 urlpatterns = [
-    path('', include(router.urls)),
+    path('', include(router_urls)),
     path('health/', health_check, name='health_check'),
+    path('cache/stats/', cache_stats, name='cache_stats'),
+    path('metrics/', metrics_view, name='metrics'),
     path('auth/register/', register, name='register'),  # Add
     path('auth/login/', login, name='login'),          # Add
     path('auth/logout/', logout, name='logout'),       # Add
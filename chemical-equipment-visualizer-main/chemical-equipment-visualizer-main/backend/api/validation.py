@@ -0,0 +1,162 @@
+"""
+Cell-level validation of parsed CSV chunks.
+
+Every cell of a chunk is classified with column-wise masks:
+
+    missing       blank cell
+    invalid       text in a numeric column
+    out_of_range  number outside settings.CSV_VALUE_RANGES
+
+ValidationReport accumulates, per column and rule, the number of flagged
+cells and the first few row numbers (0-based, not counting the header),
+e.g. {'Pressure': {'invalid': {'count': 3, 'rows': [4, 17, 90]}}}.
+"""
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from pandas.api.types import is_numeric_dtype
+
+from .stats import NUMERIC_COLUMNS
+
+DEFAULT_VALUE_RANGES = {
+    'Flowrate': (0, None),
+    'Pressure': (0, None),
+    'Temperature': (-273.15, None),
+}
+DEFAULT_MAX_EXAMPLES = 10
+
+
+class InvalidCellsError(ValueError):
+    """Raised when a file has invalid cells and invalid rows aren't skipped"""
+
+    def __init__(self, report):
+        self.report = report
+        invalid = sum(
+            rules['invalid']['count'] for rules in report['rules'].values() if 'invalid' in rules
+        )
+        super().__init__(f'{invalid} cells are not valid numbers')
+
+    def __reduce__(self):
+        # Raised in worker processes, so it has to survive pickling
+        return type(self), (self.report,)
+
+
+def get_value_ranges():
+    return getattr(settings, 'CSV_VALUE_RANGES', DEFAULT_VALUE_RANGES)
+
+
+class ValidationReport:
+    """Validates chunks in file order and summarizes the flagged cells"""
+
+    def __init__(self, value_ranges=None, max_examples=None, float_dtype='float64'):
+        self.float_dtype = float_dtype
+        self.value_ranges = get_value_ranges() if value_ranges is None else value_ranges
+        self.max_examples = max_examples or getattr(
+            settings, 'CSV_VALIDATION_EXAMPLES', DEFAULT_MAX_EXAMPLES
+        )
+        self.rows_checked = 0
+        self.rows_flagged = 0
+        self.rows_skipped = 0
+        self.counts = {}
+        self.examples = {}
+
+    @property
+    def has_invalid(self):
+        return any(rule == 'invalid' for _, rule in self.counts)
+
+    def _record(self, column, rule, mask, offset):
+        count = int(np.count_nonzero(mask))
+        if not count:
+            return
+
+        key = (column, rule)
+        self.counts[key] = self.counts.get(key, 0) + count
+        examples = self.examples.setdefault(key, [])
+        wanted = self.max_examples - len(examples)
+        if wanted > 0:
+            examples.extend((np.flatnonzero(mask)[:wanted] + offset).tolist())
+
+    def check(self, chunk):
+        """Validate the next chunk of the file
+
+        Returns the chunk with numeric columns converted to floats (text
+        cells become NaN) and a boolean array, True for rows without any
+        flagged cell.
+        """
+        offset = self.rows_checked
+        valid = np.ones(len(chunk), dtype=bool)
+        converted = {}
+
+        for column in chunk.columns:
+            values = chunk[column]
+            missing = values.isna().to_numpy()
+            self._record(column, 'missing', missing, offset)
+            valid &= ~missing
+
+            if column not in NUMERIC_COLUMNS:
+                continue
+
+            if not is_numeric_dtype(values):
+                # Read as text after a failed typed parse, see csvio
+                values = pd.to_numeric(values, errors='coerce')
+                invalid = values.isna().to_numpy() & ~missing
+                self._record(column, 'invalid', invalid, offset)
+                valid &= ~invalid
+                converted[column] = values.astype(self.float_dtype)
+
+            low, high = self.value_ranges.get(column, (None, None))
+            numbers = values.to_numpy(dtype='float64', na_value=np.nan)
+            out_of_range = np.zeros(len(chunk), dtype=bool)
+            if low is not None:
+                out_of_range |= numbers < low
+            if high is not None:
+                out_of_range |= numbers > high
+            self._record(column, 'out_of_range', out_of_range, offset)
+            valid &= ~out_of_range
+
+        if converted:
+            chunk = chunk.assign(**converted)
+        self.rows_checked += len(chunk)
+        self.rows_flagged += int(np.count_nonzero(~valid))
+        return chunk, valid
+
+    @classmethod
+    def from_dict(cls, data, **kwargs):
+        """Rebuild a report from the dict produced by to_dict(), e.g. Dataset.validation"""
+        report = cls(**kwargs)
+        report.rows_checked = data.get('rows_checked', 0)
+        report.rows_flagged = data.get('rows_flagged', 0)
+        report.rows_skipped = data.get('rows_skipped', 0)
+        for column, rules in data.get('rules', {}).items():
+            for rule, flagged in rules.items():
+                report.counts[(column, rule)] = flagged['count']
+                report.examples[(column, rule)] = list(flagged['rows'])
+        return report
+
+    def merge(self, other):
+        """Add the report of a file checked after this one
+
+        Its row numbers continue after the rows this report has checked.
+        """
+        for key, count in other.counts.items():
+            self.counts[key] = self.counts.get(key, 0) + count
+            examples = self.examples.setdefault(key, [])
+            wanted = self.max_examples - len(examples)
+            if wanted > 0:
+                examples.extend(row + self.rows_checked for row in other.examples[key][:wanted])
+        self.rows_checked += other.rows_checked
+        self.rows_flagged += other.rows_flagged
+        self.rows_skipped += other.rows_skipped
+
+    def to_dict(self):
+        rules = {}
+        for (column, rule), count in self.counts.items():
+            rules.setdefault(column, {})[rule] = {
+                'count': count, 'rows': self.examples[(column, rule)]
+            }
+        return {
+            'rows_checked': self.rows_checked,
+            'rows_flagged': self.rows_flagged,
+            'rows_skipped': self.rows_skipped,
+            'rules': rules,
+        }
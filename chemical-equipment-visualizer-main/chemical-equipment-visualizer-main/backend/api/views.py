@@ -1,27 +1,111 @@
-from rest_framework import viewsets, status
+import hashlib
+from rest_framework import mixins, viewsets, status
+from rest_framework.pagination import LimitOffsetPagination
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
+from rest_framework.generics import get_object_or_404
 from rest_framework.permissions import AllowAny, IsAuthenticated
-from django.http import HttpResponse
-from .models import Dataset
-from .serializers import DatasetSerializer, DatasetListSerializer
-import pandas as pd
-import io
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.lib import colors
+from django.http import FileResponse, HttpResponse
+from .models import Dataset, IngestionJob
+from .serializers import DatasetSerializer, DatasetListSerializer, IngestionJobSerializer
+from .ingest import ingest_csv, append_csv
+from .uploads import get_upload_sha256
+from .filters import filter_records, sort_records, RecordFilterError
+from .validation import InvalidCellsError
+from .histograms import HistogramError, compute_histogram, parse_params
+from .renderers import PAYLOAD_RENDERERS
+from .conditional import conditional_dataset
+from . import bulk
+from . import caching
+from . import comparison
+from . import frames
+from . import jobs
+from . import metrics
+from . import reports
+from . import retention
+from . import tracing
+
+def query_flag(request, name):
+    """Interpret a query parameter such as ?async=1 as a boolean"""
+    return request.query_params.get(name, '').lower() in ('1', 'true', 'yes')
+
+def request_owner(request):
+    """The user datasets of this request belong to, None when anonymous"""
+    return request.user if request.user.is_authenticated else None
+
+class RowsPagination(LimitOffsetPagination):
+    default_limit = 100
+    max_limit = 1000
 
 class DatasetViewSet(viewsets.ModelViewSet):
     queryset = Dataset.objects.all()
     serializer_class = DatasetSerializer
     permission_classes = [AllowAny]  # ✅ Changed from IsAuthenticated
+    lookup_value_regex = '[0-9]+'
+    
+    def get_renderers(self):
+        renderers = super().get_renderers()
+        # Row payloads can also be sent as Arrow IPC or MessagePack
+        if self.action in ('retrieve', 'rows'):
+            renderers += [renderer() for renderer in PAYLOAD_RENDERERS]
+        return renderers
+    
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        caching.invalidate_datasets([serializer.instance.pk])
+    
+    def perform_destroy(self, instance):
+        caching.invalidate_datasets([instance.pk])
+        super().perform_destroy(instance)
     
     def list(self, request):
-        """List last 5 datasets"""
-        datasets = Dataset.objects.all()[:5]
-        serializer = DatasetListSerializer(datasets, many=True)
-        return Response(serializer.data)
+        """List the last 5 datasets of the current user (or of anonymous uploads)"""
+        owner = request_owner(request)
+        
+        def build():
+            # Served by the (user, upload_date) index
+            datasets = Dataset.objects.filter(user=owner)[:5]
+            return DatasetListSerializer(datasets, many=True).data
+        
+        scope = f'user:{owner.pk}' if owner else 'anonymous'
+        return Response(caching.cached_list(build, scope))
+    
+    # Timings are stored after the upload, without a new version of the dataset
+    @conditional_dataset(unless=lambda request: query_flag(request, 'debug_timing'))
+    def retrieve(self, request, pk=None):
+        """Get a dataset, ?include_data=0 leaves out the rows, ?debug_timing=1 adds upload timings"""
+        if request.query_params.get('include_data', '1').lower() in ('0', 'false', 'no'):
+            data = caching.cached_metadata(
+                int(pk), lambda: DatasetListSerializer(self.get_object()).data
+            )
+        else:
+            data = DatasetSerializer(self.get_object()).data
+        
+        if query_flag(request, 'debug_timing'):
+            # Not part of the cached metadata, the cleanup stage is added later
+            timing = self.get_queryset().filter(pk=pk).values_list('timing', flat=True).first()
+            data = {**data, 'timing': timing}
+        return Response(data)
+    
+    @action(detail=True, methods=['get'])
+    @conditional_dataset()
+    def rows(self, request, pk=None):
+        """Get a window of rows with optional sorting and column filters"""
+        dataset = self.get_object()
+        
+        try:
+            records = filter_records(dataset.records.all(), request.query_params)
+            records = sort_records(records, request.query_params)
+        except RecordFilterError as e:
+            return Response(
+                {'error': str(e)}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        paginator = RowsPagination()
+        page = paginator.paginate_queryset(records, request, view=self)
+        return paginator.get_paginated_response([record.to_row() for record in page])
     
     @action(detail=False, methods=['post'])
     def upload(self, request):
@@ -41,143 +125,248 @@ class DatasetViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
+        # Where the time goes, stored on the dataset (see tracing.py)
+        trace = tracing.Trace()
+        
+        # Identical files are not parsed again, return the stored dataset
+        owner = request_owner(request)
+        with tracing.activate(trace), tracing.span('hash'):
+            content_hash = get_upload_sha256(request, csv_file)
+        existing = Dataset.objects.filter(content_hash=content_hash, user=owner).first()
+        if existing is not None:
+            serializer = DatasetSerializer(existing)
+            return Response(serializer.data, status=status.HTTP_200_OK)
+        
+        # Hand the file to the background workers and report the job
+        if query_flag(request, 'async'):
+            job = jobs.submit_upload(
+                csv_file, user=owner, content_hash=content_hash,
+                skip_invalid=query_flag(request, 'skip_invalid')
+            )
+            serializer = IngestionJobSerializer(job)
+            return Response(
+                serializer.data,
+                status=status.HTTP_202_ACCEPTED,
+                headers={'Location': reverse('job-detail', args=[job.pk], request=request)}
+            )
+        
         try:
-            # Read CSV using pandas
-            df = pd.read_csv(csv_file)
-            
-            # Validate required columns
-            required_columns = ['Equipment Name', 'Type', 'Flowrate', 'Pressure', 'Temperature']
-            missing_columns = [col for col in required_columns if col not in df.columns]
-            
-            if missing_columns:
-                return Response(
-                    {'error': f'Missing columns: {", ".join(missing_columns)}'}, 
-                    status=status.HTTP_400_BAD_REQUEST
+            with tracing.activate(trace):
+                # Stream the CSV in chunks into a new dataset and its records
+                dataset = ingest_csv(
+                    csv_file, csv_file.name, user=owner,
+                    content_hash=content_hash, size_bytes=csv_file.size,
+                    skip_invalid=query_flag(request, 'skip_invalid')
                 )
+                with tracing.span('serialize'):
+                    data = DatasetSerializer(dataset).data
+            # The report is prerendered after the per-type stats refresh
+            timing = tracing.store(dataset.pk, trace.to_dict())
             
-            # Convert dataframe to JSON
-            data = df.to_dict('records')
+            # Cleanup old datasets off the request path, its time is added to the trace
+            retention.schedule_retention(traced_dataset=dataset.pk)
             
-            # Calculate summary statistics
-            summary = {
-                'total_count': len(df),
-                'avg_flowrate': float(df['Flowrate'].mean()),
-                'avg_pressure': float(df['Pressure'].mean()),
-                'avg_temperature': float(df['Temperature'].mean()),
-                'type_distribution': df['Type'].value_counts().to_dict(),
-                'max_flowrate': float(df['Flowrate'].max()),
-                'min_flowrate': float(df['Flowrate'].min()),
-                'max_pressure': float(df['Pressure'].max()),
-                'min_pressure': float(df['Pressure'].min()),
-                'max_temperature': float(df['Temperature'].max()),
-                'min_temperature': float(df['Temperature'].min()),
-            }
+            if query_flag(request, 'debug_timing'):
+                data = {**data, 'timing': timing}
+            return Response(data, status=status.HTTP_201_CREATED)
             
-            # Create dataset
-            dataset = Dataset.objects.create(
-                filename=csv_file.name,
-                data=data,
-                summary=summary
+        except InvalidCellsError as e:
+            # ?skip_invalid=1 would store the valid rows instead
+            return Response(
+                {'error': str(e), 'validation': e.report}, 
+                status=status.HTTP_400_BAD_REQUEST
             )
-            
-            # Cleanup old datasets (keep only last 5)
-            Dataset.cleanup_old_datasets()
-            
-            serializer = DatasetSerializer(dataset)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-            
         except Exception as e:
             return Response(
                 {'error': str(e)}, 
                 status=status.HTTP_400_BAD_REQUEST
             )
     
+    @action(detail=False, methods=['post'])
+    def bulk_upload(self, request):
+        """Upload many CSV files (or ZIP archives of them) in one request"""
+        uploaded_files = request.FILES.getlist('files') + request.FILES.getlist('file')
+        if not uploaded_files:
+            return Response(
+                {'error': 'No files provided'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        # Files are parsed in parallel and stored in one transaction
+        try:
+            results = bulk.ingest_bulk(
+                uploaded_files, user=request_owner(request),
+                skip_invalid=query_flag(request, 'skip_invalid')
+            )
+        except bulk.ArchiveLimitError as e:
+            return Response(
+                {'error': str(e)}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        created = [result['dataset'] for result in results if result['status'] == 'created']
+        for dataset in Dataset.objects.filter(pk__in=created):
+            reports.schedule_prerender(dataset)
+        if created:
+            retention.schedule_retention()
+        
+        return Response(
+            {'results': results},
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK
+        )
+    
+    @action(detail=True, methods=['post'])
+    def append(self, request, pk=None):
+        """Append the rows of a CSV file to an existing dataset"""
+        dataset = self.get_object()
+        
+        if 'file' not in request.FILES:
+            return Response(
+                {'error': 'No file provided'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        csv_file = request.FILES['file']
+        
+        if not csv_file.name.endswith('.csv'):
+            return Response(
+                {'error': 'File must be a CSV'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            # Only the new rows are parsed, their aggregates are merged in
+            dataset, rows_appended, validation = append_csv(
+                dataset, csv_file, skip_invalid=query_flag(request, 'skip_invalid')
+            )
+        except InvalidCellsError as e:
+            return Response(
+                {'error': str(e), 'validation': e.report}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        except Exception as e:
+            return Response(
+                {'error': str(e)}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        serializer = DatasetListSerializer(dataset)
+        return Response({
+            **serializer.data, 'rows_appended': rows_appended, 'validation': validation
+        })
+    
     @action(detail=True, methods=['get'])
+    @conditional_dataset()
     def summary(self, request, pk=None):
-        """Get summary for a specific dataset"""
-        dataset = self.get_object()
-        return Response(dataset.summary)
+        """Get summary and per-type statistics for a specific dataset"""
+        def build():
+            dataset = self.get_object()
+            return {**dataset.summary, 'type_stats': dataset.type_stats}
+        
+        return Response(caching.cached_summary(int(pk), build))
     
     @action(detail=True, methods=['get'])
+    @conditional_dataset()
+    def histogram(self, request, pk=None):
+        """Get binned counts of a numeric column, or of two for a heatmap"""
+        try:
+            params = parse_params(request.query_params)
+        except HistogramError as e:
+            return Response(
+                {'error': str(e)}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        def build():
+            return compute_histogram(self.get_object(), **params)
+        
+        return Response(caching.cached_histogram(int(pk), params, build))
+    
+    @action(detail=False, methods=['get'])
+    def compare(self, request):
+        """Compare dataset b with dataset a, joined on equipment name"""
+        try:
+            params = comparison.parse_params(request.query_params)
+        except comparison.CompareError as e:
+            return Response(
+                {'error': str(e)}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        dataset_a = get_object_or_404(self.get_queryset(), pk=params['a'])
+        dataset_b = get_object_or_404(self.get_queryset(), pk=params['b'])
+        
+        def build():
+            frame, counts = comparison.compare_datasets(dataset_a, dataset_b)
+            rows = comparison.select_rows(frame, params['status'], params['sort'])
+            paginator = RowsPagination()
+            page = paginator.paginate_queryset(rows, request, view=self)
+            return {
+                'a': DatasetListSerializer(dataset_a).data,
+                'b': DatasetListSerializer(dataset_b).data,
+                'counts': counts,
+                'movers': comparison.largest_movers(frame, params['top']),
+                **paginator.get_paginated_response(page).data,
+            }
+        
+        # Pages are cached by URL, links in them are absolute
+        key = hashlib.sha256(request.build_absolute_uri().encode()).hexdigest()
+        return Response(caching.cached_comparison(dataset_a.pk, dataset_b.pk, key, build))
+    
+    @action(detail=True, methods=['get'])
+    @conditional_dataset(extra=reports.REPORT_TEMPLATE_VERSION)
     def download_pdf(self, request, pk=None):
-        """Generate PDF report for a dataset"""
+        """Download the PDF report for a dataset, rendered once and cached"""
         dataset = self.get_object()
         
-        # Create PDF
-        buffer = io.BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=letter)
-        elements = []
-        styles = getSampleStyleSheet()
-        
-        # Title
-        title = Paragraph(f"<b>Chemical Equipment Report</b><br/>{dataset.filename}", styles['Title'])
-        elements.append(title)
-        elements.append(Spacer(1, 12))
-        
-        # Summary statistics
-        summary_text = f"""
-        <b>Summary Statistics</b><br/>
-        Total Equipment: {dataset.summary['total_count']}<br/>
-        Average Flowrate: {dataset.summary['avg_flowrate']:.2f}<br/>
-        Average Pressure: {dataset.summary['avg_pressure']:.2f}<br/>
-        Average Temperature: {dataset.summary['avg_temperature']:.2f}<br/>
-        """
-        elements.append(Paragraph(summary_text, styles['Normal']))
-        elements.append(Spacer(1, 12))
-        
-        # Equipment type distribution
-        elements.append(Paragraph("<b>Equipment Type Distribution</b>", styles['Heading2']))
-        type_data = [['Type', 'Count']]
-        for eq_type, count in dataset.summary['type_distribution'].items():
-            type_data.append([eq_type, str(count)])
-        
-        type_table = Table(type_data)
-        type_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 14),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black)
-        ]))
-        elements.append(type_table)
-        elements.append(Spacer(1, 12))
-        
-        # Equipment data table (first 10 rows)
-        elements.append(Paragraph("<b>Equipment Data (First 10 Rows)</b>", styles['Heading2']))
-        data_table = [['Name', 'Type', 'Flowrate', 'Pressure', 'Temp']]
-        for i, row in enumerate(dataset.data[:10]):
-            data_table.append([
-                row['Equipment Name'],
-                row['Type'],
-                f"{row['Flowrate']:.2f}",
-                f"{row['Pressure']:.2f}",
-                f"{row['Temperature']:.2f}"
-            ])
-        
-        equipment_table = Table(data_table)
-        equipment_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ('FONTSIZE', (0, 1), (-1, -1), 8)
-        ]))
-        elements.append(equipment_table)
-        
-        # Build PDF
-        doc.build(elements)
-        buffer.seek(0)
-        
-        response = HttpResponse(buffer, content_type='application/pdf')
-        response['Content-Disposition'] = f'attachment; filename="{dataset.filename}_report.pdf"'
-        return response
+        # ?full=1 lists every row instead of the first 10
+        variant = 'full' if query_flag(request, 'full') else 'summary'
+        path = reports.cached_report(dataset, variant)
+        if path is None and reports.renders_in_background(dataset, variant):
+            # Too many rows to render within the request, poll until it's cached
+            try:
+                reports.render_in_background(dataset, variant)
+            except reports.ReportRenderError as e:
+                return Response(
+                    {'error': str(e)}, 
+                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                )
+            return Response(
+                {'status': 'rendering', 'retry_after': reports.RETRY_AFTER_SECONDS},
+                status=status.HTTP_202_ACCEPTED,
+                headers={'Retry-After': str(reports.RETRY_AFTER_SECONDS)}
+            )
+        if path is None:
+            path = reports.get_report(dataset, variant)
+        return FileResponse(
+            open(path, 'rb'),
+            as_attachment=True,
+            filename=f"{dataset.filename}_{'full_' if variant == 'full' else ''}report.pdf",
+            content_type='application/pdf'
+        )
+
+class IngestionJobViewSet(mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    queryset = IngestionJob.objects.all()
+    serializer_class = IngestionJobSerializer
+    permission_classes = [AllowAny]
+    
+    def retrieve(self, request, pk=None):
+        """Get state and progress of a background ingestion job"""
+        job = self.get_object()
+        if job.state == IngestionJob.STATE_RUNNING:
+            job.rows_processed = max(job.rows_processed, jobs.get_live_progress(job.pk))
+        serializer = self.get_serializer(job)
+        return Response(serializer.data)
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def cache_stats(request):
+    """Hit/miss counters of the response and frame caches in this process"""
+    return Response({**caching.get_stats(), 'frames': frames.get_stats()})
+
+def metrics_view(request):
+    """Process metrics in the Prometheus text format"""
+    return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)
 
 @api_view(['GET'])
 @permission_classes([AllowAny])
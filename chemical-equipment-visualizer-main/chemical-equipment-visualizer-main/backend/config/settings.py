@@ -2,6 +2,7 @@
 Django settings for chemical_equipment project.
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project
@@ -30,6 +31,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.MetricsMiddleware',  # Latency, SQL and size per view, served at /api/metrics/
+    'django.middleware.gzip.GZipMiddleware',  # Compress responses, runs last on the way out
+    'api.middleware.BrotliMiddleware',  # Preferred over gzip when the client accepts br
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -61,13 +65,27 @@ TEMPLATES = [
 WSGI_APPLICATION = 'config.wsgi.application'
 
 # Database
+# SQLite by default; e.g. DB_ENGINE=postgresql DB_NAME=equipment for a local PostgreSQL
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'ENGINE': 'django.db.backends.' + os.environ.get('DB_ENGINE', 'sqlite3'),
+        'NAME': os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),
+        'USER': os.environ.get('DB_USER', ''),
+        'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+        'HOST': os.environ.get('DB_HOST', ''),
+        'PORT': os.environ.get('DB_PORT', ''),
+        'CONN_MAX_AGE': 60,  # Keep connections open between requests
+        'CONN_HEALTH_CHECKS': True,  # Replace persistent connections that went away
     }
 }
 
+# Applied to every new SQLite connection, see api/db.py; ignored on other databases
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',  # Readers don't block the writer and vice versa
+    'synchronous': 'NORMAL',  # Durable enough with WAL, far fewer fsyncs
+    'busy_timeout': 20000,  # Milliseconds to wait for a lock instead of failing with "database is locked"
+}
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -115,4 +133,66 @@ REST_FRAMEWORK = {
 
 # File upload settings
 FILE_UPLOAD_MAX_MEMORY_SIZE = 10485760  # 10MB
-DATA_UPLOAD_MAX_MEMORY_SIZE = 10485760  # 10MB
\ No newline at end of file
+DATA_UPLOAD_MAX_MEMORY_SIZE = 10485760  # 10MB
+FILE_UPLOAD_HANDLERS = [
+    'api.uploads.HashingUploadHandler',  # SHA-256 of uploads for deduplication
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+
+# CSV ingestion settings
+CSV_INGEST_CHUNK_SIZE = 50000  # Rows parsed per chunk while streaming uploads
+CSV_INGEST_BATCH_SIZE = 5000  # Rows per bulk_create batch
+CSV_ENGINE = 'auto'  # 'auto' parses with pyarrow when installed, 'pandas' forces pandas' parser
+CSV_FLOAT_DTYPE = 'float64'  # 'float32' halves numeric memory but keeps only ~7 significant digits
+CSV_VALUE_RANGES = {  # Inclusive (min, max) per numeric column, None = unbounded
+    'Flowrate': (0, None),
+    'Pressure': (0, None),
+    'Temperature': (-273.15, None),
+}
+CSV_VALIDATION_EXAMPLES = 10  # Row numbers listed per column and rule in validation reports
+
+# Background ingestion (?async=1 uploads)
+INGEST_WORKERS = 2  # Threads processing queued uploads
+INGEST_SPOOL_DIR = None  # Where uploads wait for a worker, None = system temp dir
+BULK_UPLOAD_WORKERS = None  # Processes parsing bulk uploads, None = one per CPU
+# Limits on the ZIP archives of one bulk upload, checked before extracting
+BULK_ZIP_MAX_MEMBERS = 1000  # Files in all archives
+BULK_ZIP_MAX_BYTES = 1024 * 1024 * 1024  # Uncompressed size of all members
+BULK_ZIP_MAX_RATIO = 100  # Uncompressed / compressed size of any member
+
+# PDF report cache
+REPORT_CACHE_DIR = BASE_DIR / 'report_cache'  # Rendered reports, keyed by dataset and template version
+REPORT_PRERENDER = True  # Render the report in the background right after upload
+REPORT_ROWS_PER_TABLE = 40  # Rows per table chunk in ?full=1 reports
+REPORT_BACKGROUND_ROWS = 20000  # ?full=1 reports of more rows are rendered in the background (202 until ready)
+
+# Dataset retention, see api/retention.py
+DATASET_RETENTION = {
+    'MAX_COUNT': 5,  # Newest datasets kept overall
+    'MAX_AGE_DAYS': None,
+    'MAX_TOTAL_BYTES': None,
+    'MAX_PER_USER': None,
+}
+
+# Response cache for the dataset list, metadata and summaries, see api/caching.py
+CACHES = {
+    'default': {
+        # Per process; use FileBasedCache, Redis or Memcached to share entries between workers
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'datasets',
+    }
+}
+DATASET_CACHE_ALIAS = 'default'
+DATASET_CACHE_TIMEOUT = 300  # Seconds; entries are also invalidated on every change
+
+# Decoded dataset frames kept in memory by each worker for histograms,
+# comparisons and full reports, see api/frames.py
+DATASET_FRAME_CACHE_BYTES = 256 * 1024 * 1024  # 0 disables the cache
+
+# Prometheus metrics at /api/metrics/, see api/metrics.py
+METRICS_ENABLED = True  # Per-request latency, SQL and size metrics (MetricsMiddleware)
+
+# Async serving of the dataset endpoints under ASGI, see api/offload.py
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS', '0') == '1'  # Set by config/asgi.py
+ASYNC_WORKERS = None  # Threads running offloaded views, None for one per CPU
\ No newline at end of file
@@ -0,0 +1,11 @@
+"""
+Benchmark suite for the backend endpoints and the desktop widgets.
+
+    python -m benchmarks.generate --rows 100000 -o data.csv
+    python -m benchmarks.run --rows 1000 100000 --output results.json
+    python -m benchmarks.compare baseline.json results.json
+    python -m benchmarks.load --url http://localhost:8000/api --concurrency 1 4 16
+
+Run from the project root (the directory holding backend/ and
+frontend-desktop/).
+"""
@@ -0,0 +1,122 @@
+"""
+Endpoint scenarios, run through Django's test client.
+
+The backend runs in-process against a throwaway database created like the
+test runner does (a SQLite file in the work directory, or test_<name> on
+PostgreSQL). Report pre-rendering and retention are switched off so no
+background work overlaps the timings, and the report cache lives in the
+work directory.
+
+Scenarios without a suffix start cold: the response, frame and report
+caches are cleared before every repeat. '_cached' scenarios measure the
+warm path.
+"""
+import os
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / 'backend'
+FULL_PDF_MAX_ROWS = 100_000
+
+
+def setup_django(workdir):
+    """Configure Django and create the benchmark database, returns a teardown"""
+    sys.path.insert(0, str(BACKEND_DIR))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+
+    import django
+    django.setup()
+
+    from django.db import connection
+    from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+    overrides = override_settings(
+        REPORT_PRERENDER=False,
+        REPORT_CACHE_DIR=os.path.join(workdir, 'reports'),
+        DATASET_RETENTION={'MAX_COUNT': None},
+    )
+    overrides.enable()
+    setup_test_environment()
+    if connection.vendor == 'sqlite':
+        connection.settings_dict['TEST']['NAME'] = os.path.join(workdir, 'benchmark.sqlite3')
+    old_name = connection.creation.create_test_db(verbosity=0)
+
+    def teardown():
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+        overrides.disable()
+    return teardown
+
+
+def _consume(response):
+    """Read the whole body and return its size"""
+    if response.streaming:
+        size = sum(len(chunk) for chunk in response.streaming_content)
+        response.close()
+        return size
+    return len(response.content)
+
+
+class BackendBench:
+    """Scenarios for one generated CSV"""
+
+    def __init__(self, csv_path, rows):
+        from django.test import Client
+        self.client = Client()
+        self.csv_path = csv_path
+        self.rows = rows
+        self.dataset_id = None
+
+    def _get(self, url):
+        response = self.client.get(url)
+        if response.status_code != 200:
+            raise RuntimeError(f'GET {url} returned {response.status_code}')
+        return {'bytes': _consume(response)}
+
+    def reset_caches(self):
+        from api import caching, frames, reports
+        self.ensure_dataset()
+        caching.get_cache().clear()
+        frames.get_frame_cache().invalidate([self.dataset_id])
+        reports.evict_reports([self.dataset_id])
+
+    def clear_datasets(self):
+        from api.models import Dataset
+        Dataset.objects.all().delete()
+        self.dataset_id = None
+
+    def upload(self):
+        with open(self.csv_path, 'rb') as file:
+            response = self.client.post('/api/datasets/upload/', {'file': file})
+        if response.status_code != 201:
+            raise RuntimeError(f'Upload returned {response.status_code}: {response.content[:200]!r}')
+        self.dataset_id = response.json()['id']
+        return {'bytes': os.path.getsize(self.csv_path)}
+
+    def ensure_dataset(self):
+        if self.dataset_id is None:
+            self.upload()
+
+    def scenarios(self):
+        """(name, setup, run, skip reason) for every scenario"""
+        def url(path=''):
+            return f'/api/datasets/{self.dataset_id}/{path}'
+
+        cold = self.reset_caches
+        full_pdf_skip = None
+        if self.rows > FULL_PDF_MAX_ROWS:
+            full_pdf_skip = f'more than {FULL_PDF_MAX_ROWS} rows'
+
+        return [
+            # Datasets are deduplicated by content, so every upload starts empty
+            ('upload', self.clear_datasets, self.upload, None),
+            ('list', cold, lambda: self._get('/api/datasets/'), None),
+            ('retrieve', cold, lambda: self._get(url()), None),
+            ('retrieve_metadata', cold, lambda: self._get(url() + '?include_data=0'), None),
+            ('summary', cold, lambda: self._get(url('summary/')), None),
+            ('summary_cached', self.ensure_dataset, lambda: self._get(url('summary/')), None),
+            ('histogram', cold, lambda: self._get(url('histogram/?column=Pressure&bins=64&by=type')), None),
+            ('download_pdf', cold, lambda: self._get(url('download_pdf/')), None),
+            ('download_pdf_cached', self.ensure_dataset, lambda: self._get(url('download_pdf/')), None),
+            ('download_pdf_full', cold, lambda: self._get(url('download_pdf/?full=1')), full_pdf_skip),
+        ]
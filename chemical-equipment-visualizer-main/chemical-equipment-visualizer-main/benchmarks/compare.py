@@ -0,0 +1,51 @@
+"""
+Compare two benchmark result files.
+
+    python -m benchmarks.compare baseline.json current.json --threshold 1.2
+
+Scenarios are matched on (group, scenario, rows) and compared by median
+time. The exit status is 1 when a scenario got slower than threshold
+times the baseline, so the comparison can gate a CI job.
+"""
+import argparse
+import json
+import sys
+
+
+def load_medians(path):
+    with open(path) as file:
+        results = json.load(file)['results']
+    return {
+        (result['group'], result['scenario'], result['rows']): result['seconds']['median']
+        for result in results if 'seconds' in result
+    }
+
+
+def compare(baseline, current, threshold):
+    """Rows of (key, baseline median, current median, ratio, regressed)"""
+    rows = []
+    for key in sorted(baseline.keys() & current.keys()):
+        ratio = current[key] / baseline[key] if baseline[key] else None
+        rows.append((key, baseline[key], current[key], ratio, ratio is not None and ratio > threshold))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare two benchmark result files')
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--threshold', type=float, default=1.2, help='slowdown ratio that counts as a regression')
+    args = parser.parse_args(argv)
+
+    rows = compare(load_medians(args.baseline), load_medians(args.current), args.threshold)
+    for (group, scenario, size), before, after, ratio, regressed in rows:
+        change = '' if ratio is None else f'x{ratio:.2f}'
+        print(
+            f"{group:8} {scenario:20} {size:>10} {before * 1000:10.1f} ms {after * 1000:10.1f} ms"
+            f"  {change}{'  REGRESSION' if regressed else ''}"
+        )
+    sys.exit(1 if any(row[4] for row in rows) else 0)
+
+
+if __name__ == '__main__':
+    main()
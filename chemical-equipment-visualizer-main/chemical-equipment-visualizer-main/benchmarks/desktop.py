@@ -0,0 +1,107 @@
+"""
+Desktop widget scenarios, run under offscreen Qt.
+
+The widgets get the same rows and summary the API would return. Each
+update is followed by processing pending events, so the time includes
+layout and painting (the matplotlib canvases draw on paint). PyQt5 and
+matplotlib are optional: without them every scenario is reported as
+skipped.
+"""
+import math
+import os
+import sys
+from pathlib import Path
+
+DESKTOP_DIR = Path(__file__).resolve().parent.parent / 'frontend-desktop'
+TABLE_MAX_ROWS = 100_000
+SCENARIOS = ['table_update', 'charts_update']
+NUMERIC_COLUMNS = ['Flowrate', 'Pressure', 'Temperature']
+
+
+def import_error():
+    """Why the desktop scenarios can't run, or None"""
+    try:
+        import matplotlib  # noqa: F401
+        import PyQt5  # noqa: F401
+    except ImportError as e:
+        return str(e)
+    return None
+
+
+def summarize(blocks):
+    """The summary fields the charts read, computed like the API does"""
+    total = 0
+    types = {}
+    columns = {column: [0, 0.0, math.inf, -math.inf] for column in NUMERIC_COLUMNS}  # count, sum, min, max
+    for block in blocks:
+        total += len(block)
+        for name, count in block['Type'].value_counts().items():
+            types[name] = types.get(name, 0) + int(count)
+        for column, state in columns.items():
+            values = block[column].dropna()
+            if len(values):
+                state[0] += len(values)
+                state[1] += float(values.sum())
+                state[2] = min(state[2], float(values.min()))
+                state[3] = max(state[3], float(values.max()))
+
+    summary = {
+        'total_count': total,
+        'type_distribution': dict(sorted(types.items(), key=lambda item: item[1], reverse=True)),
+    }
+    for column, (count, total_value, low, high) in columns.items():
+        summary[f'avg_{column.lower()}'] = total_value / count if count else None
+        summary[f'min_{column.lower()}'] = low if count else None
+        summary[f'max_{column.lower()}'] = high if count else None
+    return summary
+
+
+def api_rows(frame):
+    """Rows as the API sends them, blank cells as None"""
+    values = frame.astype(object)
+    return values.where(frame.notna(), None).to_dict('records')
+
+
+class DesktopBench:
+    """Scenarios for one generated dataset
+
+    data is the list of rows, None when there are too many to show in
+    the table.
+    """
+
+    def __init__(self, rows, data, summary):
+        os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+        sys.path.insert(0, str(DESKTOP_DIR))
+        from PyQt5.QtWidgets import QApplication
+        from ui.charts_widget import ChartsWidget
+        from ui.table_widget import TableWidget
+
+        self.app = QApplication.instance() or QApplication([])
+        self.rows = rows
+        self.data = data
+        self.summary = summary
+        self.table = TableWidget()
+        self.charts = ChartsWidget()
+        self.table.show()
+        self.charts.show()
+
+    def update_table(self):
+        self.table.update_table(self.data)
+        self.app.processEvents()
+        return {}
+
+    def update_charts(self):
+        # The charts only read the summary, data just has to be non-empty
+        self.charts.update_charts(self.data or [{}], self.summary)
+        self.app.processEvents()
+        return {}
+
+    def scenarios(self):
+        """(name, setup, run, skip reason) for every scenario"""
+        table_skip = None
+        if self.data is None:
+            table_skip = f'more than {TABLE_MAX_ROWS} rows'
+        return [
+            ('table_update', None, self.update_table, table_skip),
+            ('charts_update', None, self.update_charts, None),
+        ]
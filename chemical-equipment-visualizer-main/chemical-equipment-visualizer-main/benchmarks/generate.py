@@ -0,0 +1,117 @@
+"""
+Deterministic generator of synthetic equipment CSVs.
+
+The same arguments always produce the same file, byte for byte, whatever
+the machine: rows are generated in fixed blocks of BLOCK_ROWS, each from
+its own seeded generator, so memory stays bounded up to tens of millions
+of rows.
+
+Equipment types follow a skewed (Zipf-like) distribution and every type
+has its own typical flowrate, pressure and temperature; values scatter
+around those by 10%. Names are unique ('Pump-17'). A fraction nan_rate of
+the numeric cells is left blank.
+
+    python -m benchmarks.generate --rows 1000000 --types 8 --nan-rate 0.01 -o data.csv
+"""
+import argparse
+import sys
+
+import numpy as np
+import pandas as pd
+
+BLOCK_ROWS = 100_000
+COLUMNS = ['Equipment Name', 'Type', 'Flowrate', 'Pressure', 'Temperature']
+EQUIPMENT_TYPES = [
+    'Pump', 'Valve', 'Heat Exchanger', 'Reactor', 'Compressor', 'Column', 'Tank', 'Condenser',
+    'Boiler', 'Mixer', 'Separator', 'Filter', 'Dryer', 'Evaporator', 'Turbine', 'Furnace',
+]
+
+
+def type_names(types):
+    """Names of the first `types` equipment types, numbered past the known ones"""
+    return [
+        EQUIPMENT_TYPES[i] if i < len(EQUIPMENT_TYPES)
+        else f'{EQUIPMENT_TYPES[i % len(EQUIPMENT_TYPES)]} {i // len(EQUIPMENT_TYPES) + 1}'
+        for i in range(types)
+    ]
+
+
+def _profiles(types, seed):
+    """Per-type weights and typical (flowrate, pressure, temperature)"""
+    rng = np.random.default_rng([seed, 0])
+    weights = 1 / np.arange(1, types + 1) ** 0.8
+    typical = np.column_stack([
+        rng.lognormal(np.log(120), 0.6, types),  # Flowrate
+        rng.lognormal(np.log(6), 0.5, types),  # Pressure
+        rng.uniform(40, 350, types),  # Temperature
+    ])
+    return weights / weights.sum(), typical
+
+
+def generate_block(index, rows, types=5, nan_rate=0.0, seed=0):
+    """Rows [index * BLOCK_ROWS, index * BLOCK_ROWS + rows) as a DataFrame"""
+    rng = np.random.default_rng([seed, index + 1])
+    weights, typical = _profiles(types, seed)
+    names = np.array(type_names(types), dtype=object)
+
+    codes = rng.choice(types, size=rows, p=weights)
+    values = typical[codes] * rng.normal(1.0, 0.1, size=(rows, 3))
+    # Flowrate and pressure can't be negative
+    values[:, :2] = np.abs(values[:, :2])
+    values = values.round(2)
+    if nan_rate:
+        values[rng.random(size=values.shape) < nan_rate] = np.nan
+
+    start = index * BLOCK_ROWS
+    numbers = pd.Series(np.arange(start + 1, start + rows + 1)).astype(str)
+    return pd.DataFrame({
+        'Equipment Name': pd.Series(names[codes]) + '-' + numbers,
+        'Type': names[codes],
+        'Flowrate': values[:, 0],
+        'Pressure': values[:, 1],
+        'Temperature': values[:, 2],
+    })
+
+
+def iter_blocks(rows, types=5, nan_rate=0.0, seed=0):
+    for index, start in enumerate(range(0, rows, BLOCK_ROWS)):
+        yield generate_block(index, min(BLOCK_ROWS, rows - start), types, nan_rate, seed)
+
+
+def generate_frame(rows, types=5, nan_rate=0.0, seed=0):
+    """All rows as one DataFrame, for sizes that fit in memory"""
+    blocks = list(iter_blocks(rows, types, nan_rate, seed))
+    return pd.concat(blocks, ignore_index=True) if blocks else pd.DataFrame(columns=COLUMNS)
+
+
+def write_csv(output, rows, types=5, nan_rate=0.0, seed=0):
+    """Write the CSV to a path or text file object, block by block"""
+    if isinstance(output, str):
+        with open(output, 'w', newline='') as file:
+            return write_csv(file, rows, types, nan_rate, seed)
+
+    output.write(','.join(COLUMNS) + '\n')
+    for block in iter_blocks(rows, types, nan_rate, seed):
+        # Values are already rounded, so their shortest repr is short
+        block.to_csv(output, header=False, index=False, lineterminator='\n')
+
+
+def add_arguments(parser):
+    parser.add_argument('--types', type=int, default=5, help='number of equipment types')
+    parser.add_argument('--nan-rate', type=float, default=0.0, help='fraction of blank numeric cells')
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate a synthetic equipment CSV')
+    parser.add_argument('--rows', type=int, default=1000)
+    add_arguments(parser)
+    parser.add_argument('-o', '--output', default='-', help="CSV path, '-' for stdout")
+    args = parser.parse_args(argv)
+
+    output = sys.stdout if args.output == '-' else args.output
+    write_csv(output, args.rows, args.types, args.nan_rate, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,397 @@
+"""
+Load generator for a running backend.
+
+    python -m benchmarks.load --url http://localhost:8000/api \\
+        --concurrency 1 4 16 64 --duration 30 --output load.json
+
+Each concurrency level runs that many virtual users for --duration
+seconds. A user holds one keep-alive connection, like a browser tab or a
+desktop client, and loops over requests drawn at random from the traffic
+mix:
+
+    health   GET  /health/
+    history  GET  /datasets/                   (the dashboard polling)
+    open     GET  /datasets/{id}/              (all rows)
+    upload   POST /datasets/upload/            (a generated CSV)
+    pdf      GET  /datasets/{id}/download_pdf/
+
+--mix sets their weights, e.g. --mix history=50,open=30,upload=5,pdf=15.
+Users wait --think seconds between requests; with the default of 0 they
+send the next one as soon as the previous answered, so the server is
+saturated and the throughput at each level is what it can sustain.
+Requests of the first --warmup seconds of a level aren't counted.
+
+Uploads are generated once (see generate.py) and made unique with one
+extra row each, so the server parses them rather than deduplicating.
+Datasets to open are picked among those of the last history response and
+the uploads. The server's retention policy deletes old datasets while
+uploads keep coming, and requests for deleted ones count as errors:
+raise DATASET_RETENTION['MAX_COUNT'] on the server under test, or leave
+uploads out of the mix.
+
+Django's runserver answers requests on a reused connection about 40 ms
+late (Nagle's algorithm on its side meets delayed ACKs on ours); measure
+the server you deploy, or pass --no-keepalive to open a connection per
+request.
+
+Only the standard library does the HTTP (threads and http.client), so
+runs are comparable across machines. Per level and per endpoint the
+report gives requests, throughput, p50/p95/p99 latency and error rate;
+the JSON output keeps status counts and errors too.
+"""
+import argparse
+import gzip
+import http.client
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit
+
+from .generate import add_arguments, generate_frame
+from .run import get_meta
+
+RESULTS_VERSION = 1
+OPERATIONS = ['health', 'history', 'open', 'upload', 'pdf']
+DEFAULT_MIX = {'health': 5, 'history': 35, 'open': 35, 'upload': 5, 'pdf': 20}
+DEFAULT_CONCURRENCY = [1, 2, 4, 8, 16, 32]
+PERCENTILES = [50, 95, 99]
+
+
+class Client:
+    """One keep-alive HTTP connection to the API"""
+
+    def __init__(self, base_url, token=None, timeout=60, keepalive=True):
+        url = urlsplit(base_url)
+        self.connection_class = (
+            http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+        )
+        self.host = url.netloc
+        self.prefix = url.path.rstrip('/')
+        self.timeout = timeout
+        self.headers = {'Accept-Encoding': 'gzip'}
+        if not keepalive:
+            self.headers['Connection'] = 'close'
+        if token:
+            self.headers['Authorization'] = f'Token {token}'
+        self.connection = None
+
+    def request(self, method, path, body=None, headers=None):
+        """Send a request and read the whole response, returns (status, body, encoding)"""
+        headers = {**self.headers, **(headers or {})}
+        while True:
+            reused = self.connection is not None
+            if not reused:
+                self.connection = self.connection_class(self.host, timeout=self.timeout)
+            try:
+                self.connection.request(method, self.prefix + path, body, headers)
+                response = self.connection.getresponse()
+                data = response.read()
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                self.close()
+                if reused:
+                    # The server closed the idle connection, send again on a new one
+                    continue
+                raise
+            except Exception:
+                self.close()
+                raise
+            if response.will_close:
+                self.close()
+            return response.status, data, response.getheader('Content-Encoding')
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+def _json(data, encoding):
+    return json.loads(gzip.decompress(data) if encoding == 'gzip' else data)
+
+
+class DatasetPool:
+    """Ids of datasets the users can open, shared by every user"""
+
+    def __init__(self):
+        self.ids = []
+        self.lock = threading.Lock()
+
+    def replace(self, ids):
+        with self.lock:
+            self.ids = list(ids)
+
+    def add(self, dataset_id):
+        with self.lock:
+            if dataset_id not in self.ids:
+                self.ids.append(dataset_id)
+
+    def pick(self, rng):
+        with self.lock:
+            return rng.choice(self.ids) if self.ids else None
+
+
+class UploadSource:
+    """Generated CSV bodies, each one different"""
+
+    def __init__(self, rows, types, nan_rate, seed):
+        frame = generate_frame(rows, types, nan_rate, seed)
+        self.csv = frame.to_csv(index=False, lineterminator='\n').encode()
+        self.run = uuid.uuid4().hex[:8]
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def next_body(self):
+        """A multipart body and its content type"""
+        with self.lock:
+            self.count += 1
+            number = self.count
+        boundary = uuid.uuid4().hex
+        csv = self.csv + f'load-{self.run}-{number},Pump,100,5,80\n'.encode()
+        body = b''.join([
+            f'--{boundary}\r\n'.encode(),
+            f'Content-Disposition: form-data; name="file"; filename="load-{number}.csv"\r\n'.encode(),
+            b'Content-Type: text/csv\r\n\r\n',
+            csv,
+            f'\r\n--{boundary}--\r\n'.encode(),
+        ])
+        return body, f'multipart/form-data; boundary={boundary}'
+
+
+class Traffic:
+    """The operations of the mix, each returns (status, response bytes)"""
+
+    def __init__(self, pool, uploads):
+        self.pool = pool
+        self.uploads = uploads
+
+    def health(self, client, rng):
+        status, data, _ = client.request('GET', '/health/')
+        return status, len(data)
+
+    def history(self, client, rng):
+        status, data, encoding = client.request('GET', '/datasets/')
+        if status == 200:
+            self.pool.replace(dataset['id'] for dataset in _json(data, encoding))
+        return status, len(data)
+
+    def open(self, client, rng):
+        dataset_id = self.pool.pick(rng)
+        if dataset_id is None:
+            return self.history(client, rng)
+        status, data, _ = client.request('GET', f'/datasets/{dataset_id}/')
+        return status, len(data)
+
+    def upload(self, client, rng):
+        body, content_type = self.uploads.next_body()
+        status, data, encoding = client.request(
+            'POST', '/datasets/upload/', body, {'Content-Type': content_type}
+        )
+        if status in (200, 201):
+            self.pool.add(_json(data, encoding)['id'])
+        return status, len(data)
+
+    def pdf(self, client, rng):
+        dataset_id = self.pool.pick(rng)
+        if dataset_id is None:
+            return self.history(client, rng)
+        status, data, _ = client.request('GET', f'/datasets/{dataset_id}/download_pdf/')
+        return status, len(data)
+
+
+def run_user(client, traffic, mix, rng, deadline, think, samples):
+    """Send requests until the deadline, appending (started, operation,
+    seconds, status, bytes, error) to samples"""
+    operations = list(mix)
+    weights = [mix[operation] for operation in operations]
+    try:
+        while True:
+            started = time.perf_counter()
+            if started >= deadline:
+                return
+            operation = rng.choices(operations, weights)[0]
+            status, size, error = None, 0, None
+            try:
+                status, size = getattr(traffic, operation)(client, rng)
+            except Exception as e:
+                error = f'{type(e).__name__}: {e}'
+            samples.append((started, operation, time.perf_counter() - started, status, size, error))
+            if think:
+                time.sleep(rng.expovariate(1 / think))
+    finally:
+        client.close()
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of sorted values"""
+    if not values:
+        return None
+    rank = max(1, -(-len(values) * p // 100))
+    return values[int(rank) - 1]
+
+
+def summarize(samples, seconds):
+    """Requests, throughput, latency percentiles and errors of samples"""
+    latencies = sorted(sample[2] for sample in samples)
+    statuses = {}
+    errors = {}
+    failed = 0
+    for _, _, _, status, _, error in samples:
+        if error is not None:
+            errors[error] = errors.get(error, 0) + 1
+            failed += 1
+        else:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+            if status >= 400:
+                failed += 1
+
+    return {
+        'requests': len(samples),
+        'throughput': len(samples) / seconds if seconds else None,
+        'error_rate': failed / len(samples) if samples else None,
+        'bytes': sum(sample[4] for sample in samples),
+        'latency': {
+            **{f'p{p}': percentile(latencies, p) for p in PERCENTILES},
+            'mean': sum(latencies) / len(latencies) if latencies else None,
+            'max': latencies[-1] if latencies else None,
+        },
+        'statuses': statuses,
+        'errors': errors,
+    }
+
+
+def run_level(args, traffic, concurrency):
+    """Run concurrency users for warmup + duration seconds"""
+    start = time.perf_counter()
+    measured_from = start + args.warmup
+    deadline = measured_from + args.duration
+    samples = [[] for _ in range(concurrency)]
+    users = [
+        threading.Thread(
+            target=run_user, name=f'user-{index}', daemon=True,
+            args=(
+                Client(args.url, args.token, args.timeout, args.keepalive), traffic, args.mix,
+                random.Random(f'{args.seed}-{concurrency}-{index}'), deadline, args.think,
+                samples[index],
+            ),
+        )
+        for index in range(concurrency)
+    ]
+    for user in users:
+        user.start()
+    for user in users:
+        user.join()
+    # Requests started before the deadline are waited for and counted
+    seconds = max(time.perf_counter(), deadline) - measured_from
+
+    measured = [sample for user in samples for sample in user if sample[0] >= measured_from]
+    level = {'concurrency': concurrency, 'seconds': seconds, **summarize(measured, seconds)}
+    level['endpoints'] = {
+        operation: summarize([sample for sample in measured if sample[1] == operation], seconds)
+        for operation in args.mix
+    }
+    return level
+
+
+def seed_datasets(args, traffic):
+    """Fill the dataset pool, uploading one dataset when the server has none"""
+    client = Client(args.url, args.token, args.timeout, args.keepalive)
+    try:
+        rng = random.Random(args.seed)
+        status, _ = traffic.history(client, rng)
+        if status != 200:
+            raise SystemExit(f'GET {args.url}/datasets/ returned {status}')
+        if traffic.pool.pick(rng) is None:
+            traffic.upload(client, rng)
+    finally:
+        client.close()
+
+
+def _ms(seconds):
+    return '-' if seconds is None else f'{seconds * 1000:.1f}'
+
+
+def _report(level):
+    print(
+        f"concurrency {level['concurrency']}: {level['requests']} requests, "
+        f"{level['throughput']:.1f} req/s, {level['error_rate'] or 0:.1%} errors",
+        file=sys.stderr,
+    )
+    rows = [('total', level)] + list(level['endpoints'].items())
+    for name, result in rows:
+        latency = result['latency']
+        print(
+            f"  {name:8} {result['requests']:>8} {result['throughput']:>9.1f}/s"
+            f" {_ms(latency['p50']):>9} {_ms(latency['p95']):>9} {_ms(latency['p99']):>9} ms"
+            f"  {result['error_rate'] or 0:7.1%}",
+            file=sys.stderr,
+        )
+
+
+def parse_mix(value):
+    """'history=50,open=30' -> {'history': 50.0, 'open': 30.0}"""
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"unknown operation '{name}', expected one of {OPERATIONS}")
+        try:
+            mix[name] = float(weight)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"weight of '{name}' must be a number")
+    if not any(weight > 0 for weight in mix.values()):
+        raise argparse.ArgumentTypeError('at least one weight must be positive')
+    return {name: weight for name, weight in mix.items() if weight > 0}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay mixed traffic against a running backend')
+    parser.add_argument('--url', default='http://localhost:8000/api', help='API base URL')
+    parser.add_argument('--token', help='API token, uploads are anonymous without it')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=DEFAULT_CONCURRENCY,
+                        help='numbers of concurrent users, one level each')
+    parser.add_argument('--duration', type=float, default=30, help='measured seconds per level')
+    parser.add_argument('--warmup', type=float, default=5, help='unmeasured seconds before each level')
+    parser.add_argument('--think', type=float, default=0, help='mean pause of a user between requests')
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help='operation weights, e.g. history=50,open=30,upload=5,pdf=15')
+    parser.add_argument('--timeout', type=float, default=60, help='socket timeout of a request')
+    parser.add_argument('--no-keepalive', dest='keepalive', action='store_false',
+                        help='open a new connection for every request')
+    parser.add_argument('--upload-rows', type=int, default=1000, help='rows of each uploaded CSV')
+    add_arguments(parser)
+    parser.add_argument('-o', '--output', default='-', help="JSON path, '-' for stdout")
+    args = parser.parse_args(argv)
+
+    uploads = None
+    if 'upload' in args.mix or 'open' in args.mix or 'pdf' in args.mix:
+        uploads = UploadSource(args.upload_rows, args.types, args.nan_rate, args.seed)
+    traffic = Traffic(DatasetPool(), uploads)
+    if uploads is not None:
+        seed_datasets(args, traffic)
+
+    output = {'version': RESULTS_VERSION, 'meta': get_meta(args), 'levels': []}
+    for concurrency in args.concurrency:
+        level = run_level(args, traffic, concurrency)
+        _report(level)
+        output['levels'].append(level)
+
+    peak = max(output['levels'], key=lambda level: level['throughput'] or 0)
+    print(
+        f"peak throughput {peak['throughput']:.1f} req/s at concurrency {peak['concurrency']}",
+        file=sys.stderr,
+    )
+
+    if args.output == '-':
+        json.dump(output, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        with open(args.output, 'w') as file:
+            json.dump(output, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+"""
+Benchmark runner.
+
+    python -m benchmarks.run --rows 1000 10000 100000 --output results.json
+
+For every row count a CSV is generated (see generate.py) and every
+scenario of the backend (backend.py) and desktop (desktop.py) groups runs
+`warmup` untimed times, then `repeat` timed times. Setup, e.g. clearing
+caches, is never timed. Results are written as JSON:
+
+    {"version": 1, "meta": {"git_commit": ..., "packages": {...}, ...},
+     "results": [
+        {"group": "backend", "scenario": "summary", "rows": 10000,
+         "times": [...], "seconds": {"min", "median", "mean", "max", "stdev"},
+         "rows_per_second": ..., "bytes": ...},
+        {"group": "desktop", "scenario": "table_update", "rows": 1000000,
+         "skipped": "more than 100000 rows"}
+     ]}
+
+Compare two result files with `python -m benchmarks.compare`.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from importlib import metadata
+from pathlib import Path
+
+from . import backend, desktop
+from .generate import add_arguments, generate_frame, iter_blocks, write_csv
+
+RESULTS_VERSION = 1
+DEFAULT_ROWS = [1000, 10000, 100000]
+GROUPS = ['backend', 'desktop']
+PACKAGES = ['django', 'djangorestframework', 'pandas', 'numpy', 'pyarrow', 'reportlab', 'PyQt5', 'matplotlib']
+
+
+def measure(run, setup=None, repeat=5, warmup=1):
+    """Time run() repeat times, returns (times, what the last run returned)"""
+    times = []
+    extra = {}
+    for attempt in range(warmup + repeat):
+        if setup is not None:
+            setup()
+        gc.collect()
+        start = time.perf_counter()
+        extra = run() or {}
+        elapsed = time.perf_counter() - start
+        if attempt >= warmup:
+            times.append(elapsed)
+    return times, extra
+
+
+def run_scenarios(group, scenarios, rows, args):
+    results = []
+    for name, setup, run, skip in scenarios:
+        if args.scenario and name not in args.scenario:
+            continue
+
+        result = {'group': group, 'scenario': name, 'rows': rows}
+        if skip:
+            result['skipped'] = skip
+        else:
+            try:
+                times, extra = measure(run, setup, args.repeat, args.warmup)
+            except Exception as e:
+                result['error'] = f'{type(e).__name__}: {e}'
+            else:
+                median = statistics.median(times)
+                result.update({
+                    'repeat': args.repeat,
+                    'times': times,
+                    'seconds': {
+                        'min': min(times),
+                        'median': median,
+                        'mean': statistics.mean(times),
+                        'max': max(times),
+                        'stdev': statistics.stdev(times) if len(times) > 1 else 0.0,
+                    },
+                    'rows_per_second': rows / median if median else None,
+                    **extra,
+                })
+        _report(result)
+        results.append(result)
+    return results
+
+
+def _report(result):
+    if 'seconds' in result:
+        outcome = f"{result['seconds']['median'] * 1000:10.1f} ms"
+    else:
+        outcome = result.get('skipped') or result.get('error')
+    print(f"{result['group']:8} {result['scenario']:20} {result['rows']:>10}  {outcome}", file=sys.stderr)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=Path(__file__).parent,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _versions():
+    versions = {}
+    for package in PACKAGES:
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = None
+    return versions
+
+
+def get_meta(args):
+    return {
+        'started': datetime.now(timezone.utc).isoformat(),
+        'git_commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'packages': _versions(),
+        'args': vars(args),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time backend endpoints and desktop widgets')
+    parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_ROWS, help='dataset sizes')
+    add_arguments(parser)
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per scenario')
+    parser.add_argument('--warmup', type=int, default=1, help='untimed runs per scenario')
+    parser.add_argument('--group', choices=GROUPS, action='append', help='only these groups')
+    parser.add_argument('--scenario', action='append', help='only these scenarios')
+    parser.add_argument('-o', '--output', default='-', help="JSON path, '-' for stdout")
+    args = parser.parse_args(argv)
+    groups = args.group or GROUPS
+
+    output = {'version': RESULTS_VERSION, 'meta': get_meta(args), 'results': []}
+    results = output['results']
+
+    with tempfile.TemporaryDirectory(prefix='benchmarks-') as workdir:
+        teardown = backend.setup_django(workdir) if 'backend' in groups else None
+        try:
+            for rows in args.rows:
+                generator_args = (rows, args.types, args.nan_rate, args.seed)
+
+                if 'backend' in groups:
+                    csv_path = os.path.join(workdir, f'{rows}.csv')
+                    write_csv(csv_path, *generator_args)
+                    bench = backend.BackendBench(csv_path, rows)
+                    results += run_scenarios('backend', bench.scenarios(), rows, args)
+                    bench.clear_datasets()
+                    os.remove(csv_path)
+
+                if 'desktop' in groups:
+                    error = desktop.import_error()
+                    if error:
+                        scenarios = [(name, None, None, error) for name in desktop.SCENARIOS]
+                    else:
+                        data = None
+                        if rows <= desktop.TABLE_MAX_ROWS:
+                            data = desktop.api_rows(generate_frame(*generator_args))
+                        summary = desktop.summarize(iter_blocks(*generator_args))
+                        scenarios = desktop.DesktopBench(rows, data, summary).scenarios()
+                    results += run_scenarios('desktop', scenarios, rows, args)
+        finally:
+            if teardown is not None:
+                teardown()
+
+    if args.output == '-':
+        json.dump(output, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        with open(args.output, 'w') as file:
+            json.dump(output, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
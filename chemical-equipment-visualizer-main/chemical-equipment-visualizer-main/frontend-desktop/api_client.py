@@ -1,10 +1,54 @@
 import requests
 import json
+import os
+import shutil
+from collections import OrderedDict
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 class APIClient:
+    # Revalidatable responses kept, least recently used dropped first
+    MAX_VALIDATED = 32
+    # Larger bodies (e.g. full row listings) are fetched again instead
+    MAX_VALIDATED_BYTES = 1024 * 1024
+    
     def __init__(self, base_url="http://localhost:8000/api"):
         self.base_url = base_url
         self.session = requests.Session()
+        # Row payloads are smaller and faster to decode as MessagePack
+        if msgpack is not None:
+            self.session.headers['Accept'] = 'application/msgpack, application/json;q=0.9'
+        # (url, params) -> (ETag, payload) of responses that can be revalidated
+        self._validated = OrderedDict()
+    
+    def _decode(self, response):
+        """Decode a JSON or MessagePack response body"""
+        if msgpack is not None and response.headers.get('Content-Type', '').startswith('application/msgpack'):
+            return msgpack.unpackb(response.content)
+        return response.json()
+    
+    def _get_revalidated(self, url, params=None):
+        """GET a dataset resource, reusing the cached payload on 304 Not Modified"""
+        key = (url, tuple(sorted((params or {}).items())))
+        cached = self._validated.get(key)
+        headers = {'If-None-Match': cached[0]} if cached else {}
+        
+        response = self.session.get(url, params=params, headers=headers)
+        if cached and response.status_code == 304:
+            self._validated.move_to_end(key)
+            return cached[1]
+        response.raise_for_status()
+        
+        payload = self._decode(response)
+        self._validated.pop(key, None)
+        if response.headers.get('ETag') and len(response.content) <= self.MAX_VALIDATED_BYTES:
+            self._validated[key] = (response.headers['ETag'], payload)
+            while len(self._validated) > self.MAX_VALIDATED:
+                self._validated.popitem(last=False)
+        return payload
     
     def upload_csv(self, file_path):
         """Upload CSV file to backend"""
@@ -19,6 +63,35 @@ class APIClient:
         except requests.exceptions.RequestException as e:
             raise Exception(f"Upload failed: {str(e)}")
     
+    def bulk_upload(self, file_paths):
+        """Upload several CSV files or ZIP archives, returns one result per file"""
+        url = f"{self.base_url}/datasets/bulk_upload/"
+        
+        handles = [open(path, 'rb') for path in file_paths]
+        try:
+            files = [('files', (os.path.basename(f.name), f)) for f in handles]
+            response = self.session.post(url, files=files)
+            response.raise_for_status()
+            return response.json()['results']
+        except requests.exceptions.RequestException as e:
+            raise Exception(f"Bulk upload failed: {str(e)}")
+        finally:
+            for f in handles:
+                f.close()
+    
+    def append_csv(self, dataset_id, file_path):
+        """Append the rows of a CSV file to an existing dataset"""
+        url = f"{self.base_url}/datasets/{dataset_id}/append/"
+        
+        try:
+            with open(file_path, 'rb') as f:
+                files = {'file': f}
+                response = self.session.post(url, files=files)
+                response.raise_for_status()
+                return response.json()
+        except requests.exceptions.RequestException as e:
+            raise Exception(f"Append failed: {str(e)}")
+    
     def get_datasets(self):
         """Get list of all datasets"""
         url = f"{self.base_url}/datasets/"
@@ -30,29 +103,84 @@ class APIClient:
         except requests.exceptions.RequestException as e:
             raise Exception(f"Failed to fetch datasets: {str(e)}")
     
-    def get_dataset(self, dataset_id):
-        """Get specific dataset by ID"""
+    def get_dataset(self, dataset_id, include_data=True):
+        """Get specific dataset by ID, optionally without its rows"""
         url = f"{self.base_url}/datasets/{dataset_id}/"
+        params = {} if include_data else {'include_data': 0}
         
         try:
-            response = self.session.get(url)
+            return self._get_revalidated(url, params)
+        except requests.exceptions.RequestException as e:
+            raise Exception(f"Failed to fetch dataset: {str(e)}")
+    
+    def get_rows(self, dataset_id, offset=0, limit=100, **filters):
+        """Get a window of dataset rows
+        
+        filters are passed as query parameters, e.g. sort='Pressure',
+        order='desc', type='Pump', flowrate_min=100
+        """
+        url = f"{self.base_url}/datasets/{dataset_id}/rows/"
+        params = {'offset': offset, 'limit': limit, **filters}
+        
+        try:
+            return self._get_revalidated(url, params)
+        except requests.exceptions.RequestException as e:
+            raise Exception(f"Failed to fetch rows: {str(e)}")
+    
+    def compare_datasets(self, dataset_a_id, dataset_b_id, offset=0, limit=100, **params):
+        """Compare dataset b with dataset a
+        
+        params are passed as query parameters, e.g. status='changed',
+        sort='Pressure', top=5
+        """
+        url = f"{self.base_url}/datasets/compare/"
+        params = {'a': dataset_a_id, 'b': dataset_b_id, 'offset': offset, 'limit': limit, **params}
+        
+        try:
+            response = self.session.get(url, params=params)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
-            raise Exception(f"Failed to fetch dataset: {str(e)}")
+            raise Exception(f"Failed to compare datasets: {str(e)}")
+    
+    def get_histogram(self, dataset_id, column, bins=32, y=None, by=None):
+        """Get binned counts of column, or a 2D grid of column against y"""
+        url = f"{self.base_url}/datasets/{dataset_id}/histogram/"
+        params = {'column': column, 'bins': bins}
+        if y:
+            params['y'] = y
+        if by:
+            params['by'] = by
+        
+        try:
+            return self._get_revalidated(url, params)
+        except requests.exceptions.RequestException as e:
+            raise Exception(f"Failed to fetch histogram: {str(e)}")
     
     def download_pdf(self, dataset_id, save_path):
         """Download PDF report"""
         url = f"{self.base_url}/datasets/{dataset_id}/download_pdf/"
         
+        # Reuse the last download of this report if it is still current
+        cached = self._validated.get((url, ()))
+        headers = {}
+        if cached and os.path.exists(cached[1]):
+            headers['If-None-Match'] = cached[0]
+        
         try:
-            response = self.session.get(url, stream=True)
+            response = self.session.get(url, stream=True, headers=headers)
+            if headers and response.status_code == 304:
+                if os.path.abspath(cached[1]) != os.path.abspath(save_path):
+                    shutil.copyfile(cached[1], save_path)
+                return True
             response.raise_for_status()
             
             with open(save_path, 'wb') as f:
                 for chunk in response.iter_content(chunk_size=8192):
                     f.write(chunk)
             
+            if response.headers.get('ETag'):
+                self._validated[(url, ())] = (response.headers['ETag'], save_path)
             return True
         except requests.exceptions.RequestException as e:
             raise Exception(f"Failed to download PDF: {str(e)}")